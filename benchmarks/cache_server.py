@@ -0,0 +1,240 @@
+"""A local stand-in for the spacetime cache server.
+
+It answers GET /?q=<url>&u=<useragent> with the same cbor encoded dict the
+real cache server sends, with the page as a pickled requests.Response, so
+utils.download and utils.response work against it unchanged.
+
+Run from the project root:
+    python -m benchmarks.cache_server --port 9000 [--hosts 20 --latency 0.05]
+"""
+import pickle
+import random
+import string
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import cbor
+import requests
+
+
+def make_raw_response(url, status, content, headers=None):
+    raw = requests.models.Response()
+    raw.url = url
+    raw.status_code = status
+    raw._content = content
+    raw.headers.update(headers or {"Content-Type": "text/html"})
+    raw.encoding = "utf-8"
+    return raw
+
+
+def encode_response(url, status, content, headers=None):
+    """The body the cache server sends back for url"""
+    return cbor.dumps({
+        "url": url,
+        "status": status,
+        "response": pickle.dumps(
+            make_raw_response(url, status, content, headers))})
+
+
+class StubSite(object):
+    """Pages served by the stub, url -> (status, content, headers)"""
+
+    def __init__(self, pages=None):
+        self.pages = dict(pages or {})
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def add_page(self, url, content, status=200, headers=None):
+        self.pages[url] = (status, content, headers)
+
+    def fetch(self, url):
+        with self.lock:
+            self.requests += 1
+        if url not in self.pages:
+            return encode_response(url, 404, b"")
+        status, content, headers = self.pages[url]
+        return encode_response(url, status, content, headers)
+
+
+def letters(number):
+    """number spelled in letters (0 -> a, 26 -> ba), so synthetic urls have
+    no digits for the trap templates to collapse (see TRAP_BUDGET)"""
+    word = ""
+    while True:
+        number, digit = divmod(number, 26)
+        word = string.ascii_lowercase[digit] + word
+        if not number:
+            return word
+
+
+class SyntheticSite(StubSite):
+    """A generated site graph: `hosts` subdomains of ics.uci.edu with
+    `pages_per_host` pages each. Every page has `words_per_page` words and
+    `links_per_page` links, `local_links` of them to its own host. Pages are
+    generated on request from `seed` and the url, so any size is cheap and
+    the same seed always serves the same site.
+
+    A `thin_pages` fraction of the pages are listings, with a tenth of the
+    words and twice the links, that mostly link to other listings (like
+    tag, archive and paging pages). Crawling in a good order gets to the
+    content pages first."""
+
+    SECTIONS = ("people", "research", "courses", "news", "events", "about")
+
+    def __init__(self, hosts=10, pages_per_host=200, links_per_page=20,
+                 words_per_page=300, local_links=0.7, seed=0, thin_pages=0.0):
+        super().__init__()
+        self.hosts = [f"{letters(h)}.ics.uci.edu" for h in range(hosts)]
+        self.pages_per_host = pages_per_host
+        self.links_per_page = links_per_page
+        self.words_per_page = words_per_page
+        self.local_links = local_links
+        self.seed = seed
+        # Words are drawn uniformly and anchors are single words, so the
+        # pages are not near duplicates of each other for the simhash check.
+        self.vocabulary = [letters(w + 1000) for w in range(5000)]
+        rand = random.Random(f"{seed}:thin")
+        # The home page of a host is never thin.
+        self.thin = [
+            number for number in range(1, pages_per_host)
+            if rand.random() < thin_pages]
+        self.thin_set = frozenset(self.thin)
+
+    @property
+    def seed_urls(self):
+        return [f"https://{host}" for host in self.hosts]
+
+    @property
+    def size(self):
+        return len(self.hosts) * self.pages_per_host
+
+    def page_url(self, host, number):
+        if number == 0:
+            return f"https://{host}"
+        section = self.SECTIONS[number % len(self.SECTIONS)]
+        return f"https://{host}/{section}/{letters(number)}"
+
+    def _page_number(self, url):
+        parts = urlparse(url)
+        if parts.netloc not in self.hosts:
+            return None
+        if parts.path in {"", "/"}:
+            return 0
+        section, _, word = parts.path.strip("/").partition("/")
+        number = 0
+        for letter in word:
+            if letter not in string.ascii_lowercase:
+                return None
+            number = number * 26 + string.ascii_lowercase.index(letter)
+        if (section != self.SECTIONS[number % len(self.SECTIONS)]
+                or not 0 < number < self.pages_per_host):
+            return None
+        return number
+
+    def fetch(self, url):
+        if url in self.pages or self._page_number(url) is None:
+            return super().fetch(url)
+        with self.lock:
+            self.requests += 1
+        rand = random.Random(f"{self.seed}:{url}")
+        host = urlparse(url).netloc
+        thin = self._page_number(url) in self.thin_set
+        words = rand.choices(
+            self.vocabulary,
+            k=self.words_per_page // 10 if thin else self.words_per_page)
+        links = list()
+        for _ in range(self.links_per_page * 2 if thin else self.links_per_page):
+            target = host if rand.random() < self.local_links else rand.choice(self.hosts)
+            if thin and self.thin and rand.random() < 0.9:
+                number = rand.choice(self.thin)
+            else:
+                number = rand.randrange(self.pages_per_host)
+            links.append(self.page_url(target, number))
+        body = "".join(
+            f"<p>{' '.join(words[i:i + 30])}</p>"
+            for i in range(0, len(words), 30))
+        anchors = "".join(
+            f'<a href="{link}">{rand.choice(self.vocabulary)}</a>' for link in links)
+        content = f"<html><body>{body}{anchors}</body></html>".encode()
+        return encode_response(url, 200, content)
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive, like the real server
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes, without this every response on
+    # a kept-alive connection waits for the client's delayed ack.
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        query = parse_qs(urlparse(self.path).query)
+        if "q" not in query:
+            self.send_error(400, "missing q")
+            return
+        if self.server.latency or self.server.jitter:
+            time.sleep(
+                self.server.latency + random.uniform(0, self.server.jitter))
+        body = self.server.site.fetch(query["q"][0])
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The crawler hung up on a response over its size limit.
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CacheServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, site, host="127.0.0.1", port=0, latency=0.0, jitter=0.0):
+        """Every response is delayed by latency plus up to jitter seconds"""
+        super().__init__((host, port), CacheRequestHandler)
+        self.site = site
+        self.latency = latency
+        self.jitter = jitter
+
+    @property
+    def address(self):
+        """(host, port), what config.cache_server expects"""
+        return self.server_address[:2]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--pages-per-host", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--thin-pages", type=float, default=0.0)
+    args = parser.parse_args()
+    site = SyntheticSite(
+        args.hosts, args.pages_per_host, seed=args.seed,
+        thin_pages=args.thin_pages)
+    site.add_page(
+        "https://www.ics.uci.edu",
+        b"<html><body><p>stub cache server</p></body></html>")
+    server = CacheServer(
+        site, args.host, args.port, args.latency, args.jitter)
+    print(f"Seed urls: {','.join(site.seed_urls)}")
+    print(f"Serving on {server.address}")
+    server.serve_forever()
@@ -0,0 +1,250 @@
+"""Runs the Crawler end to end against a local stand-in cache server and
+reports pages per second, CPU time per page, peak RSS and the size of the
+frontier over time.
+
+Run from the project root:
+    python -m benchmarks.crawl_benchmark [--hosts 10 --pages-per-host 200]
+        [--latency 0.02] [-o "LOCAL PROPERTIES.MODE=pipelined" ...]
+        [--thin-pages 0.5 --max-downloads 1000]
+
+With --max-downloads the crawl stops after that many downloads, and the
+number of content pages (recorded with at least --content-tokens tokens)
+per thousand downloads tells how good the crawl order is (see
+benchmarks.frontier_order).
+
+Settings come from config.ini, -o overrides them. The crawl runs in a
+temporary directory (--workdir to keep it), from the seeds of the
+synthetic site, with POLITENESS 0 unless overridden, so it measures the
+crawler and not the politeness delay. --cache-server host:port crawls
+through an already running server instead (see benchmarks.cache_server).
+"""
+import csv
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from configparser import ConfigParser
+from functools import partial
+from threading import Event, Lock, Thread
+
+from benchmarks.cache_server import CacheServer, SyntheticSite
+from crawler import Crawler
+from crawler.frontier import Frontier
+from crawler.metrics import METRICS
+from utils.config import Config
+
+
+def current_rss():
+    """Resident memory of this process in bytes"""
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def peak_rss():
+    """Peak resident memory in bytes (the largest of this process and its
+    children, for pipelined mode)"""
+    peaks = [
+        resource.getrusage(who).ru_maxrss
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)]
+    # kilobytes on Linux, bytes on macOS
+    return max(peaks) * (1 if sys.platform == "darwin" else 1024)
+
+
+def cpu_seconds():
+    return sum(
+        usage.ru_utime + usage.ru_stime
+        for usage in map(resource.getrusage, (
+            resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)))
+
+
+def load_config(config_file, overrides, seed_urls, cache_server):
+    cparser = ConfigParser()
+    cparser.read(config_file)
+    cparser["CRAWLER"]["SEEDURL"] = ",".join(seed_urls)
+    cparser["CRAWLER"]["POLITENESS"] = "0"
+    for override in overrides:
+        key, _, value = override.partition("=")
+        section, _, option = key.rpartition(".")
+        cparser[section][option] = value
+    config = Config(cparser)
+    config.cache_server = cache_server
+    return config
+
+
+class BudgetedFrontier(Frontier):
+    """Hands out at most `max_downloads` urls, then ends the crawl"""
+
+    def __init__(self, config, restart, max_downloads):
+        self.budget = max_downloads
+        self.budget_lock = Lock()
+        super().__init__(config, restart)
+
+    def get_tbd_url(self, timeout=None):
+        with self.budget_lock:
+            if not self.budget:
+                return None
+            self.budget -= 1
+        url = super().get_tbd_url(timeout)
+        if url is None:
+            with self.budget_lock:
+                self.budget += 1
+        return url
+
+
+def content_pages(url_file, min_tokens):
+    """Recorded pages with at least min_tokens tokens"""
+    if not os.path.exists(url_file):
+        return 0
+    with open(url_file, newline="") as rows:
+        return sum(
+            1 for _, token_count in csv.reader(rows)
+            if int(token_count) >= min_tokens)
+
+
+class Sampler(Thread):
+    """Records (seconds, pages, urls to download, urls discovered, rss) every
+    `interval` seconds while the crawl runs"""
+
+    def __init__(self, crawler, interval):
+        super().__init__(daemon=True)
+        self.crawler = crawler
+        self.interval = interval
+        self.samples = list()
+        self.stopped = Event()
+        self.start_time = time.monotonic()
+
+    def sample(self):
+        frontier = self.crawler.frontier
+        self.samples.append((
+            round(time.monotonic() - self.start_time, 3),
+            METRICS.count("pages"),
+            len(frontier.to_be_downloaded),
+            len(frontier.save),
+            current_rss()))
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sample()
+
+
+def run(args):
+    server = None
+    if args.cache_server:
+        host, _, port = args.cache_server.rpartition(":")
+        cache_server = (host, int(port))
+        seed_urls = SyntheticSite(args.hosts, args.pages_per_host, seed=args.seed).seed_urls
+    else:
+        site = SyntheticSite(
+            args.hosts, args.pages_per_host, args.links_per_page,
+            args.words_per_page, seed=args.seed, thin_pages=args.thin_pages)
+        server = CacheServer(
+            site, latency=args.latency, jitter=args.jitter).start()
+        cache_server = server.address
+        seed_urls = site.seed_urls
+    config_file = os.path.abspath(args.config_file)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="crawl_benchmark_")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    config = load_config(config_file, args.override, seed_urls, cache_server)
+
+    start = time.monotonic()
+    start_cpu = cpu_seconds()
+    frontier_factory = Frontier
+    if args.max_downloads:
+        frontier_factory = partial(
+            BudgetedFrontier, max_downloads=args.max_downloads)
+    crawler = Crawler(config, restart=True, frontier_factory=frontier_factory)
+    sampler = Sampler(crawler, args.sample_interval)
+    sampler.start()
+    crawler.start_async()
+    for worker in crawler.workers:
+        worker.join()
+    # The last sample reads the frontier, which join() closes.
+    sampler.stop()
+    crawler.join()
+    elapsed = time.monotonic() - start
+    cpu = cpu_seconds() - start_cpu
+    if server:
+        server.stop()
+
+    pages = METRICS.count("pages")
+    downloads = METRICS.count("downloads")
+    content = content_pages(config.url_file, args.content_tokens)
+    return {
+        "mode": config.crawler_mode,
+        "threads": config.threads_count,
+        "order": config.frontier_order,
+        "downloads": downloads,
+        "pages": pages,
+        "content_pages": content,
+        "content_pages_per_1000_downloads": round(
+            content / max(downloads, 1) * 1000, 1),
+        "seconds": round(elapsed, 3),
+        "pages_per_second": round(pages / elapsed, 2),
+        "downloads_per_second": round(downloads / elapsed, 2),
+        "cpu_ms_per_page": round(cpu / max(pages, 1) * 1000, 3),
+        "peak_rss_mb": round(peak_rss() / 2 ** 20, 1),
+        "workdir": workdir,
+        "timeline": [
+            dict(zip(("seconds", "pages", "to_download", "discovered", "rss_mb"),
+                     sample[:4] + (round(sample[4] / 2 ** 20, 1),)))
+            for sample in sampler.samples],
+    }
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("-o", "--override", action="append", default=[],
+                        help='"SECTION.OPTION=value", may be repeated')
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--pages-per-host", type=int, default=200)
+    parser.add_argument("--links-per-page", type=int, default=20)
+    parser.add_argument("--words-per-page", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--thin-pages", type=float, default=0.0,
+                        help="fraction of low content listing pages")
+    parser.add_argument("--max-downloads", type=int, default=0,
+                        help="stop after this many downloads (0: crawl all)")
+    parser.add_argument("--content-tokens", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds added to every cache server response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--cache-server", type=str, default=None)
+    parser.add_argument("--workdir", type=str, default=None)
+    parser.add_argument("--sample-interval", type=float, default=1.0)
+    parser.add_argument("--json", type=str, default=None,
+                        help="also write the results to this file")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    results = run(args)
+    print(f"{results['mode']} x{results['threads']}: "
+          f"{results['pages']} pages ({results['downloads']} downloads) "
+          f"in {results['seconds']}s")
+    print(f"{results['order']} order: {results['content_pages']} content pages, "
+          f"{results['content_pages_per_1000_downloads']} per 1000 downloads")
+    print(f"{results['pages_per_second']} pages/s, "
+          f"{results['cpu_ms_per_page']} ms CPU per page, "
+          f"peak RSS {results['peak_rss_mb']} MB")
+    print(f"{'seconds':>8} {'pages':>8} {'to_download':>12} {'discovered':>11} {'rss_mb':>7}")
+    for sample in results["timeline"]:
+        print(f"{sample['seconds']:>8} {sample['pages']:>8} "
+              f"{sample['to_download']:>12} {sample['discovered']:>11} "
+              f"{sample['rss_mb']:>7}")
+    if args.json:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""Compares crawl orders on the same download budget: how many content pages
+each one gets per thousand downloads from a synthetic site where half the
+pages are thin listings.
+
+Run from the project root:
+    python -m benchmarks.frontier_order [--max-downloads 1000 --thin-pages 0.5]
+        [-o "LOCAL PROPERTIES.THREADCOUNT=8" ...]
+
+Every order runs benchmarks.crawl_benchmark in its own process, so their
+metrics do not mix.
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from argparse import ArgumentParser
+
+# (name, crawl_benchmark overrides)
+ORDERS = (
+    ("fifo", ["CRAWLER.FRONTIER_ORDER=fifo"]),
+    ("priority content", [
+        "CRAWLER.FRONTIER_ORDER=priority", "CRAWLER.SCORER=content"]),
+    ("priority breadth_first", [
+        "CRAWLER.FRONTIER_ORDER=priority", "CRAWLER.SCORER=breadth_first"]),
+)
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("-o", "--override", action="append", default=[],
+                        help='"SECTION.OPTION=value", may be repeated')
+    parser.add_argument("--hosts", type=int, default=10)
+    parser.add_argument("--pages-per-host", type=int, default=300)
+    parser.add_argument("--thin-pages", type=float, default=0.5)
+    parser.add_argument("--max-downloads", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'order':<24} {'downloads':>9} {'pages':>6} "
+          f"{'content':>8} {'per 1000':>9} {'seconds':>8}")
+    for name, overrides in ORDERS:
+        with tempfile.TemporaryDirectory(prefix="frontier_order_") as workdir:
+            results_file = os.path.join(workdir, "results.json")
+            command = [
+                sys.executable, "-m", "benchmarks.crawl_benchmark",
+                "--config_file", os.path.abspath(args.config_file),
+                "--hosts", str(args.hosts),
+                "--pages-per-host", str(args.pages_per_host),
+                "--thin-pages", str(args.thin_pages),
+                "--max-downloads", str(args.max_downloads),
+                "--seed", str(args.seed),
+                "--workdir", os.path.join(workdir, "crawl"),
+                "--json", results_file]
+            for override in ["LOCAL PROPERTIES.LOG_LEVEL=WARNING"] + overrides + args.override:
+                command += ["-o", override]
+            subprocess.run(
+                command, check=True, stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL)
+            with open(results_file) as json_file:
+                results = json.load(json_file)
+        print(f"{name:<24} {results['downloads']:>9} {results['pages']:>6} "
+              f"{results['content_pages']:>8} "
+              f"{results['content_pages_per_1000_downloads']:>9} "
+              f"{results['seconds']:>8}")
+
+
+if __name__ == "__main__":
+    main()
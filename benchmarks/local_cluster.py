@@ -0,0 +1,103 @@
+"""Runs a distributed crawl on this machine: a local stand-in cache server
+serving a synthetic site, and N launch.py processes that split the hosts
+between them (see crawler/distributed.py).
+
+Run from the project root:
+    python -m benchmarks.local_cluster --nodes 3 [--hosts 12 --latency 0.01]
+        [-o "LOCAL PROPERTIES.THREADCOUNT=2" ...]
+
+Every node runs in its own directory under --workdir (node-0, node-1...),
+with its own config.ini, save file, reports and logs.
+"""
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from configparser import ConfigParser
+
+from benchmarks.cache_server import CacheServer, SyntheticSite
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def write_node_configs(config_file, overrides, seed_urls, nodes, workdir):
+    """One directory and config.ini per node, returns the directories"""
+    directories = list()
+    for node_id in range(len(nodes)):
+        cparser = ConfigParser()
+        cparser.read(config_file)
+        cparser["CRAWLER"]["SEEDURL"] = ",".join(seed_urls)
+        cparser["CRAWLER"]["POLITENESS"] = "0"
+        cparser["LOCAL PROPERTIES"]["NODES"] = ",".join(
+            f"{host}:{port}" for host, port in nodes)
+        cparser["LOCAL PROPERTIES"]["NODE_ID"] = str(node_id)
+        for override in overrides:
+            key, _, value = override.partition("=")
+            section, _, option = key.rpartition(".")
+            cparser[section][option] = value
+        directory = os.path.join(workdir, f"node-{node_id}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "config.ini"), "w") as node_config:
+            cparser.write(node_config)
+        directories.append(directory)
+    return directories
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("-o", "--override", action="append", default=[],
+                        help='"SECTION.OPTION=value", may be repeated')
+    parser.add_argument("--hosts", type=int, default=12)
+    parser.add_argument("--pages-per-host", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--workdir", type=str, default=None)
+    args = parser.parse_args()
+
+    site = SyntheticSite(args.hosts, args.pages_per_host, seed=args.seed)
+    server = CacheServer(site, latency=args.latency).start()
+    host, port = server.address
+    nodes = [("127.0.0.1", free_port()) for _ in range(args.nodes)]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="local_cluster_")
+    directories = write_node_configs(
+        os.path.abspath(args.config_file), args.override, site.seed_urls,
+        nodes, workdir)
+
+    start = time.monotonic()
+    processes = [
+        subprocess.Popen(
+            [sys.executable, os.path.join(PROJECT_ROOT, "launch.py"),
+             "--restart", "--config_file", "config.ini",
+             "--cache_server", f"{host}:{port}", "--node_id", str(node_id)],
+            cwd=directory, stdout=subprocess.DEVNULL,
+            stderr=open(os.path.join(directory, "stderr.log"), "w"))
+        for node_id, directory in enumerate(directories)]
+    codes = [process.wait() for process in processes]
+    elapsed = time.monotonic() - start
+    server.stop()
+
+    total = 0
+    for node_id, directory in enumerate(directories):
+        cparser = ConfigParser()
+        cparser.read(os.path.join(directory, "config.ini"))
+        url_file = os.path.join(directory, cparser["LOCAL PROPERTIES"]["URL_COUNT"])
+        pages = sum(1 for _ in open(url_file)) if os.path.exists(url_file) else 0
+        total += pages
+        print(f"node {node_id}: {pages} pages, exit code {codes[node_id]} ({directory})")
+    print(f"{total} pages of {site.size} in {elapsed:.2f}s "
+          f"({total / elapsed:.1f} pages/s), {site.requests} downloads")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Measures the throughput of utils.tokenize_string against the original
+character by character tokenizer, in MB/s. tests/test_tokenize_string.py
+checks that both give the same tokens.
+
+Run from the project root:
+    python -m benchmarks.tokenize_benchmark [word_file]
+Without a word file a synthetic corpus is used.
+"""
+import random
+import re
+import sys
+import time
+from io import StringIO
+
+from utils.tokenize_string import tokenize
+
+
+def reference_tokenize(s):
+    """The original implementation, kept here as the reference output"""
+    tokens = []
+    with StringIO(s) as stream:
+        current_token = ''
+        while True:
+            char = stream.read(1)
+            if re.match("[a-zA-Z0-9]", char):
+                current_token += char.lower()
+            else:
+                if len(current_token) > 0:
+                    tokens.append(current_token)
+                    current_token = ''
+                if len(char) == 0:
+                    break
+    return tokens
+
+
+# ascii text plus characters that are easy to get wrong: accents, the kelvin
+# sign and dotted capital I (whose lowercase forms contain ascii letters),
+# full width digits, and whitespace of every kind.
+ALPHABET = (
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    "     \t\n\r.,;:'\"!?-_/()<>&"
+    "éüßKİ１  中\U0001f600")
+
+
+def synthetic_corpus(size, seed=0):
+    rand = random.Random(seed)
+    return [
+        "".join(rand.choice(ALPHABET) for _ in range(rand.randint(0, 200)))
+        for _ in range(size)]
+
+
+def throughput(function, lines):
+    size = sum(len(line.encode("utf-8")) for line in lines) / 2 ** 20
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    return size / (time.perf_counter() - start)
+
+
+def main(word_file=None):
+    if word_file:
+        with open(word_file, "r") as words:
+            lines = words.read().splitlines()
+    else:
+        lines = synthetic_corpus(20000)
+    print(f"{len(lines)} lines")
+    print(f"reference: {throughput(reference_tokenize, lines):8.2f} MB/s")
+    print(f"tokenize:  {throughput(tokenize, lines):8.2f} MB/s")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
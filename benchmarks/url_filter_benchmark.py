@@ -0,0 +1,88 @@
+"""Compares utils.url_filter against the original regex based is_valid:
+accept/reject decisions and urls per second.
+
+Run from the project root:
+    python -m benchmarks.url_filter_benchmark [corpus]
+The corpus is a text file with one url per line, or a crawler url_file
+(csv, first column). Without one a synthetic corpus is used.
+"""
+import csv
+import random
+import re
+import sys
+import time
+from urllib.parse import urlparse
+
+from utils.url_filter import URL_FILTER
+
+
+def reference_is_valid(url):
+    """The original is_valid rules"""
+    parsed = urlparse(url)
+    if parsed.scheme not in set(["http", "https"]):
+        return False
+    if re.match(
+        r".*\.(css|js|bmp|gif|jpe?g|ico"
+        + r"|png|tiff?|mid|mp2|mp3|mp4"
+        + r"|wav|avi|mov|mpe?g|ram|m4v|mkv|ogg|ogv|pdf|war"
+        + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
+        + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|Z"
+        + r"|epub|dll|cnf|tgz|sha1|py|sql|conf|svg|tif|r|c"
+        + r"|thmx|mso|arff|rtf|jar|csv|json|java|apk|img|war|xml"
+        + r"|rm|smil|wmv|swf|wma|zip|rar|gz|txt|vmdk|php|ppsx)$"
+        + r"|.*(json|xmlrpc|mailto|\.php|.*attachment\/)"
+        + r"|.*\/(pdf|wiki|files)\/.*", parsed.path.lower()):
+        return False
+    if parsed.netloc is not None and not re.match(r".*(\.ics|\.cs|\.informatics|\.stat)\.uci\.edu", parsed.netloc):
+        return False
+    return True
+
+
+def load_corpus(path):
+    with open(path, "r", newline="") as f:
+        if path.endswith(".csv"):
+            return [row[0] for row in csv.reader(f) if row]
+        return [line.strip() for line in f if line.strip()]
+
+
+def synthetic_corpus(size, seed=0):
+    rand = random.Random(seed)
+    hosts = ["www.ics.uci.edu", "vision.ics.uci.edu", "www.cs.uci.edu",
+             "www.informatics.uci.edu", "www.stat.uci.edu", "www.uci.edu",
+             "github.com", "www.ics.uci.edu:8080"]
+    segments = ["people", "research", "~eppstein", "pubs", "2019", "events",
+                "files", "wiki", "index.php", "paper.pdf", "slides.pptx",
+                "attachment", "doku.php", "main.css", "page.html", "a.c"]
+    urls = []
+    for _ in range(size):
+        path = "/".join(rand.choice(segments) for _ in range(rand.randint(0, 4)))
+        query = f"?id={rand.randint(0, 99)}" if rand.random() < 0.2 else ""
+        scheme = rand.choice(["http", "https", "https", "mailto", "ftp"])
+        urls.append(f"{scheme}://{rand.choice(hosts)}/{path}{query}")
+    return urls
+
+
+def rate(function, urls):
+    start = time.perf_counter()
+    for url in urls:
+        function(url)
+    return len(urls) / (time.perf_counter() - start)
+
+
+def main(corpus=None):
+    urls = load_corpus(corpus) if corpus else synthetic_corpus(100000)
+    mismatches = [
+        url for url in urls
+        if reference_is_valid(url) != URL_FILTER.classify(url)[0]]
+    print(f"{len(urls)} urls, {len(mismatches)} different decisions")
+    for url in mismatches[:20]:
+        print(f"  reference={reference_is_valid(url)} filter={URL_FILTER.classify(url)} {url}")
+    print(f"reference:     {rate(reference_is_valid, urls):10.0f} urls/s")
+    print(f"classify:      {rate(URL_FILTER.classify, urls):10.0f} urls/s")
+    start = time.perf_counter()
+    URL_FILTER.classify_many(urls)
+    print(f"classify_many: {len(urls) / (time.perf_counter() - start):10.0f} urls/s")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:2])
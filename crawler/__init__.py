@@ -1,18 +1,50 @@
-from utils import get_logger
+from contextlib import ExitStack
+from functools import partial
+
+from utils import configure_logging, get_logger, stop_logging
+from crawler.distributed import DistributedFrontier
 from crawler.frontier import Frontier
+from crawler.metrics import MetricsReporter
+from crawler.pipeline import ParseStage, PipelineWorker
+from crawler.report_sink import ReportSink
 from crawler.worker import Worker
+from utils.download import get_downloader
 
 class Crawler(object):
     def __init__(self, config, restart, frontier_factory=Frontier, worker_factory=Worker):
         self.config = config
+        configure_logging(
+            config.log_mode, config.log_level, config.skip_log_every)
         self.logger = get_logger("CRAWLER")
+        if self.config.nodes and frontier_factory is Frontier:
+            # One of several crawler processes, each owning some hosts.
+            frontier_factory = DistributedFrontier
         self.frontier = frontier_factory(config, restart)
+        self.report_sink = ReportSink(config, config.report_flush_interval)
+        self.metrics_reporter = MetricsReporter(config)
         self.workers = list()
         self.worker_factory = worker_factory
+        if (self.config.download_engine == "pooled"
+                and self.config.response_cache != "replay"):
+            # Shared by the workers, created before they start and before
+            # the parse stage forks its processes.
+            get_downloader(self.config)
+        self.parse_stage = None
+        if self.config.crawler_mode == "pipelined":
+            # Workers only fetch, parsing happens in a process pool.
+            self.parse_stage = ParseStage(
+                config, self.frontier, self.report_sink)
+            self.worker_factory = partial(
+                PipelineWorker, parse_stage=self.parse_stage)
+
+    def host_states(self, throttled_only=True):
+        ''' Which hosts are slowed down or cut off, and why. '''
+        return self.frontier.host_states(throttled_only)
 
     def start_async(self):
         self.workers = [
-            self.worker_factory(worker_id, self.config, self.frontier)
+            self.worker_factory(
+                worker_id, self.config, self.frontier, self.report_sink)
             for worker_id in range(self.config.threads_count)]
         for worker in self.workers:
             worker.start()
@@ -22,5 +54,16 @@ class Crawler(object):
         self.join()
 
     def join(self):
-        for worker in self.workers:
-            worker.join()
+        ''' Waits for the workers, then closes everything even if the wait
+        is interrupted. The report sink closes before the frontier, the
+        completions it holds back are saved as it writes the reports. '''
+        with ExitStack() as closing:
+            # Called last to first, each one even if another one fails.
+            closing.callback(stop_logging)
+            closing.callback(self.frontier.close)
+            closing.callback(self.metrics_reporter.close)
+            closing.callback(self.report_sink.close)
+            if self.parse_stage:
+                closing.callback(self.parse_stage.close)
+            for worker in self.workers:
+                worker.join()
@@ -0,0 +1,286 @@
+import bisect
+import json
+import time
+from hashlib import blake2b
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+from urllib.parse import urlparse
+
+import requests
+
+from crawler.frontier import Frontier
+from crawler.metrics import METRICS
+from utils import get_logger, get_urlkey, normalize
+from utils.seen_set import SeenSet
+
+
+def _hash(value):
+    return int.from_bytes(
+        blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing(object):
+    ''' Consistent hashing of hosts onto node ids 0..nodes-1. Each node has
+    `replicas` points on the ring, so hosts spread evenly and changing the
+    number of nodes only moves about 1/nodes of them. '''
+
+    def __init__(self, nodes, replicas=64):
+        points = sorted(
+            (_hash(f"node-{node}#{replica}"), node)
+            for node in range(nodes) for replica in range(replicas))
+        self.hashes = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    def owner(self, url):
+        ''' The node that crawls url's host. '''
+        index = bisect.bisect(self.hashes, _hash(urlparse(url).netloc))
+        return self.nodes[index % len(self.nodes)]
+
+
+class Forwarder(object):
+    ''' Sends urls discovered here for hosts owned by other nodes to their
+    owners, in batches of up to `batch_size`, at least every `interval`
+    seconds. Batches that could not be delivered (the peer is not up yet,
+    or is restarting) are kept and retried. '''
+
+    def __init__(self, node_id, peers, batch_size=500, interval=0.5):
+        self.logger = get_logger("FORWARDER")
+        self.node_id = node_id
+        self.peers = peers      # node id -> "http://host:port"
+        self.batch_size = batch_size
+        self.interval = interval
+        self.lock = Lock()
+        self.buffers = {node: list() for node in peers}
+        self.forwarded = SeenSet()  # url keys already sent, owners dedupe too
+        self.sent = 0
+        self.session = requests.Session()
+        self.wakeup = Event()
+        self.closed = Event()
+        self.thread = Thread(target=self._send_loop, daemon=True)
+        self.thread.start()
+
+    @property
+    def empty(self):
+        with self.lock:
+            return not any(self.buffers.values())
+
+    def add(self, node, url, parent_url, parent_stats=None):
+        urlkey = get_urlkey(url)
+        with self.lock:
+            if urlkey in self.forwarded:
+                return
+            self.forwarded.add(urlkey)
+            self.buffers[node].append((url, parent_url, parent_stats))
+            if len(self.buffers[node]) >= self.batch_size:
+                self.wakeup.set()
+
+    def send(self):
+        ''' Sends every buffered batch, returns True if all went through. '''
+        delivered = True
+        for node, endpoint in self.peers.items():
+            with self.lock:
+                batch = self.buffers[node][:self.batch_size]
+            while batch:
+                try:
+                    response = self.session.post(
+                        f"{endpoint}/urls", timeout=10, json={
+                            "from": self.node_id, "urls": batch})
+                    response.raise_for_status()
+                except requests.RequestException as e:
+                    self.logger.debug(f"Could not reach node {node}: {e}.")
+                    delivered = False
+                    break
+                METRICS.increment("forwarded_urls", len(batch))
+                with self.lock:
+                    del self.buffers[node][:len(batch)]
+                    self.sent += len(batch)
+                    batch = self.buffers[node][:self.batch_size]
+        return delivered
+
+    def _send_loop(self):
+        while not self.closed.is_set():
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.send()
+
+    def close(self):
+        self.closed.set()
+        self.wakeup.set()
+        self.thread.join()
+        self.send()
+        self.session.close()
+
+
+class PeerServer(ThreadingHTTPServer):
+    ''' The endpoint other nodes talk to: POST /urls with forwarded urls,
+    GET /status for termination detection, POST /finished once a node has
+    found the whole crawl finished. '''
+
+    daemon_threads = True
+
+    def __init__(self, frontier, address):
+        super().__init__(address, PeerRequestHandler)
+        self.frontier = frontier
+
+
+class PeerRequestHandler(BaseHTTPRequestHandler):
+    def _reply(self, message):
+        body = json.dumps(message).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path != "/status":
+            self.send_error(404)
+            return
+        self._reply(self.server.frontier.status())
+
+    def do_POST(self):
+        if self.path == "/urls":
+            self.server.frontier.receive(self._read()["urls"])
+        elif self.path == "/finished":
+            self.server.frontier.finished.set()
+        else:
+            self.send_error(404)
+            return
+        self._reply({"ok": True})
+
+    def log_message(self, format, *args):
+        pass
+
+
+class DistributedFrontier(Frontier):
+    ''' Frontier of one of several crawler processes (config.nodes) that
+    split the crawl by host: this node only keeps, and politely crawls,
+    the hosts its node id owns on the HashRing. Urls for other hosts are
+    forwarded to their owners, and urls forwarded here are added as if
+    they were discovered here.
+
+    The crawl is finished once every node is idle (nothing queued, in
+    flight or waiting to be forwarded) and the number of urls sent and
+    received, summed over the nodes, are equal and did not change between
+    two rounds of asking. The first node to see that tells the others. '''
+
+    def __init__(self, config, restart):
+        self.node_id = config.node_id
+        self.ring = HashRing(len(config.nodes))
+        self.peers = {
+            node: f"http://{host}:{port}"
+            for node, (host, port) in enumerate(config.nodes)
+            if node != self.node_id}
+        self.forwarder = Forwarder(
+            self.node_id, self.peers, config.forward_batch,
+            config.forward_interval)
+        self.received = 0
+        self.finished = Event()
+        self.wakeup = Event()
+        self.check_lock = Lock()
+        self.last_check = 0
+        self.last_counts = None
+        self.poll_interval = config.forward_interval
+        super().__init__(config, restart)
+        host, port = config.nodes[self.node_id]
+        self.server = PeerServer(self, (host, port))
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        self.logger.info(
+            f"Node {self.node_id} of {len(config.nodes)}, serving peers "
+            f"on {host}:{port}.")
+
+    def add_url(self, url, parent_url=None):
+        url = normalize(url)
+        owner = self.ring.owner(url)
+        if owner == self.node_id:
+            super().add_url(url, parent_url)
+        else:
+            # The owner scores it (in priority order) with what is known
+            # here about the page it was found on.
+            self.forwarder.add(
+                owner, url, parent_url, self.parent_stats(parent_url))
+
+    def receive(self, urls):
+        for url, parent_url, parent_stats in urls:
+            super().add_url(url, parent_url, parent_stats)
+        with self.lock:
+            self.received += len(urls)
+        METRICS.increment("received_urls", len(urls))
+        self.wakeup.set()
+
+    def status(self):
+        with self.lock:
+            received = self.received
+        return {
+            "idle": (self.to_be_downloaded.idle() and self.forwarder.empty
+                     and not self.pending.unread),
+            "sent": self.forwarder.sent,
+            "received": received,
+            "finished": self.finished.is_set()}
+
+    def _crawl_finished(self):
+        ''' Asks every node for its status (at most once per poll interval)
+        and decides whether the whole crawl is finished. '''
+        with self.check_lock:
+            if self.finished.is_set():
+                return True
+            if time.monotonic() - self.last_check < self.poll_interval:
+                return False
+            self.last_check = time.monotonic()
+            statuses = [self.status()]
+            for endpoint in self.peers.values():
+                try:
+                    response = requests.get(f"{endpoint}/status", timeout=5)
+                    response.raise_for_status()
+                    statuses.append(response.json())
+                except requests.RequestException:
+                    self.last_counts = None
+                    return False
+            if any(status["finished"] for status in statuses):
+                self.finished.set()
+                return True
+            counts = (
+                sum(status["sent"] for status in statuses),
+                sum(status["received"] for status in statuses))
+            if (not all(status["idle"] for status in statuses)
+                    or counts[0] != counts[1]):
+                self.last_counts = None
+                return False
+            if counts != self.last_counts:
+                self.last_counts = counts
+                return False
+            self.finished.set()
+        for endpoint in self.peers.values():
+            try:
+                requests.post(f"{endpoint}/finished", timeout=5)
+            except requests.RequestException:
+                pass
+        return True
+
+    def get_tbd_url(self, timeout=None):
+        ''' Like Frontier.get_tbd_url, but only returns None once the whole
+        crawl is finished (or the timeout expires). '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            url = super().get_tbd_url(self.poll_interval)
+            if url is not None:
+                return url
+            if self._crawl_finished():
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            self.wakeup.wait(self.poll_interval)
+            self.wakeup.clear()
+
+    def close(self):
+        self.forwarder.close()
+        self.logger.info(
+            f"Node {self.node_id}: forwarded {self.forwarder.sent} urls, "
+            f"received {self.received}.")
+        self.server.shutdown()
+        self.server.server_close()
+        super().close()
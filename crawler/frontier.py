@@ -1,39 +1,120 @@
 import os
-import shelve
-from queue import Empty, Queue
-from threading import RLock, Thread
+import time
+from collections import Counter
+from contextlib import ExitStack
+from threading import RLock
+from urllib.parse import urlparse
 
-from scraper import is_valid
-from utils import get_logger, get_urlhash, normalize
+import scraper
+from crawler.metrics import METRICS
+from crawler.parent_index import ParentIndex
+from crawler.pending_queue import PendingQueue
+from crawler.priority import SCORERS, Link
+from crawler.robots import get_robots_cache, iter_sitemap
+from crawler.scheduler import HostScheduler, HostTask, PriorityHostScheduler
+from crawler.store import open_store, side_file, store_files
+from utils import get_logger, get_urlkey, normalize
+from utils.download import DOWNLOAD_ERROR_STATUS, download
+from utils.path_template import TrapDetector
+from utils.seen_set import make_seen_set
+from utils.simhash import NearDuplicateIndex
+from utils.url_filter import URL_FILTER
+
+# Pending urls are loaded from the pending queue this many at a time, when
+# fewer than REFILL_THRESHOLD are waiting in the scheduler.
+LOAD_BATCH = 10000
+REFILL_THRESHOLD = 1000
+# At most this many sitemap files are read per host (sitemap indexes
+# included).
+MAX_SITEMAP_FILES = 50
+# Kinds of HostTask
+ROBOTS, SITEMAP = "robots", "sitemap"
+# Times a robots.txt download is tried while the cache server is down,
+# before its host is crawled as if it had none (see RETRY_TTL).
+ROBOTS_ATTEMPTS = 3
+# Depth below the seeds is only counted this far when scoring urls.
+MAX_SCORED_DEPTH = 50
 
 
 class Frontier(object):
     def __init__(self, config, restart):
         self.logger = get_logger("FRONTIER")
         self.config = config
-        self.to_be_downloaded = list()
+        # Urls are served in arrival order per host, or best scored first.
+        self.priority = self.config.frontier_order == "priority"
+        scheduler = PriorityHostScheduler if self.priority else HostScheduler
+        self.scorer = SCORERS[self.config.scorer]
+        self.page_stats = dict()    # urlkey -> (depth, information value, tokens)
+        self.host_urls = Counter()  # host -> urls discovered in this run
+        # Replayed downloads never reach a host (RESPONSE_CACHE = replay),
+        # there is no politeness to keep and no rate to adapt.
+        self.replay = self.config.response_cache == "replay"
+        self.to_be_downloaded = scheduler(
+            0.0 if self.replay else self.config.time_delay,
+            self.config.max_delay,
+            self.config.failure_threshold, self.config.circuit_cooldown,
+            self.config.max_probes, self.config.latency_factor, self.logger)
+        self.parents = ParentIndex(self._load_parent_entry)
+        self.seen = make_seen_set(self.config)
+        # False if urls missing from the seen set may still be in the save
+        # file (see _restore_seen_set).
+        self.seen_complete = True
+        self.lock = RLock()
+        METRICS.gauge("frontier_pending", lambda: len(self.to_be_downloaded))
+        METRICS.gauge("host_queue_depth", self.to_be_downloaded.depths)
+        METRICS.gauge("throttled_hosts", lambda: {
+            host: state["delay"]
+            for host, state in self.host_states().items()})
         
-        if not os.path.exists(self.config.save_file) and not restart:
+        save_files = store_files(self.config)
+        if not save_files and not restart:
             # Save file does not exist, but request to load save.
             self.logger.info(
                 f"Did not find save file {self.config.save_file}, "
                 f"starting from seed.")
-        elif os.path.exists(self.config.save_file) and restart:
+        elif save_files and restart:
             # Save file does exists, but request to start from seed.
             self.logger.info(
                 f"Found save file {self.config.save_file}, deleting it.")
-            os.remove(self.config.save_file)
+            for save_file in save_files:
+                os.remove(save_file)
         # Load existing save file, or create one if it does not exist.
-        self.save = shelve.open(self.config.save_file)
+        start = time.perf_counter()
+        self.save = open_store(self.config)
+        if not restart:
+            self._check_save_keys()
+        queue_file = side_file(self.config, ".queue")
+        migrate = bool(self.save) and not os.path.exists(queue_file)
+        self.pending = PendingQueue(
+            queue_file, self.config.store_flush_interval)
+        self.near_duplicates = None
+        if self.config.near_duplicate_distance >= 0:
+            self.near_duplicates = NearDuplicateIndex(
+                side_file(self.config, ".simhash"),
+                self.config.near_duplicate_distance)
+        self.traps = None
+        if self.config.trap_budget > 0:
+            self.traps = TrapDetector(
+                side_file(self.config, ".templates"), self.config.trap_budget,
+                logger=self.logger)
+        self.robots = get_robots_cache(self.config)
+        self.robots_queued = set()      # hosts whose robots.txt is queued
+        self.sitemap_files = dict()     # host -> its sitemaps queued so far
+        self.sitemap_found = Counter()  # host -> urls found in its sitemaps
         if restart:
             for url in self.config.seed_urls:
                 self.add_url(url, None)
         else:
             # Set the frontier state with contents of save file.
+            if migrate:
+                self._migrate_save_file()
+            self._restore_seen_set()
             self._parse_save_file()
             if not self.save:
                 for url in self.config.seed_urls:
                     self.add_url(url, None)
+            self.logger.info(
+                f"Resumed in {time.perf_counter() - start:.2f}s.")
 
         if not os.path.exists(self.config.url_file) and not restart:
             # Url file does not exist, but request to load save.
@@ -65,50 +146,383 @@ class Frontier(object):
             
 
     def _parse_save_file(self):
-        ''' This function can be overridden for alternate saving techniques. '''
+        ''' This function can be overridden for alternate saving techniques.
+        Only the first batch of pending urls is loaded here, the rest is
+        loaded by get_tbd_url as the scheduler runs low. '''
         total_count = len(self.save) 
-        tbd_count = 0
-        for url, completed, _ in self.save.values():
-            if not completed and is_valid(url, self.config, self.logger):
-                self.to_be_downloaded.append(url)
-                tbd_count += 1
+        tbd_count = self._load_pending()
         self.logger.info(
-            f"Found {tbd_count} urls to be downloaded from {total_count} "
-            f"total urls discovered.")
+            f"Loaded {tbd_count} urls to be downloaded from {total_count} "
+            f"total urls discovered"
+            f"{', more to come' if self.pending.unread else ''}.")
 
-    def get_tbd_url(self):
-        try:
-            return self.to_be_downloaded.pop()
-        except IndexError:
+    def _migrate_save_file(self):
+        ''' Save files from before the pending queue: queue their pending
+        urls once, with a full scan. '''
+        self.logger.info(
+            f"No pending queue for {self.config.save_file}, building it.")
+        for url, completed, _ in self.save.values():
+            if not completed:
+                self.pending.append(url)
+        self.pending.flush()
+        self.pending.close()
+        self.pending = PendingQueue(
+            side_file(self.config, ".queue"),
+            self.config.store_flush_interval)
+
+    def _check_save_keys(self):
+        ''' Save files from before the 64 bit url keys are keyed by 64 hex
+        digit SHA-256 hashes, none of which would ever be found again. '''
+        for urlhash in self.save.keys():
+            if len(urlhash) != 16:
+                self.save.close()
+                raise RuntimeError(
+                    f"Save file {self.config.save_file} uses the url keys "
+                    f"of an older version of the crawler and cannot be "
+                    f"resumed, run with --restart.")
+            # The first key tells, they are all of the same kind.
+            break
+
+    def _restore_seen_set(self):
+        ''' The keys of the save file are not read. A bloom filter saved by
+        the last run is loaded as is, otherwise the seen set starts empty
+        and the urls it misses are looked up in the save file. '''
+        self.seen_complete = self.seen.restore(
+            side_file(self.config, ".seen"))
+
+    def _load_pending(self):
+        ''' Moves pending urls left by a previous run to the scheduler,
+        until some are loaded or none are left. Returns how many. '''
+        loaded = 0
+        with self.lock:
+            while not loaded and self.pending.unread:
+                for url in self.pending.read(LOAD_BATCH):
+                    urlkey = get_urlkey(url)
+                    urlhash = f"{urlkey:016x}"
+                    if (urlhash not in self.save or self.save[urlhash][1]
+                            or not scraper.is_valid(
+                                url, self.config, self.logger)):
+                        self.pending.complete(url)
+                        continue
+                    if self._queue(url, self._score(url, urlkey)):
+                        loaded += 1
+        return loaded
+
+    def _load_parent_entry(self, urlkey):
+        ''' Loader of the parent index: (url, parent key) from the save. '''
+        urlhash = f"{urlkey:016x}"
+        if urlhash not in self.save:
             return None
+        url, _, parent = self.save[urlhash]
+        return url, get_urlkey(normalize(parent)) if parent else None
+
+    def _is_seen(self, urlkey):
+        urlhash = f"{urlkey:016x}"
+        if urlkey in self.seen:
+            # A bloom filter can be wrong about a hit, the save file is not.
+            return self.seen.exact or urlhash in self.save
+        if self.seen_complete or urlhash not in self.save:
+            return False
+        # Found by a previous run, the seen set knows it from now on.
+        self.seen.add(urlkey)
+        return True
+
+    def get_tbd_url(self, timeout=None):
+        ''' Blocks until a url is ready to be downloaded without breaking
+        politeness for its host. Returns None once the crawl is finished
+        (or the timeout expires). robots.txt and sitemap downloads the
+        scheduler hands out on the way are done here. '''
+        while True:
+            if (self.pending.unread
+                    and len(self.to_be_downloaded) < REFILL_THRESHOLD):
+                self._load_pending()
+            url = self.to_be_downloaded.get(timeout)
+            if isinstance(url, HostTask):
+                self._run_host_task(url)
+                continue
+            if url and not self._robots_allow(url):
+                continue
+            # The scheduler ran dry, but the previous run left more.
+            if url or timeout is not None or not self.pending.unread:
+                return url
+
+    def _robots_allow(self, url):
+        ''' Checks url against the robots.txt rules of its host, which
+        were downloaded before any of its urls (see _queue). Disallowed urls
+        are marked complete. '''
+        if self.robots is None or self.robots.allowed(url):
+            return True
+        METRICS.increment("dropped_urls", label="Disallowed by robots.txt")
+        self.mark_url_complete(url)
+        return False
+
+    def _queue(self, url, score):
+        ''' Hands url to the scheduler, behind a download of the robots.txt
+        of its host if its rules are not known (or expired). Returns False
+        if url was dropped because its host is down. '''
+        if self.robots is not None:
+            parsed = urlparse(url)
+            host = parsed.netloc
+            with self.lock:
+                queue_robots = not (
+                    host in self.robots_queued or self.robots.fresh(host))
+                if queue_robots:
+                    self.robots_queued.add(host)
+            if queue_robots and not self.to_be_downloaded.put_task(HostTask(
+                    ROBOTS, f"{parsed.scheme}://{host}/robots.txt", host)):
+                with self.lock:
+                    self.robots_queued.discard(host)
+        if not self.to_be_downloaded.put(url, score):
+            # Its host is down.
+            self.pending.complete(url)
+            return False
+        return True
+
+    def _run_host_task(self, task):
+        ''' Downloads the robots.txt or sitemap of a HostTask, in the
+        politeness slot the scheduler gave it. The urls of its host wait
+        until it is done. '''
+        retry = False
+        try:
+            if task.kind == SITEMAP and self._sitemaps_done(task.site):
+                return
+            start = time.perf_counter()
+            resp = download(task.url, self.config, self.logger)
+            seconds = time.perf_counter() - start
+            self.report_download(task.url, resp.status, seconds)
+            if (task.kind == ROBOTS and resp.status == DOWNLOAD_ERROR_STATUS
+                    and task.attempts < ROBOTS_ATTEMPTS):
+                # The cache server is down, not the host. Try again once
+                # it is back, still ahead of the urls of the host.
+                task.attempts += 1
+                retry = self.to_be_downloaded.put_task(task)
+            elif task.kind == ROBOTS:
+                self._robots_fetched(task, resp)
+            else:
+                self._sitemap_fetched(task, resp)
+        except Exception:
+            self.logger.exception(f"Failed to download {task.url}.")
+        finally:
+            if task.kind == ROBOTS and not retry:
+                with self.lock:
+                    self.robots_queued.discard(task.site)
+            self.to_be_downloaded.task_done(task)
+
+    def _robots_fetched(self, task, resp):
+        ''' Applies a fresh robots.txt: its crawl-delay, and its sitemaps,
+        which are queued as the next tasks of the host. '''
+        rules = self.robots.update(task.url, resp)
+        host = task.site
+        if not self.replay:
+            if rules.delay > self.config.time_delay:
+                self.logger.info(
+                    f"Host {host} asks for a crawl-delay of {rules.delay}s.")
+            self.to_be_downloaded.set_floor(host, rules.delay)
+        if self.config.sitemap_urls > 0:
+            for sitemap in rules.sitemaps:
+                self._queue_sitemap(host, sitemap)
+
+    def _queue_sitemap(self, host, sitemap):
+        ''' Queues the download of a sitemap of host, unless it was
+        already, or host is out of sitemap files or urls. Sitemaps outside
+        the allowed domains, or disallowed by robots.txt, are skipped. '''
+        accepted, reason = URL_FILTER.classify_host(sitemap)
+        if accepted and not self.robots.allowed(sitemap):
+            accepted, reason = False, "robots.txt"
+        if not accepted:
+            METRICS.increment("skipped_sitemaps", label=f"Rejected by {reason} rule")
+            return
+        with self.lock:
+            queued = self.sitemap_files.setdefault(host, set())
+            if (sitemap in queued or len(queued) >= MAX_SITEMAP_FILES
+                    or self._sitemaps_done(host)):
+                return
+            queued.add(sitemap)
+        self.to_be_downloaded.put_task(HostTask(SITEMAP, sitemap, host))
+
+    def _sitemaps_done(self, host):
+        return self.sitemap_found[host] >= self.config.sitemap_urls
+
+    def _sitemap_fetched(self, task, resp):
+        ''' Adds the urls listed in a sitemap, and queues the sitemaps of
+        a sitemap index, up to config.sitemap_urls urls for its host. '''
+        if resp.status != 200 or resp.raw_response is None:
+            return
+        found = 0
+        for kind, loc in iter_sitemap(
+                resp.raw_response.content or b"",
+                self.config.max_response_size):
+            if kind == "sitemap":
+                self._queue_sitemap(task.site, loc)
+            elif scraper.is_valid(loc, self.config, self.logger):
+                self.add_url(loc)
+                found += 1
+                with self.lock:
+                    self.sitemap_found[task.site] += 1
+                    if self._sitemaps_done(task.site):
+                        break
+        METRICS.increment("sitemap_urls", found)
+        self.logger.info(f"Found {found} urls in sitemap {task.url}.")
 
-    def add_url(self, url, parent_url=None):
+    def add_url(self, url, parent_url=None, parent_stats=None):
+        ''' parent_stats are those of note_page, for urls found on another
+        node's page (see crawler.distributed). '''
+        with METRICS.timer("frontier_add_seconds"):
+            self._add_url(url, parent_url, parent_stats)
+
+    def _add_url(self, url, parent_url, parent_stats):
         url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            self.save[urlhash] = (url, False, parent_url)
-            self.save.sync()
-            self.to_be_downloaded.append(url)
+        urlkey = get_urlkey(url)
+        score = None
+        with self.lock:
+            if self._is_seen(urlkey):
+                return
+            if self.traps is not None and not self.traps.admit(url):
+                # Not marked as seen, a larger TRAP_BUDGET lets it in later.
+                METRICS.increment("skipped_links", label="Path template over budget")
+                return
+            self.seen.add(urlkey)
+            self.save[f"{urlkey:016x}"] = (url, False, parent_url)
+            self.pending.append(url)
+            parent_key = get_urlkey(normalize(parent_url)) if parent_url else None
+            self.parents.add(urlkey, url, parent_key)
+            if self.priority:
+                score = self._score(
+                    url, urlkey,
+                    parent_stats or self.page_stats.get(parent_key))
+        self._queue(url, score)
+
+    def note_page(self, url, page, depth):
+        ''' Remembers how good the page of url (being scraped, `depth`
+        levels below the seeds) is, to score the links found on it. '''
+        if not self.priority:
+            return
+        with self.lock:
+            self.page_stats[get_urlkey(normalize(url))] = (
+                depth, page.information_value, page.token_count)
+
+    def parent_stats(self, parent_url):
+        ''' What note_page remembered about parent_url, if anything. '''
+        if not self.priority or not parent_url:
+            return None
+        with self.lock:
+            return self.page_stats.get(get_urlkey(normalize(parent_url)))
+
+    def _score(self, url, urlkey, parent_stats=None):
+        ''' Scores a url that is about to be queued, in priority order.
+        Urls without parent stats (seeds and urls left by a previous run)
+        get their depth from the parent index. '''
+        if not self.priority:
+            return None
+        host = urlparse(url).netloc
+        host_urls = self.host_urls[host]
+        self.host_urls[host] += 1
+        if parent_stats is None:
+            link = Link(
+                url, self.parents.depth(urlkey, MAX_SCORED_DEPTH),
+                host_urls=host_urls)
+        else:
+            depth, information_value, token_count = parent_stats
+            link = Link(
+                url, depth + 1, information_value, token_count, host_urls)
+        return self.score_link(link)
+
+    def score_link(self, link):
+        ''' The priority of a new url (crawler.priority.Link), higher is
+        downloaded sooner. Uses the SCORER of the config. '''
+        return self.scorer(link)
     
     def get_parent(self, url):
         url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            raise
-        return self.save[urlhash][2]
+        urlkey = get_urlkey(url)
+        with self.lock:
+            if urlkey not in self.parents:
+                raise KeyError(url)
+            return self.parents.parent(urlkey)
+
+    def get_ancestors(self, url, depth):
+        ''' The url and up to `depth` of its ancestors, as a set. '''
+        url = normalize(url)
+        urlkey = get_urlkey(url)
+        with self.lock:
+            if urlkey not in self.parents:
+                return frozenset([url])
+            return self.parents.ancestors(urlkey, depth)
     
     def exists_in_shelf(self, url):
         url = normalize(url)
-        urlhash = get_urlhash(url)
-        return urlhash in self.save
+        urlkey = get_urlkey(url)
+        with self.lock:
+            return self._is_seen(urlkey)
 
-    def mark_url_complete(self, url):
-        url = normalize(url)
-        urlhash = get_urlhash(url)
-        if urlhash not in self.save:
-            # This should not happen.
-            self.logger.error(
-                f"Completed url {url}, but have not seen it before.")
+    def report_download(self, url, status, seconds=None):
+        ''' Lets the scheduler adapt the rate of url's host: server errors
+        count as failures of the host. A cache server that cannot be
+        reached is not the host's fault, it pauses every host instead.
+        Nothing is adapted when replaying. '''
+        if self.replay:
+            return
+        if status == DOWNLOAD_ERROR_STATUS:
+            self.to_be_downloaded.report_outage()
+            return
+        dropped = self.to_be_downloaded.report(
+            normalize(url), 500 <= status < 600, seconds)
+        for dropped_url in dropped:
+            self.pending.complete(dropped_url)
+
+    def host_states(self, throttled_only=True):
+        ''' Rate control state of the hosts (see crawler.scheduler), by
+        default only of those slowed down or cut off. '''
+        return self.to_be_downloaded.host_states(throttled_only)
+
+    def mark_url_complete(self, url, report_sink=None):
+        ''' Releases url's host right away. The completion is only saved
+        once report_sink (if given) has written the report of url, so a
+        crawler that dies in between downloads url again instead of losing
+        its report. '''
+        with METRICS.timer("frontier_mark_seconds"):
+            url = normalize(url)
+            with self.lock:
+                self.page_stats.pop(get_urlkey(url), None)
+            self.to_be_downloaded.task_done()
+            if report_sink is None:
+                self._save_complete(url)
+            else:
+                report_sink.after_flush(self._save_complete, url)
 
-        self.save[urlhash] = (url, True, self.save[urlhash][2])
-        self.save.sync()
+    def _save_complete(self, url):
+        urlhash = f"{get_urlkey(url):016x}"
+        with self.lock:
+            if urlhash not in self.save:
+                # This should not happen.
+                self.logger.error(
+                    f"Completed url {url}, but have not seen it before.")
+            else:
+                self.save[urlhash] = (url, True, self.save[urlhash][2])
+            self.pending.complete(url)
+
+    def close(self):
+        ''' Flushes the save file, must be called once the crawl stops.
+        Every file is closed even if closing another one fails. '''
+        with ExitStack() as closing:
+            if self.traps is not None:
+                closing.callback(self._close_traps)
+            if self.near_duplicates:
+                closing.callback(self._close_near_duplicates)
+            with self.lock, ExitStack() as locked:
+                locked.callback(self.pending.close)
+                locked.callback(self.save.close)
+                if self.seen_complete:
+                    self.seen.save(side_file(self.config, ".seen"))
+
+    def _close_near_duplicates(self):
+        self.near_duplicates.close()
+        self.logger.info(
+            f"Near duplicates: skipped {self.near_duplicates.pruned_pages} "
+            f"pages and {self.near_duplicates.pruned_outlinks} outlinks.")
+
+    def _close_traps(self):
+        self.traps.close()
+        self.logger.info(
+            f"Trap templates: {self.traps.exhausted} of {len(self.traps)} "
+            f"over budget, skipped {self.traps.rejected} urls.")
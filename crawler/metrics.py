@@ -0,0 +1,243 @@
+import bisect
+import json
+import os
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Event, Lock, Thread
+
+from utils import get_logger
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class Histogram(object):
+    ''' Latencies bucketed by BUCKETS, enough for rough percentiles. '''
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        ''' Upper bound of the bucket holding the q-th quantile. '''
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count, "sum": self.sum, "max": self.max,
+            "p50": self.quantile(0.5), "p95": self.quantile(0.95),
+            "buckets": dict(zip(map(str, BUCKETS), self.counts))}
+
+
+class Metrics(object):
+    ''' Counters, latency histograms and gauges of the crawl.
+
+    Counters and histograms are updated from the hot paths, so they only
+    take a lock for a dict update. Gauges are functions (returning a number,
+    or a dict of label -> number) that are only called for a snapshot.
+    Counters can be split by a label, e.g. the reason a link was skipped. '''
+
+    def __init__(self):
+        self.lock = Lock()
+        self.counters = dict()      # name -> {label: value}
+        self.histograms = dict()    # name -> Histogram
+        self.gauges = dict()        # name -> function
+        self.started = time.monotonic()
+
+    def increment(self, name, amount=1, label=None):
+        with self.lock:
+            values = self.counters.setdefault(name, dict())
+            values[label] = values.get(label, 0) + amount
+
+    def observe(self, name, seconds):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def gauge(self, name, function):
+        self.gauges[name] = function
+
+    def count(self, name):
+        with self.lock:
+            return sum(self.counters.get(name, dict()).values())
+
+    def snapshot(self):
+        with self.lock:
+            counters = {
+                name: {str(label): value for label, value in values.items()}
+                for name, values in self.counters.items()}
+            histograms = {
+                name: histogram.snapshot()
+                for name, histogram in self.histograms.items()}
+        gauges = dict()
+        for name, function in list(self.gauges.items()):
+            value = function()
+            gauges[name] = (
+                {str(label): v for label, v in value.items()}
+                if isinstance(value, dict) else value)
+        return {
+            "uptime": time.monotonic() - self.started,
+            "counters": counters, "histograms": histograms,
+            "gauges": gauges}
+
+    def summary(self):
+        ''' One line with the numbers that show where the time goes. '''
+        snapshot = self.snapshot()
+        pages = sum(snapshot["counters"].get("pages", dict()).values())
+        parts = [f"{pages} pages ({pages / snapshot['uptime']:.1f}/s)"]
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            parts.append(
+                f"{name} p50 {histogram['p50'] * 1000:.1f}ms "
+                f"p95 {histogram['p95'] * 1000:.1f}ms")
+        for name, value in sorted(snapshot["gauges"].items()):
+            if isinstance(value, dict):
+                value = f"{sum(value.values())} over {len(value)}"
+            parts.append(f"{name} {value}")
+        for name, values in sorted(snapshot["counters"].items()):
+            if name != "pages":
+                parts.append(f"{name} {sum(values.values())}")
+        return ", ".join(parts)
+
+    def prometheus(self):
+        ''' The snapshot in the Prometheus text format. '''
+        snapshot = self.snapshot()
+        lines = list()
+        for name, values in sorted(snapshot["counters"].items()):
+            lines.append(f"# TYPE crawler_{name} counter")
+            for label, value in sorted(values.items()):
+                lines.append(f"crawler_{name}{_labels(label)} {value}")
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f"# TYPE crawler_{name} gauge")
+            values = value if isinstance(value, dict) else {"None": value}
+            for label, v in sorted(values.items()):
+                lines.append(f"crawler_{name}{_labels(label)} {v}")
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            lines.append(f"# TYPE crawler_{name} histogram")
+            total = 0
+            for bound, count in histogram["buckets"].items():
+                total += count
+                bound = "+Inf" if bound == "inf" else bound
+                lines.append(f'crawler_{name}_bucket{{le="{bound}"}} {total}')
+            lines.append(f"crawler_{name}_sum {histogram['sum']}")
+            lines.append(f"crawler_{name}_count {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path):
+        with open(f"{path}.tmp", 'w') as json_file:
+            json.dump(self.snapshot(), json_file, indent=1)
+        os.replace(f"{path}.tmp", path)
+
+
+def _labels(label):
+    if label == "None":
+        return ""
+    label = label.replace("\\", "\\\\").replace('"', '\\"')
+    return f'{{label="{label}"}}'
+
+
+# Shared by the whole crawler, like utils.url_filter.URL_FILTER.
+METRICS = Metrics()
+
+
+class MetricsReporter(object):
+    ''' Logs METRICS.summary() and rewrites the JSON file every `interval`
+    seconds, and serves the metrics on localhost:`port` (Prometheus text
+    on /metrics, JSON on /metrics.json). A port or file of 0/empty and an
+    interval of 0 turn that part off. '''
+
+    def __init__(self, config, metrics=METRICS):
+        self.logger = get_logger("METRICS")
+        self.metrics = metrics
+        self.metrics.started = time.monotonic()
+        self.interval = config.metrics_interval
+        self.file = config.metrics_file
+        self.closed = Event()
+        self.thread = None
+        if self.interval > 0:
+            self.thread = Thread(target=self._report_loop, daemon=True)
+            self.thread.start()
+        self.server = None
+        if config.metrics_port:
+            self.server = ThreadingHTTPServer(
+                ("127.0.0.1", config.metrics_port), self._handler())
+            Thread(target=self.server.serve_forever, daemon=True).start()
+            self.logger.info(
+                f"Serving metrics on http://127.0.0.1:{config.metrics_port}"
+                f"/metrics")
+
+    def _handler(self):
+        metrics = self.metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot()).encode("utf-8")
+                    content_type = "application/json"
+                elif self.path in {"/", "/metrics"}:
+                    body = metrics.prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def report(self):
+        self.logger.info(self.metrics.summary())
+        if self.file:
+            self.metrics.write_json(self.file)
+
+    def _report_loop(self):
+        while not self.closed.wait(self.interval):
+            try:
+                self.report()
+            except Exception:
+                self.logger.exception("Failed to report metrics.")
+
+    def close(self):
+        ''' Reports one last time and stops the endpoint. '''
+        self.closed.set()
+        if self.thread:
+            self.thread.join()
+        if self.interval > 0 or self.file:
+            self.report()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
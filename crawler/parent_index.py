@@ -0,0 +1,93 @@
+from array import array
+from collections import OrderedDict
+
+# parent_ids value of a url whose parent has not been loaded yet
+UNLOADED = -2
+
+
+class ParentIndex(object):
+    ''' In-memory copy of the "found on" links of the frontier. Every url
+    gets an integer id, and parent_ids[id] is the id of the page it was
+    first found on (-1 for seeds), so walking up the ancestors does not
+    touch the save file. Ancestor sets are cached since all the links of a
+    page share the same ones.
+
+    The index is filled lazily: urls that are not in it yet are fetched
+    with `loader(urlkey) -> (url, parent_key)` (None if unknown) when they
+    are first needed, so resuming a crawl does not read every url. '''
+
+    def __init__(self, loader=None, cache_size=4096):
+        self.loader = loader
+        self.ids = dict()               # urlkey -> id
+        self.urls = list()              # id -> url
+        self.parent_ids = array('q')    # id -> parent id
+        self.unloaded = dict()          # id -> parent urlkey, if UNLOADED
+        self.cache_size = cache_size
+        self.cache = OrderedDict()      # (id, depth) -> frozenset of urls
+
+    def __contains__(self, urlkey):
+        return self._id(urlkey) != -1
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, urlkey, url, parent_key=None):
+        if urlkey in self.ids:
+            return self.ids[urlkey]
+        url_id = len(self.urls)
+        self.ids[urlkey] = url_id
+        self.urls.append(url)
+        parent_id = self.ids.get(parent_key, -1)
+        if parent_id == -1 and parent_key is not None and self.loader:
+            parent_id = UNLOADED
+            self.unloaded[url_id] = parent_key
+        self.parent_ids.append(parent_id)
+        return url_id
+
+    def _id(self, urlkey):
+        ''' Id of urlkey, loading it if needed, -1 if it is unknown. '''
+        if urlkey in self.ids:
+            return self.ids[urlkey]
+        entry = self.loader(urlkey) if self.loader else None
+        if entry is None:
+            return -1
+        url, parent_key = entry
+        return self.add(urlkey, url, parent_key)
+
+    def _parent_id(self, url_id):
+        parent_id = self.parent_ids[url_id]
+        if parent_id == UNLOADED:
+            parent_id = self._id(self.unloaded.pop(url_id))
+            self.parent_ids[url_id] = parent_id
+        return parent_id
+
+    def parent(self, urlkey):
+        parent_id = self._parent_id(self._id(urlkey))
+        return self.urls[parent_id] if parent_id != -1 else None
+
+    def depth(self, urlkey, limit):
+        ''' How many ancestors urlkey has, counting at most `limit`. '''
+        depth = 0
+        parent_id = self._parent_id(self._id(urlkey))
+        while parent_id != -1 and depth < limit:
+            depth += 1
+            parent_id = self._parent_id(parent_id)
+        return depth
+
+    def ancestors(self, urlkey, depth):
+        ''' The url itself and up to `depth` of its ancestors. '''
+        url_id = self._id(urlkey)
+        key = (url_id, depth)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        found = [self.urls[url_id]]
+        parent_id = self._parent_id(url_id)
+        while parent_id != -1 and len(found) <= depth:
+            found.append(self.urls[parent_id])
+            parent_id = self._parent_id(parent_id)
+        ancestors = frozenset(found)
+        self.cache[key] = ancestors
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return ancestors
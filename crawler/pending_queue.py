@@ -0,0 +1,105 @@
+import heapq
+import os
+from threading import Event, RLock, Thread
+
+
+class PendingQueue(object):
+    ''' Durable list of the urls still to be downloaded, so a resume reads
+    only those instead of scanning every url ever discovered.
+
+    `path` is an append-only file with one url per line, in the order they
+    were added. `path.head` holds the offset of the oldest line that may
+    still be pending, everything before it is completed. On resume, lines
+    from the head on are streamed in batches with read(), as the scheduler
+    runs low. Writes are flushed every `flush_interval` seconds. '''
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.head_path = f"{path}.head"
+        self.lock = RLock()
+        head = 0
+        if os.path.exists(self.head_path):
+            with open(self.head_path, 'r') as head_file:
+                head = int(head_file.read().strip() or 0)
+        self.file = open(self.path, 'ab')
+        # Lines in [cursor, resume_end) were written by a previous run and
+        # have not been read yet. Lines after resume_end are this run's.
+        self.cursor = head
+        self.resume_end = self.file.tell()
+        self.end = self.resume_end
+        self.reader = open(self.path, 'rb')
+        self.reader.seek(self.cursor)
+        self.offsets = dict()   # pending url -> offset of its line
+        self.heap = list()      # offsets of pending and completed urls
+        self.done = set()       # offsets in heap that are completed
+        self.head = head
+        self.closed = Event()
+        self.flusher = Thread(
+            target=self._flush_loop, args=(flush_interval,), daemon=True)
+        self.flusher.start()
+
+    @property
+    def unread(self):
+        return self.cursor < self.resume_end
+
+    def _track(self, url, offset):
+        self.offsets[url] = offset
+        heapq.heappush(self.heap, offset)
+
+    def append(self, url):
+        ''' Records a newly discovered url as pending. '''
+        line = f"{url}\n".encode("utf-8")
+        with self.lock:
+            self._track(url, self.end)
+            self.file.write(line)
+            self.end += len(line)
+
+    def read(self, count):
+        ''' Up to `count` urls left pending by a previous run. '''
+        urls = list()
+        with self.lock:
+            while len(urls) < count and self.cursor < self.resume_end:
+                line = self.reader.readline()
+                if not line.endswith(b"\n"):
+                    # Torn last line of a crash, or nothing left.
+                    self.cursor = self.resume_end
+                    break
+                url = line[:-1].decode("utf-8")
+                self._track(url, self.cursor)
+                self.cursor += len(line)
+                urls.append(url)
+        return urls
+
+    def complete(self, url):
+        ''' Marks url as no longer pending (downloaded or discarded). '''
+        with self.lock:
+            offset = self.offsets.pop(url, None)
+            if offset is not None:
+                self.done.add(offset)
+
+    def flush(self):
+        with self.lock:
+            self.file.flush()
+            while self.heap and self.heap[0] in self.done:
+                self.done.remove(heapq.heappop(self.heap))
+            head = self.heap[0] if self.heap else self.end
+            if self.unread:
+                # Unread lines of the previous run are pending too.
+                head = min(head, self.cursor)
+            if head != self.head:
+                with open(f"{self.head_path}.tmp", 'w') as head_file:
+                    head_file.write(str(head))
+                os.replace(f"{self.head_path}.tmp", self.head_path)
+                self.head = head
+
+    def _flush_loop(self, interval):
+        while not self.closed.wait(interval):
+            self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        with self.lock:
+            self.flush()
+            self.file.close()
+            self.reader.close()
@@ -0,0 +1,96 @@
+import multiprocessing
+from threading import BoundedSemaphore
+
+import scraper
+from crawler.worker import Worker
+from utils import get_logger
+
+
+def _analyze(url, content, parser, fingerprint):
+    # Runs in a pool process.
+    page, links = scraper.analyze(url, content, parser)
+    if fingerprint:
+        # Computed here rather than on the result thread, where it would
+        # hold the GIL.
+        page.fingerprint
+    return page, links
+
+
+class ParseStage(object):
+    ''' Runs the CPU heavy part of scraping (parsing, tokenizing, resolving
+    links) in a pool of processes, so it is not serialized by the GIL.
+    Results come back on the pool's result thread, which records the page,
+    adds its links to the frontier and marks it complete. '''
+
+    def __init__(self, config, frontier, report_sink):
+        self.logger = get_logger("PARSER")
+        self.config = config
+        self.frontier = frontier
+        self.report_sink = report_sink
+        self.pool = multiprocessing.Pool(config.parse_processes)
+        # Bounds how many downloaded pages can wait for a parser at once.
+        self.slots = BoundedSemaphore(config.parse_processes * 4)
+
+    def submit(self, url, content, base_url=None):
+        ''' base_url is the one the page was fetched from (see
+        scraper.page_url), url by default. '''
+        self.slots.acquire()
+        self.pool.apply_async(
+            _analyze, (
+                base_url or url, content, self.config.parser,
+                self.frontier.near_duplicates is not None),
+            callback=lambda result: self._done(url, result),
+            error_callback=lambda error: self._failed(url, error))
+
+    def _done(self, url, result):
+        try:
+            page, links = result
+            scraped_urls = scraper.record_page(
+                url, page, links, self.frontier, self.logger,
+                self.report_sink)
+            for scraped_url in scraped_urls:
+                if scraper.is_valid(scraped_url, self.config, self.logger):
+                    self.frontier.add_url(scraped_url, url)
+        except Exception:
+            self.logger.exception(f"Failed to record {url}.")
+        finally:
+            self._release(url)
+
+    def _failed(self, url, error):
+        self.logger.error(f"Failed to parse {url}: {error}.")
+        self._release(url)
+
+    def _release(self, url):
+        self.frontier.mark_url_complete(url, self.report_sink)
+        self.slots.release()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+class PipelineWorker(Worker):
+    ''' Fetch only worker, hands every downloaded page to the ParseStage. '''
+
+    def __init__(self, worker_id, config, frontier, report_sink, parse_stage):
+        super().__init__(worker_id, config, frontier, report_sink)
+        self.parse_stage = parse_stage
+
+    def run(self):
+        while True:
+            tbd_url = self.frontier.get_tbd_url()
+            if not tbd_url:
+                self.logger.info("Frontier is empty. Stopping Crawler.")
+                break
+            try:
+                resp = self._fetch(tbd_url)
+                content = scraper.get_content(tbd_url, resp, self.logger)
+            except Exception:
+                self.logger.exception(f"Failed to download {tbd_url}.")
+                content = None
+            if content is None:
+                self.frontier.mark_url_complete(tbd_url, self.report_sink)
+                continue
+            # The parse stage marks the url complete once it is processed.
+            self.parse_stage.submit(
+                tbd_url, content, scraper.page_url(tbd_url, resp))
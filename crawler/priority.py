@@ -0,0 +1,58 @@
+from urllib.parse import urlparse
+
+# Information value assumed for the parent of seeds and of urls resumed from
+# a previous run, whose page is not known any more.
+NEUTRAL_VALUE = 0.5
+# A parent page with this many tokens counts as fully worth following.
+FULL_PAGE_TOKENS = 500
+# Hosts with fewer discovered urls than this get a bonus, so new
+# subdomains are reached early.
+NEW_HOST_URLS = 50
+# Every level below the seeds divides the score by 1 + DEPTH_PENALTY * depth.
+DEPTH_PENALTY = 0.25
+
+
+class Link(object):
+    ''' What is known about a newly discovered url when it is scored: the
+    url, its depth below the seeds, the information value and token count
+    of the page it was found on (None if unknown) and how many urls of its
+    host were discovered before it. '''
+
+    __slots__ = (
+        "url", "depth", "information_value", "token_count", "host_urls")
+
+    def __init__(self, url, depth=0, information_value=None,
+                 token_count=None, host_urls=0):
+        self.url = url
+        self.depth = depth
+        self.information_value = information_value
+        self.token_count = token_count
+        self.host_urls = host_urls
+
+
+def content_score(link):
+    ''' Favors links of pages with a lot of text, on hosts the crawl has
+    barely seen, close to the seeds. '''
+    if link.information_value is None:
+        value = NEUTRAL_VALUE
+    else:
+        value = link.information_value * min(
+            1.0, link.token_count / FULL_PAGE_TOKENS)
+    novelty = max(0.0, 1.0 - link.host_urls / NEW_HOST_URLS)
+    # Long query strings are mostly sorting, filtering and session
+    # variants of pages found elsewhere.
+    query_penalty = 0.1 * urlparse(link.url).query.count("&")
+    return (value + novelty - query_penalty) / (1 + DEPTH_PENALTY * link.depth)
+
+
+def breadth_first_score(link):
+    ''' Shallowest first. '''
+    return -link.depth
+
+
+# SCORER in config.ini picks one of these. Frontier subclasses can also
+# override Frontier.score_link.
+SCORERS = {
+    "content": content_score,
+    "breadth_first": breadth_first_score,
+}
@@ -0,0 +1,84 @@
+import csv
+import gzip
+from threading import Event, Lock, Thread
+
+
+def open_append(path):
+    ''' Report files ending in .gz are written gzip compressed. '''
+    if path.endswith(".gz"):
+        return gzip.open(path, 'at', newline='')
+    return open(path, 'a', newline='')
+
+
+class ReportSink(object):
+    ''' Collects the word lines and (url, token count) rows of every page
+    and appends them to the report files in batches, from a background
+    thread, every `flush_interval` seconds or once `max_buffered` lines are
+    waiting. Pages are never interleaved since each one is buffered as a
+    whole under the lock. Callbacks given to after_flush run once the pages
+    recorded before them are written. '''
+
+    def __init__(self, config, flush_interval=5.0, max_buffered=50000):
+        self.word_file = config.word_file
+        self.url_file = config.url_file
+        self.max_buffered = max_buffered
+        self.words = list()
+        self.rows = list()
+        self.callbacks = list()
+        self.writing = False
+        self.lock = Lock()
+        # Only one flush writes at a time, producers never wait for it.
+        self.write_lock = Lock()
+        self.wakeup = Event()
+        self.closed = False
+        self.writer = Thread(
+            target=self._write_loop, args=(flush_interval,), daemon=True)
+        self.writer.start()
+
+    def record_page(self, url, lines, token_count):
+        with self.lock:
+            self.words.extend(' '.join(tokens) + '\n' for tokens in lines)
+            self.rows.append((url, token_count))
+            if len(self.words) >= self.max_buffered:
+                self.wakeup.set()
+
+    def after_flush(self, callback, *args):
+        ''' Calls callback(*args) once everything recorded so far is in the
+        report files, right away if nothing is waiting to be written. '''
+        with self.lock:
+            if self.words or self.rows or self.writing:
+                self.callbacks.append((callback, args))
+                return
+        callback(*args)
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                words, self.words = self.words, list()
+                rows, self.rows = self.rows, list()
+                callbacks, self.callbacks = self.callbacks, list()
+                self.writing = True
+            try:
+                if words:
+                    with open_append(self.word_file) as word_file:
+                        word_file.writelines(words)
+                if rows:
+                    with open_append(self.url_file) as url_file:
+                        csv.writer(url_file).writerows(rows)
+            finally:
+                with self.lock:
+                    self.writing = False
+            for callback, args in callbacks:
+                callback(*args)
+
+    def _write_loop(self, interval):
+        while not self.closed:
+            self.wakeup.wait(interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+        self.writer.join()
+        self.flush()
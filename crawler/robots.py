@@ -0,0 +1,237 @@
+import atexit
+import gzip
+import io
+import json
+import os
+import re
+import time
+from threading import Lock
+from urllib.parse import urlsplit
+from xml.etree.ElementTree import ParseError, iterparse
+
+from crawler.metrics import METRICS
+from crawler.store import side_file
+
+# In seconds, how long rules are kept when robots.txt could not be fetched
+# (server error, timeout) before trying again. Until then the host is
+# crawled as if it had no robots.txt.
+RETRY_TTL = 3600.0
+
+
+def _compile(pattern):
+    ''' A robots.txt path pattern as a function of path -> bool. Patterns
+    without wildcards are plain prefixes, by far the most common case. '''
+    if "*" not in pattern and not pattern.endswith("$"):
+        return lambda path: path.startswith(pattern)
+    anchored = pattern.endswith("$")
+    regex = ".*".join(re.escape(part) for part in pattern.rstrip("$").split("*"))
+    return re.compile(regex + ("$" if anchored else "")).match
+
+
+class RobotsRules(object):
+    ''' The robots.txt rules of one host that apply to our user agent.
+
+    `rules` are (pattern, allow) pairs, tried longest pattern first (allow
+    first on ties), so the first match is the most specific rule, as major
+    search engines do. No matching rule allows the url. '''
+
+    def __init__(self, rules=(), delay=0.0, sitemaps=(), expires=0.0):
+        self.rules = sorted(rules, key=lambda rule: (-len(rule[0]), not rule[1]))
+        self.delay = delay
+        self.sitemaps = list(sitemaps)
+        self.expires = expires
+        self.matchers = [
+            (_compile(pattern), allow) for pattern, allow in self.rules]
+
+    @classmethod
+    def parse(cls, text, user_agent, expires):
+        ''' Rules of the most specific group of text whose user-agent is
+        part of ours, or of the * group. '''
+        groups = dict()     # user-agent token -> (rules, delay)
+        sitemaps = list()
+        current = list()    # tokens of the group being read
+        in_rules = False
+        for line in text.splitlines():
+            line = line.split("#", 1)[0].strip()
+            field, _, value = line.partition(":")
+            field, value = field.strip().lower(), value.strip()
+            if field == "user-agent":
+                if in_rules:
+                    current, in_rules = list(), False
+                current.append(value.lower())
+                groups.setdefault(value.lower(), (list(), [0.0]))
+            elif field in ("allow", "disallow"):
+                in_rules = True
+                if field == "disallow" and not value:
+                    # An empty Disallow allows everything.
+                    continue
+                for token in current:
+                    groups[token][0].append((value, field == "allow"))
+            elif field == "crawl-delay":
+                in_rules = True
+                try:
+                    delay = float(value)
+                except ValueError:
+                    continue
+                for token in current:
+                    groups[token][1][0] = delay
+            elif field == "sitemap" and value:
+                sitemaps.append(value)
+        agent = user_agent.lower()
+        matching = [
+            token for token in groups if token != "*" and token in agent]
+        token = max(matching, key=len) if matching else "*"
+        rules, delay = groups.get(token, (list(), [0.0]))
+        return cls(rules, delay[0], sitemaps, expires)
+
+    def allowed(self, url):
+        parts = urlsplit(url)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        for match, allow in self.matchers:
+            if match(path):
+                return allow
+        return True
+
+    def as_dict(self):
+        return {
+            "rules": self.rules, "delay": self.delay,
+            "sitemaps": self.sitemaps, "expires": self.expires}
+
+
+class RobotsCache(object):
+    ''' robots.txt rules of every host, refreshed once per `ttl` seconds
+    and kept in memory and in `path` (one json line per fetch, the last one
+    of a host wins).
+
+    The cache does not download anything: the frontier fetches robots.txt
+    as scheduled work on its host when fresh() says the rules are missing
+    or expired, and hands the response to update(). allowed() only looks at
+    the rules already known, so it is cheap enough for scraper.is_valid. '''
+
+    def __init__(self, config, path, ttl):
+        self.config = config
+        self.path = path
+        self.ttl = ttl
+        self.lock = Lock()
+        self.hosts = dict()     # host -> RobotsRules
+        if os.path.exists(path):
+            with open(path, "r") as saved:
+                for line in saved:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line.
+                        continue
+                    self.hosts[entry["host"]] = RobotsRules(
+                        [tuple(rule) for rule in entry["rules"]],
+                        entry["delay"], entry["sitemaps"], entry["expires"])
+        self.file = open(path, "a")
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def allowed(self, url):
+        ''' False if the known rules of url's host disallow it. Hosts whose
+        rules are not known yet are allowed. '''
+        rules = self.hosts.get(urlsplit(url).netloc)
+        return rules is None or rules.allowed(url)
+
+    def fresh(self, host):
+        ''' True if the rules of host are known and not expired. '''
+        rules = self.hosts.get(host)
+        return rules is not None and rules.expires > time.time()
+
+    def update(self, robots_url, resp):
+        ''' Records the rules of robots_url's host from resp, the response
+        of its download, and returns them. '''
+        rules = self._parse(resp)
+        host = urlsplit(robots_url).netloc
+        with self.lock:
+            self.hosts[host] = rules
+            if not self.file.closed:
+                self.file.write(json.dumps(
+                    dict(host=host, **rules.as_dict())) + "\n")
+                self.file.flush()
+        return rules
+
+    def _parse(self, resp):
+        METRICS.increment("robots_downloads", label=resp.status)
+        now = time.time()
+        if resp.status == 200 and resp.raw_response is not None:
+            text = (resp.raw_response.content or b"").decode("utf-8", "replace")
+            return RobotsRules.parse(
+                text, self.config.user_agent, now + self.ttl)
+        if 400 <= resp.status < 500:
+            # No robots.txt, everything is allowed.
+            return RobotsRules(expires=now + self.ttl)
+        return RobotsRules(expires=now + min(self.ttl, RETRY_TTL))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+class _BoundedStream(io.RawIOBase):
+    ''' Reads at most `limit` bytes of stream, then stops as if it ended. '''
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.left = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.stream.read(min(len(buffer), self.left))
+        self.left -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def iter_sitemap(content, max_size=0):
+    ''' Streams the <loc> entries of a sitemap (gzipped or not), as
+    ("url", loc) for a urlset and ("sitemap", loc) for a sitemap index,
+    without building the whole tree. A gzipped sitemap is read up to
+    `max_size` bytes once decompressed (if set), the entries past that are
+    dropped. '''
+    stream = io.BytesIO(content)
+    if content[:2] == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+        if max_size:
+            stream = _BoundedStream(stream, max_size)
+    kind = "url"
+    root = None
+    try:
+        for event, element in iterparse(stream, events=("start", "end")):
+            tag = element.tag.rpartition("}")[2]
+            if event == "start":
+                if root is None:
+                    root = element
+                    if tag == "sitemapindex":
+                        kind = "sitemap"
+                continue
+            if tag == "loc" and element.text:
+                yield kind, element.text.strip()
+            elif tag in ("url", "sitemap"):
+                # Done with the entry, drop the ones read so far so memory
+                # stays flat.
+                root.clear()
+    except (ParseError, OSError, EOFError):
+        return
+
+
+_caches = dict()
+_caches_lock = Lock()
+
+
+def get_robots_cache(config):
+    ''' The shared RobotsCache of config, None if ROBOTS_TXT is off. '''
+    if config.robots_txt == "off":
+        return None
+    path = side_file(config, ".robots")
+    with _caches_lock:
+        if path not in _caches:
+            cache = RobotsCache(config, path, config.robots_ttl)
+            atexit.register(cache.close)
+            _caches[path] = cache
+        return _caches[path]
@@ -0,0 +1,433 @@
+import heapq
+import time
+from collections import Counter, deque
+from threading import Condition, RLock
+from urllib.parse import urlparse
+
+from crawler.metrics import METRICS
+
+# Smallest delay after a failure, for politeness delays below it.
+MIN_BACKOFF = 1.0
+# Weight of the newest sample in the latency and error rate averages.
+SMOOTHING = 0.2
+
+CLOSED, OPEN, HALF_OPEN, DOWN = "closed", "open", "half-open", "down"
+
+
+class HostState(object):
+    ''' Rate control of one host.
+
+    `backoff` doubles on every failure (up to the scheduler's max_delay) and
+    halves on every success, never below the politeness delay. After
+    `failure_threshold` failures in a row the circuit opens: the host is
+    not requested for a cooldown that doubles every time, then a single
+    probe is let through (half-open). A successful probe closes the circuit,
+    a failed one opens it again, and a host whose circuit opened more than
+    `max_probes` times is given up on (down). '''
+
+    def __init__(self, floor):
+        self.floor = floor      # politeness, or the host's crawl-delay
+        self.backoff = floor
+        self.latency = None     # moving average of download time
+        self.error_rate = 0.0   # moving average of failures
+        self.failures = 0       # in a row
+        self.state = CLOSED
+        self.open_until = 0
+        self.openings = 0
+
+    def delay(self, latency_factor):
+        return max(self.backoff, latency_factor * (self.latency or 0))
+
+    def as_dict(self, latency_factor):
+        return {
+            "state": self.state,
+            "delay": self.delay(latency_factor),
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "failures": self.failures,
+            "openings": self.openings}
+
+
+class HostTask(object):
+    ''' Work on a host that is not one of its pages, like downloading its
+    robots.txt or a sitemap. `site` is the host it is done for, which may
+    not be the one `url` is on. '''
+
+    __slots__ = ("kind", "url", "site", "attempts")
+
+    def __init__(self, kind, url, site):
+        self.kind = kind
+        self.url = url
+        self.site = site
+        self.attempts = 1
+
+
+class HostScheduler(object):
+    ''' Hands out urls so that each host (netloc) is requested at most once
+    every `delay` seconds, while different hosts are served in parallel.
+
+    The delay of a host adapts to how it is doing (see HostState and
+    report()): it grows with its latency (times `latency_factor`) and on
+    failures, up to `max_delay`, and never goes below `delay` (or the
+    host's crawl-delay, see set_floor).
+
+    When the download path itself is broken (the cache server cannot be
+    reached, see report_outage) no host is to blame, so every host is
+    paused instead, for a back-off that doubles on every outage in a row.
+    Urls that are given up on (hosts that are down) are returned by put()
+    and report() so the caller can discard them.
+
+    HostTasks (see put_task) go ahead of the urls of their host, one per
+    slot like urls, and the host's urls wait until they are all done. '''
+
+    def __init__(self, delay, max_delay=60.0, failure_threshold=5,
+                 cooldown=30.0, max_probes=4, latency_factor=1.0,
+                 logger=None):
+        self.delay = delay
+        self.max_delay = max(max_delay, delay)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_probes = max_probes
+        self.latency_factor = latency_factor
+        self.logger = logger
+        self.queues = dict()     # host -> deque of urls waiting for that host
+        self.tasks = dict()      # host -> deque of HostTasks waiting for it
+        # host -> HostTasks queued or in flight, its urls wait while it has any
+        self.open_tasks = Counter()
+        self.next_ready = dict() # host -> earliest time the host may be hit
+        # heap of (ready_time, host), entries whose time is not the host's
+        # next_ready any more are stale and skipped
+        self.ready = list()
+        self.hosts = dict()      # host -> HostState
+        self.pending = 0
+        self.in_flight = 0
+        self.outage_backoff = 0.0
+        self.paused_until = 0
+        self.cond = Condition(RLock())
+
+    def __len__(self):
+        with self.cond:
+            return self.pending
+
+    def idle(self):
+        ''' True if nothing is queued and nothing is in flight. '''
+        with self.cond:
+            return not self.pending and not self.in_flight
+
+    def depths(self):
+        ''' Number of queued urls per host. '''
+        with self.cond:
+            return {host: len(queue) for host, queue in self.queues.items()}
+
+    def host_states(self, throttled_only=True):
+        ''' host -> HostState.as_dict(), by default only for the hosts that
+        are slowed down or cut off. '''
+        with self.cond:
+            return {
+                host: state.as_dict(self.latency_factor)
+                for host, state in self.hosts.items()
+                if not throttled_only or state.state != CLOSED
+                or state.failures or state.backoff > self.delay}
+
+    def set_floor(self, host, delay):
+        ''' Never requests host more often than every `delay` seconds (its
+        robots.txt crawl-delay), or max_delay if that is lower. '''
+        with self.cond:
+            state = self.hosts.get(host)
+            if state is None:
+                state = self.hosts[host] = HostState(self.delay)
+            state.floor = max(self.delay, min(delay, self.max_delay))
+            if delay > self.max_delay:
+                self._log(
+                    f"Host {host} asks for a crawl-delay of {delay}s, "
+                    f"capped at {self.max_delay}s.")
+            state.backoff = max(state.backoff, state.floor)
+            # The host may have been scheduled with the old delay already.
+            if state.state == CLOSED:
+                self._schedule(host, max(
+                    self.next_ready.get(host, 0),
+                    time.monotonic() + state.delay(self.latency_factor)))
+
+    def _has_work(self, host):
+        return bool(self.tasks.get(host)) or (
+            host not in self.open_tasks and bool(self.queues.get(host)))
+
+    def _schedule(self, host, ready_time):
+        self.next_ready[host] = ready_time
+        if self._has_work(host):
+            heapq.heappush(self.ready, (ready_time, host))
+
+    def _new_queue(self):
+        return deque()
+
+    def _push(self, host, queue, url, score):
+        queue.append(url)
+
+    def _pop(self, queue):
+        return queue.popleft()
+
+    def _urls(self, queue):
+        return list(queue)
+
+    def put(self, url, score=None):
+        ''' Queues url. The score is only used by PriorityHostScheduler.
+        Returns False if url was dropped because its host is down. '''
+        host = urlparse(url).netloc
+        with self.cond:
+            state = self.hosts.get(host)
+            if state is None:
+                state = self.hosts[host] = HostState(self.delay)
+            if state.state == DOWN:
+                METRICS.increment("dropped_urls", label="Host down")
+                return False
+            queue = self.queues.get(host)
+            if queue is None:
+                queue = self.queues[host] = self._new_queue()
+            self._push(host, queue, url, score)
+            self.pending += 1
+            if len(queue) == 1:
+                # The host was idle, so it needs a slot on the ready heap.
+                self._schedule(host, self.next_ready.get(host, 0))
+            self.cond.notify()
+            return True
+
+    def put_task(self, task):
+        ''' Queues a HostTask on the host of its url, ahead of the host's
+        urls. Returns False if the host is down. '''
+        host = urlparse(task.url).netloc
+        with self.cond:
+            state = self.hosts.get(host)
+            if state is None:
+                state = self.hosts[host] = HostState(self.delay)
+            if state.state == DOWN:
+                return False
+            tasks = self.tasks.setdefault(host, deque())
+            tasks.append(task)
+            self.open_tasks[host] += 1
+            self.pending += 1
+            if len(tasks) == 1:
+                self._schedule(host, self.next_ready.get(host, 0))
+            self.cond.notify()
+            return True
+
+    def _next_host(self, now):
+        ''' (host to take a url from, None) if one is ready, otherwise
+        (None, seconds until one is, None if no host has urls). '''
+        while self.ready and (
+                not self._has_work(self.ready[0][1])
+                or self.ready[0][0] != self.next_ready[self.ready[0][1]]):
+            heapq.heappop(self.ready)
+        if not self.ready:
+            return None, None
+        ready_time, host = self.ready[0]
+        if ready_time <= now:
+            heapq.heappop(self.ready)
+            return host, None
+        return None, ready_time - now
+
+    def get(self, timeout=None):
+        ''' Blocks until a url (or HostTask) whose host is ready is
+        available. Returns None if the timeout expires, or as soon as nothing
+        is queued and nothing is in flight (the crawl is finished). '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until and self.pending:
+                    host, wait = None, self.paused_until - now
+                else:
+                    host, wait = self._next_host(now)
+                if host is not None:
+                    return self._take(host, now)
+                if wait is None and self.in_flight == 0 and self.pending == 0:
+                    # Nothing left and nobody can add more.
+                    self.cond.notify_all()
+                    return None
+                if deadline is not None:
+                    if now >= deadline:
+                        return None
+                    wait = deadline - now if wait is None else min(wait, deadline - now)
+                self.cond.wait(wait)
+
+    def _take(self, host, now):
+        tasks = self.tasks.get(host)
+        if tasks:
+            url = tasks.popleft()
+            if not tasks:
+                del self.tasks[host]
+        else:
+            queue = self.queues[host]
+            url = self._pop(queue)
+            if not queue:
+                del self.queues[host]
+        self.pending -= 1
+        self.in_flight += 1
+        state = self.hosts[host]
+        if state.state == OPEN:
+            # The cooldown is over, this url probes the host. Nothing else
+            # goes to it until report() says how the probe went (or for
+            # another cooldown, if it never does).
+            state.state = HALF_OPEN
+            self._schedule(host, now + self.cooldown)
+        else:
+            self._schedule(host, now + state.delay(self.latency_factor))
+        return url
+
+    def report(self, url, failed, seconds=None):
+        ''' How downloading url (returned by get) went, and how long it
+        took. Adjusts the rate of its host. Returns the urls dropped
+        because the host is now down, if any. '''
+        host = urlparse(url).netloc
+        with self.cond:
+            # The download path works again.
+            self.outage_backoff = 0.0
+            state = self.hosts.get(host)
+            if state is None or state.state == DOWN:
+                return []
+            now = time.monotonic()
+            if seconds is not None:
+                state.latency = seconds if state.latency is None else (
+                    (1 - SMOOTHING) * state.latency + SMOOTHING * seconds)
+            state.error_rate = (
+                (1 - SMOOTHING) * state.error_rate + SMOOTHING * failed)
+            if not failed:
+                state.failures = 0
+                state.backoff = max(state.floor, state.backoff / 2)
+                if state.state != CLOSED:
+                    self._log(f"Host {host} is back, closing its circuit.")
+                    state.state = CLOSED
+                    state.openings = 0
+                    self._schedule(
+                        host, now + state.delay(self.latency_factor))
+                    self.cond.notify()
+                return []
+            state.failures += 1
+            state.backoff = min(
+                self.max_delay, max(2 * state.backoff, state.floor, MIN_BACKOFF))
+            if state.state == HALF_OPEN or (
+                    state.state == CLOSED
+                    and state.failures >= self.failure_threshold):
+                return self._open(host, state, now)
+            if state.state == CLOSED:
+                self._schedule(host, max(
+                    self.next_ready.get(host, 0),
+                    now + state.delay(self.latency_factor)))
+            return []
+
+    def report_outage(self):
+        ''' A download could not reach the cache server at all. Pauses every
+        host, for MIN_BACKOFF seconds after the first outage in a row and
+        twice as long after each next one, up to max_delay. '''
+        with self.cond:
+            self.outage_backoff = min(
+                self.max_delay, max(2 * self.outage_backoff, MIN_BACKOFF))
+            self.paused_until = max(
+                self.paused_until, time.monotonic() + self.outage_backoff)
+            self._log(
+                f"Downloads are failing on every host, pausing for "
+                f"{self.outage_backoff:.1f}s.")
+
+    def _open(self, host, state, now):
+        ''' Opens the circuit of host, returns the urls dropped if the host
+        is given up on. '''
+        state.openings += 1
+        if state.openings > self.max_probes:
+            state.state = DOWN
+            dropped = self._urls(self.queues.pop(host, ()))
+            tasks = self.tasks.pop(host, ())
+            self.pending -= len(dropped) + len(tasks)
+            self.open_tasks[host] -= len(tasks)
+            if self.open_tasks[host] <= 0:
+                del self.open_tasks[host]
+            METRICS.increment("dropped_urls", len(dropped), label="Host down")
+            self._log(
+                f"Host {host} keeps failing, giving up on it and "
+                f"{len(dropped)} queued urls.")
+            # The crawl may be finished now.
+            self.cond.notify_all()
+            return dropped
+        state.state = OPEN
+        cooldown = self.cooldown * 2 ** (state.openings - 1)
+        state.open_until = now + cooldown
+        self._schedule(host, state.open_until)
+        self._log(
+            f"Host {host} failed {state.failures} times in a row, "
+            f"not requesting it for {cooldown:.1f}s.")
+        return []
+
+    def _log(self, message):
+        if self.logger:
+            self.logger.warning(message)
+
+    def task_done(self, task=None):
+        ''' Must be called once for every url returned by get, with the
+        HostTask if it was one. '''
+        with self.cond:
+            self.in_flight -= 1
+            if task is not None:
+                host = urlparse(task.url).netloc
+                self.open_tasks[host] -= 1
+                if self.open_tasks[host] <= 0:
+                    del self.open_tasks[host]
+                    # Its urls can go now.
+                    self._schedule(host, self.next_ready.get(host, 0))
+                    self.cond.notify()
+            if self.in_flight == 0 and not self.pending:
+                # Wake up the waiting workers so they can stop.
+                self.cond.notify_all()
+
+
+class PriorityHostScheduler(HostScheduler):
+    ''' Best-first HostScheduler: every url comes with a score, and of the
+    hosts that are ready, the one with the best scored url is served first,
+    its best url first. Politeness and rate control are the same.
+
+    Each host's urls are a heap of (-score, arrival, url). Hosts whose next
+    request time has passed move from the `ready` heap to the `best` heap of
+    (-score of their best url, host); entries there that do not match the
+    host's current best url, or that were left after the host was taken,
+    are stale and skipped, like those of the `ready` heap. '''
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.best = list()
+        self.arrivals = 0   # ties are served in arrival order
+
+    def _new_queue(self):
+        return list()
+
+    def _push(self, host, queue, url, score):
+        self.arrivals += 1
+        entry = (-(score or 0.0), self.arrivals, url)
+        heapq.heappush(queue, entry)
+        if (queue[0] is entry and len(queue) > 1
+                and host not in self.open_tasks
+                and self.next_ready.get(host, 0) <= time.monotonic()):
+            # The host is waiting on the best heap with a worse url.
+            heapq.heappush(self.best, (entry[0], host))
+
+    def _pop(self, queue):
+        return heapq.heappop(queue)[2]
+
+    def _urls(self, queue):
+        return [url for _, _, url in queue]
+
+    def _next_host(self, now):
+        while self.ready and self.ready[0][0] <= now:
+            ready_time, host = heapq.heappop(self.ready)
+            if ready_time != self.next_ready[host]:
+                continue
+            if self.tasks.get(host):
+                # Tasks go first, whatever the scores.
+                return host, None
+            queue = self.queues.get(host)
+            if queue and host not in self.open_tasks:
+                heapq.heappush(self.best, (queue[0][0], host))
+        while self.best:
+            score, host = heapq.heappop(self.best)
+            queue = self.queues.get(host)
+            if (queue and queue[0][0] == score
+                    and host not in self.open_tasks
+                    and self.next_ready[host] <= now):
+                return host, None
+        return super()._next_host(now)
@@ -0,0 +1,425 @@
+import dbm
+import glob
+import heapq
+import mmap
+import os
+import pickle
+import shelve
+import struct
+from hashlib import blake2b
+from operator import itemgetter
+from threading import Event, RLock, Thread
+
+# A cold index entry: hash of the key, offset of the record in the cold file.
+INDEX_ENTRY = struct.Struct("<QQ")
+# The cold index starts with the size of the cold file it covers.
+INDEX_HEADER = struct.Struct("<Q")
+# Index entries written at once when the index is rewritten.
+INDEX_CHUNK = 65536
+
+
+class ShelveStore(object):
+    ''' The original backend: a shelve that is synced after every write. '''
+
+    def __init__(self, path):
+        self.shelf = shelve.open(path)
+
+    @staticmethod
+    def files(path):
+        # dbm implementations add their own suffixes to the file name.
+        return [p for p in glob.glob(f"{glob.escape(path)}*")
+                if os.path.isfile(p)]
+
+    def __contains__(self, key):
+        return key in self.shelf
+
+    def __getitem__(self, key):
+        return self.shelf[key]
+
+    def __setitem__(self, key, value):
+        self.shelf[key] = value
+        self.shelf.sync()
+
+    def __len__(self):
+        return len(self.shelf)
+
+    def keys(self):
+        return self.shelf.keys()
+
+    def values(self):
+        return self.shelf.values()
+
+    def items(self):
+        return self.shelf.items()
+
+    def close(self):
+        self.shelf.close()
+
+
+# The files each dbm implementation adds to the path it is given (others,
+# like dbm.gnu, use the path itself).
+DBM_SUFFIXES = {
+    "dbm.dumb": (".dat", ".dir", ".bak"),
+    "dbm.ndbm": (".db", ".pag", ".dir"),
+}
+
+
+def dbm_files(path):
+    ''' The files of the dbm database (a ShelveStore) at path, if any. '''
+    kind = dbm.whichdb(path)
+    if not kind:
+        return []
+    return [f"{path}{suffix}" for suffix in DBM_SUFFIXES.get(kind, ("",))
+            if os.path.isfile(f"{path}{suffix}")]
+
+
+def _key_hash(key):
+    return int.from_bytes(
+        blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _write_snapshot(path, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as snapshot:
+        pickle.dump(data, snapshot, pickle.HIGHEST_PROTOCOL)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(tmp_path, path)
+
+
+class LogStore(object):
+    ''' Keeps the frontier state in memory and appends every change to a
+    write-ahead log. Changes are group committed: they are buffered and
+    written (and fsynced) together every `flush_interval` seconds, or as
+    soon as `batch_size` of them are waiting, so a crash loses at most one
+    batch. Once the log holds `compact_every` changes it is folded into a
+    snapshot. Both happen on a background thread, writers only ever wait
+    for the in-memory update (and, during a compaction, a copy of the
+    state).
+
+    Records that `retired(value)` says will not change any more (completed
+    urls) only stay in memory until the next compaction, which appends them
+    to the cold file. They are found through the cold index, a table of
+    (key hash, offset) sorted by hash that is memory mapped and binary
+    searched, so they are never loaded as a whole and a resume only reads
+    the records still in use.
+
+    Files: `path` is the snapshot, `path.log` is the log, `path.log.old`
+    the log of the changes a compaction is writing to the snapshot,
+    `path.done` the cold file and `path.done.index` its index. '''
+
+    def __init__(self, path, flush_interval=1.0, batch_size=10000,
+                 compact_every=500000, retired=None):
+        self.path = path
+        self.log_path = f"{path}.log"
+        self.old_log_path = f"{path}.log.old"
+        self.cold_path = f"{path}.done"
+        self.index_path = f"{path}.done.index"
+        self.batch_size = batch_size
+        self.compact_every = compact_every
+        self.retired = retired
+        self.data = dict()
+        self.buffer = list()
+        self.logged = 0
+        self.lock = RLock()
+        # Held while writing to the log, which happens without self.lock.
+        self.log_lock = RLock()
+        if not os.path.exists(self.index_path):
+            with open(self.index_path, 'wb') as index_file:
+                index_file.write(INDEX_HEADER.pack(0))
+        self.index = self._map_index()
+        # Kept apart from the index so it can be read after close.
+        self.cold_count = self._count_cold(self.index)
+        cold_size = INDEX_HEADER.unpack_from(self.index)[0]
+        if (os.path.exists(self.cold_path)
+                and os.path.getsize(self.cold_path) > cold_size):
+            # Records a compaction appended but never indexed (it died).
+            os.truncate(self.cold_path, cold_size)
+        self.cold = open(self.cold_path, 'ab')
+        self.cold_reader = open(self.cold_path, 'rb')
+        crashed = os.path.exists(self.old_log_path)
+        self._recover()
+        if crashed and self.retired is not None:
+            # The old log may bring back records the compaction already
+            # moved to the cold file.
+            for key, value in list(self.data.items()):
+                if self.retired(value) and self._find_cold(key) is not None:
+                    del self.data[key]
+        if not os.path.exists(self.path) or crashed:
+            # Always have a snapshot so the save file can be found, and
+            # fold in the old log of a compaction the crawler died in
+            # before the next compaction replaces it.
+            _write_snapshot(self.path, self.data)
+            if crashed:
+                os.remove(self.old_log_path)
+        self.log = open(self.log_path, 'ab')
+        self.closed = Event()
+        self.full = Event()     # a batch is waiting, flush it now
+        self.flusher = Thread(
+            target=self._flush_loop, args=(flush_interval,), daemon=True)
+        self.flusher.start()
+
+    @staticmethod
+    def files(path):
+        # A save file left by STORE = shelve is converted on open, and
+        # deleted with the others on restart.
+        return [p for p in (
+                    path, f"{path}.log", f"{path}.log.old", f"{path}.tmp",
+                    f"{path}.done", f"{path}.done.index",
+                    f"{path}.done.index.tmp")
+                if os.path.isfile(p)] + [
+                    p for p in dbm_files(path) if p != path]
+
+    def _recover(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as snapshot:
+                self.data = pickle.load(snapshot)
+        for log_path in (self.old_log_path, self.log_path):
+            if os.path.exists(log_path):
+                self._replay(log_path)
+
+    def _replay(self, log_path):
+        valid = 0
+        with open(log_path, 'rb') as log:
+            while True:
+                try:
+                    batch = pickle.load(log)
+                except (EOFError, pickle.UnpicklingError, ValueError):
+                    # A torn batch at the end is the one we were writing
+                    # when the crawler died, drop it.
+                    break
+                self.data.update(batch)
+                self.logged += len(batch)
+                valid = log.tell()
+        if valid != os.path.getsize(log_path):
+            with open(log_path, 'r+b') as log:
+                log.truncate(valid)
+
+    def _map_index(self):
+        with open(self.index_path, 'rb') as index_file:
+            return mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def _count_cold(index):
+        return (len(index) - INDEX_HEADER.size) // INDEX_ENTRY.size
+
+    def _find_cold(self, key):
+        ''' Offset of the cold record of key, None if it has none. '''
+        target = _key_hash(key)
+        index = self.index
+        low, high = 0, self.cold_count
+        while low < high:
+            middle = (low + high) // 2
+            found, offset = INDEX_ENTRY.unpack_from(
+                index, INDEX_HEADER.size + middle * INDEX_ENTRY.size)
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                return offset
+        return None
+
+    def _read_cold(self, offset):
+        self.cold_reader.seek(offset)
+        return pickle.load(self.cold_reader)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data or self._find_cold(key) is not None
+
+    def __getitem__(self, key):
+        with self.lock:
+            if key in self.data:
+                return self.data[key]
+            offset = self._find_cold(key)
+            if offset is None:
+                raise KeyError(key)
+            return self._read_cold(offset)[1]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.buffer.append((key, value))
+            if len(self.buffer) >= self.batch_size:
+                self.full.set()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.data) + self.cold_count
+
+    def keys(self):
+        return (key for key, _ in self.items())
+
+    def values(self):
+        return (value for _, value in self.items())
+
+    def items(self):
+        ''' The records in memory, then the cold ones, read from disk. '''
+        with self.lock:
+            hot = list(self.data.items())
+            count = self.cold_count
+        yield from hot
+        for position in range(count):
+            with self.lock:
+                if position >= self.cold_count:
+                    # A compaction changed the index, whatever is left
+                    # was in memory.
+                    return
+                _, offset = INDEX_ENTRY.unpack_from(
+                    self.index,
+                    INDEX_HEADER.size + position * INDEX_ENTRY.size)
+                key, value = self._read_cold(offset)
+                if key in self.data:
+                    continue
+            yield key, value
+
+    def flush(self):
+        ''' Commits all buffered changes to the log with a single write. '''
+        with self.log_lock:
+            with self.lock:
+                buffer, self.buffer = self.buffer, list()
+                self.full.clear()
+            if not buffer:
+                return
+            self.log.write(pickle.dumps(buffer, pickle.HIGHEST_PROTOCOL))
+            self.log.flush()
+            os.fsync(self.log.fileno())
+            self.logged += len(buffer)
+
+    def compact(self):
+        ''' Writes the live records to a new snapshot, the retired ones to
+        the cold file, and starts a new log. The state is only locked while
+        it is copied, and while the new index is swapped in. '''
+        with self.log_lock:
+            self.flush()
+            with self.lock:
+                # Changes made from here on are in the copy and in the new
+                # log, replaying them over the snapshot is harmless.
+                data = dict(self.data)
+            self.log.close()
+            os.replace(self.log_path, self.old_log_path)
+            self.log = open(self.log_path, 'ab')
+            self.logged = 0
+        retired = dict()
+        if self.retired is not None:
+            retired = {
+                key: value for key, value in data.items()
+                if self.retired(value)}
+        index = self._write_cold(retired) if retired else None
+        _write_snapshot(self.path, {
+            key: value for key, value in data.items() if key not in retired})
+        with self.lock:
+            if index is not None:
+                self.index.close()
+                self.index = index
+                self.cold_count = self._count_cold(index)
+            for key, value in retired.items():
+                if self.data.get(key) is value:
+                    del self.data[key]
+        os.remove(self.old_log_path)
+
+    def _write_cold(self, records):
+        ''' Appends records to the cold file and writes the index merged
+        with them. Returns the new index, mapped. '''
+        entries = list()
+        for key, value in records.items():
+            entries.append((_key_hash(key), self.cold.tell()))
+            pickle.dump((key, value), self.cold, pickle.HIGHEST_PROTOCOL)
+        self.cold.flush()
+        os.fsync(self.cold.fileno())
+        entries.sort()
+        # Reading the current index needs no lock, it is only replaced
+        # once the new one is written.
+        old_entries = memoryview(self.index)[INDEX_HEADER.size:]
+        merged = heapq.merge(
+            entries, INDEX_ENTRY.iter_unpack(old_entries),
+            key=itemgetter(0))
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, 'wb') as index_file:
+            index_file.write(INDEX_HEADER.pack(self.cold.tell()))
+            previous = None
+            chunk = list()
+            for key_hash, offset in merged:
+                # The new record of a key comes first and wins.
+                if key_hash != previous:
+                    chunk.append(INDEX_ENTRY.pack(key_hash, offset))
+                    previous = key_hash
+                if len(chunk) >= INDEX_CHUNK:
+                    index_file.write(b"".join(chunk))
+                    chunk = list()
+            index_file.write(b"".join(chunk))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        del merged
+        old_entries.release()
+        os.replace(tmp_path, self.index_path)
+        return self._map_index()
+
+    def _flush_loop(self, interval):
+        while not self.closed.is_set():
+            self.full.wait(interval)
+            self.flush()
+            if self.logged >= self.compact_every:
+                self.compact()
+
+    def close(self):
+        self.closed.set()
+        self.full.set()
+        self.flusher.join()
+        with self.log_lock:
+            self.flush()
+            self.log.close()
+        with self.lock:
+            self.cold.close()
+            self.cold_reader.close()
+            self.index.close()
+
+
+STORES = {"shelve": ShelveStore, "log": LogStore}
+
+# Other crawl state kept next to the save file, deleted with it on restart
+SIDE_FILE_SUFFIXES = (
+    ".simhash", ".queue", ".queue.head", ".templates", ".robots", ".seen")
+
+
+def side_file(config, suffix):
+    return f"{config.save_file}{suffix}"
+
+
+def store_files(config):
+    files = STORES[config.store].files(config.save_file)
+    for suffix in SIDE_FILE_SUFFIXES:
+        path = side_file(config, suffix)
+        if os.path.isfile(path) and path not in files:
+            files.append(path)
+    return files
+
+
+def _convert_shelve(path):
+    ''' Rewrites the save file a ShelveStore left at path as a LogStore
+    snapshot, so STORE = log resumes a crawl started with STORE = shelve. '''
+    files = dbm_files(path)
+    with shelve.open(path, 'r') as shelf:
+        data = dict(shelf.items())
+    # Replaces the database file itself for dbm implementations that use
+    # path as is.
+    _write_snapshot(path, data)
+    for dbm_file in files:
+        if dbm_file != path:
+            os.remove(dbm_file)
+
+
+def _completed(record):
+    # Frontier records are (url, completed, parent url).
+    return record[1]
+
+
+def open_store(config):
+    if config.store == "log":
+        if dbm_files(config.save_file):
+            _convert_shelve(config.save_file)
+        return LogStore(
+            config.save_file, flush_interval=config.store_flush_interval,
+            retired=_completed)
+    return STORES[config.store](config.save_file)
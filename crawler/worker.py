@@ -1,17 +1,19 @@
+import time
 from threading import Thread
 
 from inspect import getsource
+from crawler.metrics import METRICS
 from utils.download import download
 from utils import get_logger
 import scraper
-import time
 
 
 class Worker(Thread):
-    def __init__(self, worker_id, config, frontier):
+    def __init__(self, worker_id, config, frontier, report_sink):
         self.logger = get_logger(f"Worker-{worker_id}", "Worker")
         self.config = config
         self.frontier = frontier
+        self.report_sink = report_sink
         # basic check for requests in scraper
         assert {getsource(scraper).find(req) for req in {"from requests import", "import requests"}} == {-1}, "Do not use requests in scraper.py"
         assert {getsource(scraper).find(req) for req in {"from urllib.request import", "import urllib.request"}} == {-1}, "Do not use urllib.request in scraper.py"
@@ -19,16 +21,34 @@ class Worker(Thread):
         
     def run(self):
         while True:
+            # Politeness is enforced per host by the frontier, so this
+            # blocks until some host is ready instead of sleeping here.
             tbd_url = self.frontier.get_tbd_url()
             if not tbd_url:
                 self.logger.info("Frontier is empty. Stopping Crawler.")
                 break
-            resp = download(tbd_url, self.config, self.logger)
-            self.logger.info(
-                f"Downloaded {tbd_url}, status <{resp.status}>, "
-                f"using cache {self.config.cache_server}.")
-            scraped_urls = scraper.scraper(tbd_url, resp, self.config, self.logger, self.frontier)
-            for scraped_url in scraped_urls:
-                self.frontier.add_url(scraped_url, tbd_url)
-            self.frontier.mark_url_complete(tbd_url)
-            time.sleep(self.config.time_delay)
+            try:
+                resp = self._fetch(tbd_url)
+                scraped_urls = scraper.scraper(
+                    tbd_url, resp, self.config, self.logger, self.frontier,
+                    self.report_sink)
+                for scraped_url in scraped_urls:
+                    self.frontier.add_url(scraped_url, tbd_url)
+            except Exception:
+                self.logger.exception(f"Failed to process {tbd_url}.")
+            # Always release the url, otherwise the other workers would
+            # wait forever for it to finish.
+            self.frontier.mark_url_complete(tbd_url, self.report_sink)
+
+    def _fetch(self, tbd_url):
+        ''' Downloads tbd_url and reports how it went to the frontier. '''
+        start = time.perf_counter()
+        resp = download(tbd_url, self.config, self.logger)
+        seconds = time.perf_counter() - start
+        METRICS.observe("download_seconds", seconds)
+        METRICS.increment("downloads", label=resp.status)
+        self.frontier.report_download(tbd_url, resp.status, seconds)
+        self.logger.info(
+            f"Downloaded {tbd_url}, status <{resp.status}>, "
+            f"using cache {self.config.cache_server}.")
+        return resp
@@ -1,9 +1,16 @@
 import csv
+import gzip
+import heapq
+import io
 import os
+import pickle
 import re
-import sys
-from collections import defaultdict
-from typing import Dict, List, Set, Tuple
+from argparse import ArgumentParser
+from collections import Counter, defaultdict
+from hashlib import blake2b
+from itertools import chain
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Set, Tuple
 from urllib.parse import urldefrag, urlparse
 
 from utils.tokenize_string import tokenize
@@ -19,23 +26,207 @@ def compute_word_frequencies(tokens: List[str]) -> Dict[str, int]:
         freq_dict[token] += 1
     return freq_dict
 
-# O(nlogn) where n is the numner of keys in the dictionary
+def open_report_file(path: str):
+    """Opens a crawler output file for binary reading, files ending in .gz are gzip compressed"""
+    if path.endswith(".gz"):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+# Lines handed to Counter.update at once when reading the word file
+CHUNK_LINES = 10000
+# Files smaller than this are never split across processes
+MIN_SHARD_SIZE = 1 << 24
+
+
+def _count_range(word_file: str, start: int, end: int) -> Counter:
+    """
+    Counts the tokens of the lines starting in the byte range [start, end) of the word file
+    """
+    counts = Counter()
+    with open_report_file(word_file) as words:
+        if start > 0:
+            # The line containing start belongs to the previous range
+            words.seek(start - 1)
+            words.readline()
+        position = words.tell()
+        lines = []
+        for line in words:
+            if position >= end:
+                break
+            position += len(line)
+            lines.append(line)
+            if len(lines) == CHUNK_LINES:
+                counts.update(chain.from_iterable(line.split() for line in lines))
+                lines = []
+        counts.update(chain.from_iterable(line.split() for line in lines))
+    return Counter({token.decode(): count for token, count in counts.items()})
+
+
+# O(n) for n tokens, with memory in the number of distinct tokens
+def count_word_file(word_file: str, processes: int = 1, start: int = 0, end: int = None) -> Counter:
+    """
+    Counts the tokens of the word file (or of its byte range [start, end)) line by line,
+    optionally sharding the file across processes
+    """
+    if end is None:
+        end = complete_end(word_file, start)
+    # Every process would have to decompress everything before its range
+    if processes <= 1 or end - start < MIN_SHARD_SIZE or word_file.endswith(".gz"):
+        return _count_range(word_file, start, end)
+    step = (end - start) // processes + 1
+    ranges = [(word_file, shard, min(shard + step, end)) for shard in range(start, end, step)]
+    counts = Counter()
+    with Pool(processes) as pool:
+        for shard in pool.starmap(_count_range, ranges):
+            counts.update(shard)
+    return counts
+
+_DIGITS = re.compile(r"\d+")
+
+# O(n log N) where n is the number of keys in the dictionary and N the number of frequencies returned
 def get_n_frequencies(frequencies: Dict[str, int], n: int, stopwords: Set) -> List[Tuple[str, int]]:
-    items = [(k, v) for k, v in frequencies.items()]  # O(n)
-    items.sort(key=lambda i : (-i[1], i[0]))  # O(nlogn)
-    n_frequencies = []
-    for token, freq in items:  # O(n)
-        if token in stopwords or len(token) < 2 or re.match(r"\d+", token):
-            continue
-        n_frequencies.append((token, freq))
-        if len(n_frequencies) == n:
-            break
+    items = (
+        (token, freq) for token, freq in frequencies.items()
+        if not (token in stopwords or len(token) < 2 or _DIGITS.match(token)))
+    return heapq.nsmallest(n, items, key=lambda i : (-i[1], i[0]))
+
+class ReportState(object):
+    """Aggregates of everything read so far from the url and word files
+    Saved as a checkpoint so an incremental run only reads what the crawler appended since.
+    The checkpoint holds every aggregate (all unique urls and word counts), so loading and
+    saving it is O(total) per run, only reading the files is O(new lines)
+    """
+
+    def __init__(self):
+        self.url_offset = 0
+        self.word_offset = 0
+        self.url_identity = None # file_identity of the files read so far
+        self.word_identity = None
+        self.unique_urls = set()
+        self.longest_page = (None, 0)
+        self.ics_subs = dict() # domain -> set(pages in domain)
+        self.word_counts = Counter()
+
+    def as_dict(self) -> dict:
+        """Plain builtin types only, so the checkpoint loads whichever module runs the report"""
+        return dict(vars(self))
 
+    @classmethod
+    def from_dict(cls, saved: dict) -> "ReportState":
+        state = cls()
+        state.__dict__.update(saved)
+        return state
 
-    return n_frequencies
 
-def generate_report(url_file: str, word_file: str, stopwordfile: str):
-    """Generate crawling statistics from logs"""
+def file_identity(path: str) -> Optional[Tuple[int, str]]:
+    """Inode and hash of the first line of path, a restarted crawl writes new files under the same names"""
+    if not os.path.exists(path):
+        return None
+    with open_report_file(path) as f:
+        try:
+            first = f.readline()
+        except EOFError:
+            # The crawler is still writing the first gzip member
+            first = b""
+    return os.stat(path).st_ino, blake2b(first, digest_size=8).hexdigest()
+
+
+def load_state(checkpoint: str, url_file: str, word_file: str) -> ReportState:
+    """Loads the checkpoint, or a new state if there is none or the files were restarted since"""
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return ReportState()
+    with open(checkpoint, 'rb') as f:
+        saved = pickle.load(f)
+    if not isinstance(saved, dict):
+        # A checkpoint of an older version, which pickled the ReportState itself
+        return ReportState()
+    state = ReportState.from_dict(saved)
+    url_size = complete_end(url_file, 0) if os.path.exists(url_file) else 0
+    word_size = complete_end(word_file, 0) if os.path.exists(word_file) else 0
+    if url_size < state.url_offset or word_size < state.word_offset:
+        # The crawl was restarted, the files are not the ones we read.
+        return ReportState()
+    if ((state.url_offset and state.url_identity != file_identity(url_file))
+            or (state.word_offset and state.word_identity != file_identity(word_file))):
+        # Restarted and already grown past the offsets
+        return ReportState()
+    return state
+
+
+def save_state(checkpoint: str, state: ReportState):
+    with open(f"{checkpoint}.tmp", 'wb') as f:
+        pickle.dump(state.as_dict(), f, pickle.HIGHEST_PROTOCOL)
+    os.replace(f"{checkpoint}.tmp", checkpoint)
+
+
+def complete_end(path: str, start: int) -> int:
+    """Offset just after the last newline of the file, so lines still being written are left for the next run"""
+    if path.endswith(".gz"):
+        return _complete_end_compressed(path, start)
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        while end > start:
+            block = max(start, end - (1 << 16))
+            f.seek(block)
+            newline = f.read(end - block).rfind(b'\n')
+            if newline != -1:
+                return block + newline + 1
+            end = block
+    return start
+
+
+def _complete_end_compressed(path: str, start: int) -> int:
+    """complete_end for gzip files, which have to be decompressed from the beginning"""
+    end = start
+    position = 0
+    with gzip.open(path, 'rb') as f:
+        try:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                newline = block.rfind(b'\n')
+                if newline != -1 and position + newline + 1 > start:
+                    end = position + newline + 1
+                position += len(block)
+        except EOFError:
+            # The crawler is still writing the last member
+            pass
+    return end
+
+
+def update_url_stats(state: ReportState, url_file: str):
+    """Number of Unique pages, Longest page and pages per ics subdomain, for the rows appended since the last run"""
+    end = complete_end(url_file, state.url_offset)
+    with open_report_file(url_file) as f:
+        f.seek(state.url_offset)
+        text = f.read(end - state.url_offset).decode()
+    for row in csv.reader(io.StringIO(text, newline='')):
+        url, token_count = row
+        token_count = int(token_count)
+        defrag = urldefrag(url)[0]
+        state.unique_urls.add(defrag)
+        if token_count >= state.longest_page[1]:
+            state.longest_page = (defrag, token_count)
+        parsedurl = urlparse(defrag)
+        if re.match(r".*\.ics\.uci\.edu.*", parsedurl.netloc):
+            domain = "/".join([parsedurl.scheme, parsedurl.netloc])
+            if domain not in state.ics_subs:
+                state.ics_subs[domain] = set()
+            state.ics_subs[domain].add(defrag)
+    state.url_offset = end
+    state.url_identity = file_identity(url_file)
+
+
+def update_word_counts(state: ReportState, word_file: str, processes: int = 1):
+    end = complete_end(word_file, state.word_offset)
+    state.word_counts.update(count_word_file(word_file, processes, state.word_offset, end))
+    state.word_offset = end
+    state.word_identity = file_identity(word_file)
+
+
+def generate_report(url_file: str, word_file: str, stopwordfile: str, processes: int = 1, checkpoint: str = None):
+    """Generate crawling statistics from logs
+    With a checkpoint, only the part of the files appended since the last run is read
+    """
     if not os.path.exists("reports"):
         os.mkdir("reports")
     report_num = -1
@@ -46,37 +237,15 @@ def generate_report(url_file: str, word_file: str, stopwordfile: str):
             report_num = max(report_num, num)
     report_num += 1
     report_file = os.path.join("reports", f"report{report_num}.txt")
+    state = load_state(checkpoint, url_file, word_file)
     # Number of Unique pages
     # Longest page
     # Number of Subdomains in ics.uci.edu and their page count
-    unique_page_count = 0
-    longest_page = (None, 0)
-    ics_subs = dict() # domain -> set(pages in domain)
-    unique_urls = set()
     if os.path.exists(url_file):
-        with open(url_file, 'r', newline='') as urls:
-            urlreader = csv.reader(urls)
-            row = next(urlreader)
-            while row is not None:
-                url, token_count = row
-                token_count = int(token_count)
-                defrag = urldefrag(url)[0]
-                if defrag not in unique_urls:
-                    unique_page_count +=1
-                    unique_urls.add(defrag)
-                if token_count >= longest_page[1]:
-                    longest_page = (defrag, token_count)
-                parsedurl = urlparse(defrag)
-                if re.match(r".*\.ics\.uci\.edu.*", parsedurl.netloc):
-                    domain = "/".join([parsedurl.scheme, parsedurl.netloc])
-                    if domain not in ics_subs:
-                        ics_subs[domain] = set()
-                    ics_subs[domain].add(defrag)
-                try:
-                    row = next(urlreader)
-                except StopIteration:
-                    break
-    ics_sub_counts = [(k, len(v)) for k, v in ics_subs.items()]
+        update_url_stats(state, url_file)
+    unique_page_count = len(state.unique_urls)
+    longest_page = state.longest_page
+    ics_sub_counts = [(k, len(v)) for k, v in state.ics_subs.items()]
     ics_sub_counts.sort()
     # Common words
     top_freqs = []
@@ -86,10 +255,10 @@ def generate_report(url_file: str, word_file: str, stopwordfile: str):
         stopwords = set()
         with open(stopwordfile, 'r') as f:
             stopwords = set(f.read().split())
-        with open(word_file, 'r') as words:
-            tokens = words.read().split()
-            freqs = compute_word_frequencies(tokens)
-            top_freqs = get_n_frequencies(freqs, 50, stopwords)
+        update_word_counts(state, word_file, processes)
+        top_freqs = get_n_frequencies(state.word_counts, 50, stopwords)
+    if checkpoint is not None:
+        save_state(checkpoint, state)
     
     # Generate Report
     with open(report_file, 'x') as r:
@@ -107,8 +276,17 @@ def generate_report(url_file: str, word_file: str, stopwordfile: str):
             r.write(f"{url}, {pages}\n")
 
 if __name__ == "__main__":
-    try:
-        url_file, word_file, stopwordfile = sys.argv[1:4]
-    except:
-        raise Exception("Not enough args")
-    generate_report(url_file, word_file, stopwordfile)
\ No newline at end of file
+    parser = ArgumentParser()
+    parser.add_argument("url_file", type=str)
+    parser.add_argument("word_file", type=str)
+    parser.add_argument("stopwordfile", type=str)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="count the word file with this many processes")
+    parser.add_argument("--incremental", action="store_true", default=False,
+                        help="only read what was appended since the last incremental run")
+    parser.add_argument("--checkpoint", type=str, default=os.path.join("reports", "checkpoint.pickle"),
+                        help="where --incremental keeps its aggregates")
+    args = parser.parse_args()
+    generate_report(
+        args.url_file, args.word_file, args.stopwordfile, args.processes,
+        args.checkpoint if args.incremental else None)
\ No newline at end of file
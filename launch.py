@@ -1,16 +1,25 @@
 from configparser import ConfigParser
 from argparse import ArgumentParser
 
-from utils.server_registration import get_cache_server
 from utils.config import Config
 from crawler import Crawler
 
 
-def main(config_file, restart):
+def main(config_file, restart, cache_server=None, node_id=None):
     cparser = ConfigParser()
     cparser.read(config_file)
+    if node_id is not None:
+        cparser["LOCAL PROPERTIES"]["NODE_ID"] = str(node_id)
     config = Config(cparser)
-    config.cache_server = get_cache_server(config, restart)
+    if cache_server:
+        # e.g. a local stand-in (benchmarks/cache_server.py), no registration
+        host, _, port = cache_server.rpartition(":")
+        config.cache_server = (host, int(port))
+    elif config.response_cache != "replay":
+        # Replayed crawls never talk to the cache server.
+        # (Imported here, only registering needs the spacetime package.)
+        from utils.server_registration import get_cache_server
+        config.cache_server = get_cache_server(config, restart)
     crawler = Crawler(config, restart)
     crawler.start()
 
@@ -19,5 +28,9 @@ if __name__ == "__main__":
     parser = ArgumentParser()
     parser.add_argument("--restart", action="store_true", default=False)
     parser.add_argument("--config_file", type=str, default="config.ini")
+    parser.add_argument("--cache_server", type=str, default=None,
+                        help="host:port of the cache server to use directly")
+    parser.add_argument("--node_id", type=int, default=None,
+                        help="this process's index in NODES (distributed crawl)")
     args = parser.parse_args()
-    main(args.config_file, args.restart)
+    main(args.config_file, args.restart, args.cache_server, args.node_id)
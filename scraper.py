@@ -1,21 +1,23 @@
-import csv
-import re
 from urllib.parse import urldefrag, urljoin, urlparse
 
-from bs4 import BeautifulSoup
-
-from utils.download import download
+from crawler.metrics import METRICS
+from crawler.robots import get_robots_cache
 from utils.get_parents import get_parents_set
-from utils.information_value import information_value
-from utils.tokenize_string import tokenize
-from utils.calendar_trap import calendar_trap_check
-from utils import normalize
-
-def scraper(url, resp, config, logger, frontier):
-    links = extract_next_links(url, resp, frontier, logger)
+from utils.page_analysis import analyze_page
+from utils.calendar_trap import calendar_trap_counts, strip_numbers
+from utils.url_filter import URL_FILTER
+from utils import normalize, should_log_skip
+
+# Pages with a lower information value are not recorded or expanded
+MIN_INFORMATION_VALUE = 0.33
+# Only responses of these types are parsed (no Content-Type counts as html)
+HTML_CONTENT_TYPES = frozenset(["text/html", "application/xhtml+xml"])
+
+def scraper(url, resp, config, logger, frontier, report_sink):
+    links = extract_next_links(url, resp, frontier, logger, report_sink)
     return [link for link in links if is_valid(link, config, logger)]
 
-def extract_next_links(url, resp, frontier, logger):
+def extract_next_links(url, resp, frontier, logger, report_sink):
 
     # Implementation required.
     # url: the URL that was used to get the page
@@ -27,128 +29,162 @@ def extract_next_links(url, resp, frontier, logger):
     #         resp.raw_response.content: the content of the page!
     # Return a list with the hyperlinks (as strings) scrapped from resp.raw_response.content
 
-    urls_list = []
+    content = get_content(url, resp, logger)
+    if content is None:
+        return []
+    page, links = analyze(page_url(url, resp), content, frontier.config.parser)
+    return record_page(url, page, links, frontier, logger, report_sink)
+
+def page_url(url, resp):
+    """The url the page was actually fetched from (after redirects), which its relative links are resolved against
+    url itself is normalized, so it may have lost the index page or trailing slash the links are relative to
+    """
+    raw_response = resp.raw_response
+    return getattr(raw_response, "url", None) or url
+
+def get_content(url, resp, logger):
+    """Returns the page content of resp, or None if there is nothing to scrape
+    Only the status is looked at before deciding, then the headers, so skipped responses are never parsed
+    """
     if resp.status != 200:
         if resp.status == 404:
             logger.info(f"{url} returned 404 not found")
         elif (resp.error != None):
             logger.info(resp.error)
-        return urls_list
+        if resp.size:
+            METRICS.increment("skipped_bytes", resp.size, label=f"Status {resp.status}")
+        return None
+    if resp.raw_response is None:
+        logger.info(f"{url} has no response")
+        return None
+    content_type = resp.raw_response.headers.get("Content-Type", "")
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type and content_type not in HTML_CONTENT_TYPES: # Binary files and other documents are not parsed
+        logger.info(f"Skipped {url}: content type {content_type}")
+        METRICS.increment("skipped_pages", label="Not html")
+        METRICS.increment("skipped_bytes", len(resp.raw_response.content or b""), label="Not html")
+        return None
     if (resp.raw_response.content == "" or resp.raw_response.content == None): # Check for dead pages
         logger.info("Page has no data")
+        return None
+    return resp.raw_response.content
+
+def analyze(url, content, parser):
+    """The part of the scraping that only depends on the page itself (url is the one it was fetched from, see page_url)
+    Returns the PageAnalysis of content and its resolved links as (found_url, skip_reason) pairs
+    Does not touch the frontier or any file, so it can run in another process
+    """
+    # Tokens, tag count and links all come from a single parse of the page
+    page = analyze_page(content, parser)
+    if page.information_value < MIN_INFORMATION_VALUE:
+        return page, []
+    return page, [resolve_link(url, found_url) for found_url in page.outlinks]
+
+def resolve_link(url, found_url):
+    """Turns an href found on url into an absolute, normalized url
+    Returns (found_url, None), or (found_url, reason) if the link should be skipped
+    """
+    found_url = urldefrag(found_url)[0] # defrag URL using urldefrag from urllib
+    parsed = urlparse(found_url)
+    if (len(found_url) != 0) and (parsed.scheme == ""): # check if found_url is a relative URL
+        if found_url.startswith("///"): #if 3 slashes, it is a file URL, don't add
+            return found_url, "Most likely a file"
+        if found_url.startswith("//"): # if url starts with // (shorthand to request reference url using protocol of current url)
+            current_protocol = urlparse(url).scheme
+            found_url = current_protocol + ":" + found_url
+        else:
+            found_url = urljoin(url, found_url) # if not, join urls using urljoin from urllib
+
+    if len(found_url) == 0: #Check URL is not empty string
+        return found_url, "Empty URL"
+
+    #check for repeating directories and calendar traps
+    reason = URL_FILTER.trap_reason(found_url, url)
+    if reason is not None:
+        return found_url, reason
+
+    #Check for dynamic urls
+    if "?" in (found_url):
+        found_url = found_url.split("?")[0]
+        if (found_url) == url: #don't add if url without query parameters is same as parent url
+            return found_url, "Same as parent without query"
+    return normalize(found_url), None
+
+def record_page(url, page, links, frontier, logger, report_sink):
+    """The part of the scraping that needs the crawl state
+    Records the page for the reports (through the crawler's ReportSink) and returns the links worth adding to the frontier
+    """
+    urls_list = []
+    METRICS.observe("parse_seconds", page.parse_seconds)
+    METRICS.observe("tokenize_seconds", page.tokenize_seconds)
+
+    # Low information value filter, done on the page we already downloaded
+    info = page.information_value
+    if info < MIN_INFORMATION_VALUE:
+        logger.info(f"Skipped {url}: information value = {info} < 1/3")
+        METRICS.increment("skipped_pages", label="Low information value")
         return urls_list
 
+    # Near duplicate filter, mirrors and printable versions are not recorded or expanded
+    if frontier.near_duplicates is not None:
+        duplicate = frontier.near_duplicates.find_or_add(url, page.fingerprint, len(page.outlinks))
+        if duplicate is not None:
+            logger.info(f"Skipped {url}: near duplicate of {duplicate}")
+            METRICS.increment("skipped_pages", label="Near duplicate")
+            return urls_list
+
+    # Record all tokens in page, and url and token count
+    report_sink.record_page(url, page.lines, page.token_count)
+    METRICS.increment("pages")
+
     unique_urls = set() # keeps track of unique urls on page
     unique_urls.add(url) # add parent url to set
 
-    soup = BeautifulSoup(resp.raw_response.content, "html.parser")
-
-    # Report processing
-    page_token_count = 0
-
-    # Record all tokens in page
-    with open(frontier.config.word_file, 'at') as words:
-        for strings in soup.stripped_strings:
-            tokens = tokenize(strings)
-            page_token_count += len(tokens)
-            if len(tokens) > 0:
-                words.write(' '.join(tokens) + '\n')
-
-    # Record url and token count
-    with open(frontier.config.url_file, 'a', newline='') as urlcount:
-        urlwriter = csv.writer(urlcount)
-        urlwriter.writerow([url, page_token_count])
-
-    for link in soup.find_all(href=True):
-        found_url = link['href']
-        found_url = urldefrag(found_url)[0] # defrag URL using urldefrag from urllib
-        parsed = urlparse(found_url)
-        if (len(found_url) != 0) and (parsed.scheme == ""): # check if found_url is a relative URL
-            if (re.match(r"^\/{3}", found_url)): #if 3 slashes, it is a file URL, don't add
-                logger.info(f"SKIPPING {found_url}: Most likely a file")
-                continue
-            if re.match(r"^(\/\/)", found_url): # if url starts with // (shorthand to request reference url using protocol of current url)
-                current_protocol = urlparse(url).scheme
-                found_url = current_protocol + ":" + found_url
-            else:
-                found_url = urljoin(url, found_url) # if not, join urls using urljoin from urllib
-
-        if len(found_url) == 0: #Check URL is not empty string
-            logger.info(f"SKIPPING {found_url}: Empty URL")
-            continue
-        
-        #check for repeating directories
-        if (re.search(r'\/([^\/]+)\/(.+\/)?\1\/(.+\/)?\1', found_url)): #check if directory is repeated 3 or more times
-            logger.info(f"SKIPPING {found_url}: Repeated path")
+    # loop check, the parents are the same for every link on the page
+    # (calendars and other number patterns are stopped by the frontier's path template budget, see TRAP_BUDGET)
+    parents = get_parents_set(url, frontier, 50)
+    logger.debug("%s had parents %s", url, parents)
+    frontier.note_page(url, page, len(parents) - 1) # the links are scored with it in priority order
+    # without a budget (TRAP_BUDGET = 0) the calendar check on the parents is the fallback
+    calendar_counts = calendar_trap_counts(parents) if frontier.traps is None else None
+
+    for found_url, reason in links:
+        if reason is not None:
+            skip_link(found_url, reason, logger)
             continue
-
-        #check for calendar traps
-        pattern = r'\/?([0-9]{0,2})\/([0-9]{0,2})\/([0-9]{4})($|\/)$'
-
-        if (re.search(pattern, url) and re.search(pattern, found_url)):
-            if(re.sub(pattern, "", url) == re.sub(pattern, "", found_url)):
-                logger.info(f"SKIPPING {found_url}: Found common calendar format")
-                continue
-
-        #Check for dynamic urls
-        if "?" in (found_url):
-            found_url = found_url.split("?")[0]
-            if (found_url) == url: #don't add if url without query parameters is same as parent url
-                logger.info(f"SKIPPING {found_url}: Same as parent ({url}) without query")
-                continue 
-        found_url = normalize(found_url)
-        # trap check
-        parents = get_parents_set(url, frontier, 50) # number should be changed based on trap check implementation
-        logger.info(f"{found_url} had parents {parents}")
         if (found_url) in parents:
-            logger.info(f"SKIPPING {found_url}: Existed in parents")
+            skip_link(found_url, "Existed in parents", logger)
             continue
-        if calendar_trap_check(found_url, parents) > 5:
-            logger.info(f"SKIPPING {found_url}: Repeated number pattern found (Calendar)")
+        if calendar_counts is not None and calendar_counts[strip_numbers(found_url)] > 5:
+            skip_link(found_url, "Repeated number pattern found (Calendar)", logger)
             continue
 
         if found_url not in unique_urls:
             urls_list.append(found_url)
             unique_urls.add(found_url)
         else:
-            logger.info(f"SKIPPING {found_url}: Already found on page")
+            skip_link(found_url, "Already found on page", logger)
 
     return urls_list
 
+def skip_link(found_url, reason, logger):
+    """Counts a skipped link by reason, only some of them are logged (see SKIP_LOG_EVERY)"""
+    METRICS.increment("skipped_links", label=reason)
+    if should_log_skip():
+        logger.info(f"SKIPPING {found_url}: {reason}")
+
 def is_valid(url, config, logger):
     # Decide whether to crawl this url or not. 
     # If you decide to crawl it, return True; otherwise return False.
-    # There are already some conditions that return False.
-
-    try:
-        parsed = urlparse(url)
-        if parsed.scheme not in set(["http", "https"]):
-            return False
-        if re.match(
-            r".*\.(css|js|bmp|gif|jpe?g|ico"
-            + r"|png|tiff?|mid|mp2|mp3|mp4"
-            + r"|wav|avi|mov|mpe?g|ram|m4v|mkv|ogg|ogv|pdf|war"
-            + r"|ps|eps|tex|ppt|pptx|doc|docx|xls|xlsx|names"
-            + r"|data|dat|exe|bz2|tar|msi|bin|7z|psd|dmg|iso|Z"
-            + r"|epub|dll|cnf|tgz|sha1|py|sql|conf|svg|tif|r|c"
-            + r"|thmx|mso|arff|rtf|jar|csv|json|java|apk|img|war|xml"
-            + r"|rm|smil|wmv|swf|wma|zip|rar|gz|txt|vmdk|php|ppsx)$"
-            + r"|.*(json|xmlrpc|mailto|\.php|.*attachment\/)"
-            + r"|.*\/(pdf|wiki|files)\/.*", parsed.path.lower()):
-            return False
-
-        # check for valid domain
-        if parsed.netloc is not None and not re.match(r".*(\.ics|\.cs|\.informatics|\.stat)\.uci\.edu", parsed.netloc):
-            return False
-
-        resp = download(url, config, logger)
-        if resp.error == None and resp.raw_response != None:
-            soup = BeautifulSoup(resp.raw_response.content, "html.parser")
-            info = information_value(soup)
-            if info < 0.33: 
-                logger.info(f"Skipped {url}: information value = {info} < 1/3")
-                return False
-        return True
-    except TypeError:
-        print ("TypeError for ", parsed)
-        raise
\ No newline at end of file
+    # The rules (extensions, paths, allowed domains) are compiled once in utils/url_filter.py
+
+    # Only the url is checked here, pages with a low information value
+    # are dropped after they are downloaded (see extract_next_links).
+    accepted, reason = URL_FILTER.classify(url)
+    if accepted: # robots.txt rules of the hosts seen so far, the frontier checks the others before downloading
+        robots = get_robots_cache(config)
+        if robots is not None and not robots.allowed(url):
+            accepted, reason = False, "robots.txt"
+    if not accepted:
+        METRICS.increment("skipped_links", label=f"Rejected by {reason} rule")
+    return accepted
\ No newline at end of file
@@ -0,0 +1,58 @@
+import os
+import pickle
+
+from generate_report import ReportState, generate_report, load_state
+
+STOPWORDS = os.path.join(os.path.dirname(os.path.dirname(__file__)), "stopwords.txt")
+
+
+def append(path, text):
+    with open(path, 'a', newline='') as f:
+        f.write(text)
+
+
+def run():
+    generate_report("urls.csv", "words.txt", STOPWORDS, checkpoint="checkpoint.pickle")
+    return load_state("checkpoint.pickle", "urls.csv", "words.txt")
+
+
+def test_incremental_runs_add_up(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    append("urls.csv", "http://a.ics.uci.edu/one,3\n")
+    append("words.txt", "crawler crawler page\n")
+    run()
+    append("urls.csv", "http://a.ics.uci.edu/two,5\n")
+    append("words.txt", "crawler\n")
+    state = run()
+    assert state.unique_urls == {"http://a.ics.uci.edu/one", "http://a.ics.uci.edu/two"}
+    assert state.longest_page == ("http://a.ics.uci.edu/two", 5)
+    assert state.word_counts["crawler"] == 3
+    # Plain builtins and collections only, no ReportState in the pickle
+    with open("checkpoint.pickle", 'rb') as f:
+        assert isinstance(pickle.load(f), dict)
+
+
+def test_restarted_files_are_read_again(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    append("urls.csv", "http://a.ics.uci.edu/one,3\n")
+    append("words.txt", "old words\n")
+    run()
+    # A restarted crawl that already wrote more than the old files held
+    os.remove("urls.csv")
+    os.remove("words.txt")
+    append("urls.csv", "http://b.ics.uci.edu/new,4\nhttp://b.ics.uci.edu/newer,2\n")
+    append("words.txt", "new words and more\n")
+    state = run()
+    assert state.unique_urls == {"http://b.ics.uci.edu/new", "http://b.ics.uci.edu/newer"}
+    assert state.word_counts["old"] == 0
+    assert state.word_counts["new"] == 1
+
+
+def test_old_checkpoint_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    append("urls.csv", "http://a.ics.uci.edu/one,3\n")
+    state = ReportState()
+    state.url_offset = 5
+    with open("checkpoint.pickle", 'wb') as f:
+        pickle.dump(state, f)
+    assert load_state("checkpoint.pickle", "urls.csv", "words.txt").url_offset == 0
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from benchmarks.crawl_benchmark import load_config
+from crawler.frontier import Frontier
+from crawler.store import LogStore
+from utils import get_urlhash, normalize
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), "config.ini")
+
+
+@pytest.mark.parametrize("url, expected", [
+    # scheme and host are lowercased, the path is not
+    ("HTTP://WWW.ICS.UCI.EDU/People", "http://www.ics.uci.edu/People"),
+    # default ports are dropped, others are kept
+    ("http://www.ics.uci.edu:80/a", "http://www.ics.uci.edu/a"),
+    ("https://www.ics.uci.edu:443/a", "https://www.ics.uci.edu/a"),
+    ("https://www.ics.uci.edu:80/a", "https://www.ics.uci.edu:80/a"),
+    ("http://www.ics.uci.edu:8080/a/", "http://www.ics.uci.edu:8080/a"),
+    ("http://[::1]:80/a", "http://[::1]/a"),
+    ("http://User@WWW.ics.uci.edu/a", "http://User@www.ics.uci.edu/a"),
+    # dot segments
+    ("http://www.ics.uci.edu/a/./b/../c", "http://www.ics.uci.edu/a/c"),
+    ("http://www.ics.uci.edu/a/../../b", "http://www.ics.uci.edu/b"),
+    ("http://www.ics.uci.edu/a/b/..", "http://www.ics.uci.edu/a"),
+    ("http://www.ics.uci.edu/a.b/c.html", "http://www.ics.uci.edu/a.b/c.html"),
+    # index pages and trailing slashes
+    ("http://www.ics.uci.edu/", "http://www.ics.uci.edu"),
+    ("http://www.ics.uci.edu/a/index.html", "http://www.ics.uci.edu/a"),
+    ("http://www.ics.uci.edu/a/INDEX.HTM", "http://www.ics.uci.edu/a"),
+    ("http://www.ics.uci.edu/a/index.php", "http://www.ics.uci.edu/a/index.php"),
+    # tracking parameters are dropped, the others sorted
+    ("http://www.ics.uci.edu/a?utm_source=x&id=1", "http://www.ics.uci.edu/a?id=1"),
+    ("http://www.ics.uci.edu/a?UTM_Medium=x&gclid=y&fbclid=z", "http://www.ics.uci.edu/a"),
+    ("http://www.ics.uci.edu/a?b=2&a=1&c", "http://www.ics.uci.edu/a?a=1&b=2&c"),
+    ("http://www.ics.uci.edu/a?&&b=2&", "http://www.ics.uci.edu/a?b=2"),
+    # fragments
+    ("http://www.ics.uci.edu/a#section", "http://www.ics.uci.edu/a"),
+    # unparsable urls are only stripped of their trailing slash
+    ("http://[::1/", "http://[::1"),
+])
+def test_normalize(url, expected):
+    assert normalize(url) == expected
+
+
+def test_normalize_is_idempotent():
+    url = "HTTP://Www.ICS.uci.edu:80/a/./b/../index.html?z=1&utm_id=2&a=3#top"
+    assert normalize(normalize(url)) == normalize(url)
+
+
+def save_file_with_key(tmp_path, monkeypatch, key):
+    monkeypatch.chdir(tmp_path)
+    config = load_config(CONFIG_FILE, [], ["http://www.ics.uci.edu/"], ("127.0.0.1", 1))
+    store = LogStore(config.save_file)
+    store[key] = ("http://www.ics.uci.edu/a", False, None)
+    store.close()
+    return config
+
+
+def test_old_save_keys_are_rejected(tmp_path, monkeypatch):
+    # Save files from before the 64 bit keys are keyed by SHA-256 hex digests
+    config = save_file_with_key(tmp_path, monkeypatch, "ab" * 32)
+    with pytest.raises(RuntimeError, match="--restart"):
+        Frontier(config, restart=False)
+
+
+def test_current_save_keys_are_resumed(tmp_path, monkeypatch):
+    config = save_file_with_key(
+        tmp_path, monkeypatch, get_urlhash(normalize("http://www.ics.uci.edu/a")))
+    frontier = Frontier(config, restart=False)
+    assert len(frontier.save) == 1
+    frontier.close()
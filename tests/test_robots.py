@@ -0,0 +1,116 @@
+import gzip
+
+import pytest
+
+from crawler.robots import RobotsRules, iter_sitemap
+
+USER_AGENT = "IR UW24 12345678,87654321"
+
+ROBOTS_TXT = """
+# comments and unknown fields are ignored
+User-agent: *
+Disallow: /private/
+Allow: /private/open
+Disallow: /*.pdf$
+Crawl-delay: 2
+
+User-agent: googlebot
+User-agent: ir uw24
+Disallow: /
+Allow: /public/
+Disallow: /search*q=
+Crawl-delay: 0.5
+
+User-agent: ir
+Disallow: /other/
+
+Sitemap: http://www.ics.uci.edu/sitemap.xml
+"""
+
+
+def parse(text, user_agent=USER_AGENT):
+    return RobotsRules.parse(text, user_agent, expires=0)
+
+
+def test_most_specific_group_applies():
+    rules = parse(ROBOTS_TXT)
+    assert rules.delay == 0.5
+    assert rules.sitemaps == ["http://www.ics.uci.edu/sitemap.xml"]
+    assert not rules.allowed("http://www.ics.uci.edu/other/")
+    assert rules.allowed("http://www.ics.uci.edu/public/page")
+
+
+def test_star_group_when_no_group_matches():
+    rules = parse(ROBOTS_TXT, "SomeOtherBot/1.0")
+    assert rules.delay == 2
+    assert not rules.allowed("http://www.ics.uci.edu/private/page")
+    assert rules.allowed("http://www.ics.uci.edu/private/open/page")
+    assert rules.allowed("http://www.ics.uci.edu/other/")
+    assert not rules.allowed("http://www.ics.uci.edu/paper.pdf")
+    assert rules.allowed("http://www.ics.uci.edu/paper.pdf?download=1")
+
+
+def test_star_group_is_ignored_when_a_group_matches():
+    rules = parse("User-agent: ir\nDisallow: /a\n\nUser-agent: *\nDisallow: /b\n")
+    assert not rules.allowed("http://www.ics.uci.edu/a")
+    assert rules.allowed("http://www.ics.uci.edu/b")
+
+
+@pytest.mark.parametrize("url, allowed", [
+    ("http://www.ics.uci.edu/", False),
+    ("http://www.ics.uci.edu/public/", True),
+    ("http://www.ics.uci.edu/public/paper.pdf", True),
+    ("http://www.ics.uci.edu/search?q=crawler", False),
+    ("http://www.ics.uci.edu/search", False),
+])
+def test_longest_rule_wins(url, allowed):
+    assert parse(ROBOTS_TXT).allowed(url) is allowed
+
+
+def test_allow_wins_ties():
+    rules = parse("User-agent: *\nDisallow: /page\nAllow: /page\n")
+    assert rules.allowed("http://www.ics.uci.edu/page")
+
+
+def test_empty_disallow_allows_everything():
+    rules = parse("User-agent: *\nDisallow:\n")
+    assert rules.rules == []
+    assert rules.allowed("http://www.ics.uci.edu/anything")
+
+
+def test_bad_crawl_delay_is_ignored():
+    assert parse("User-agent: *\nCrawl-delay: soon\n").delay == 0.0
+
+
+def test_empty_file_allows_everything():
+    rules = parse("")
+    assert rules.delay == 0.0
+    assert rules.allowed("http://www.ics.uci.edu/")
+
+
+def urlset(count):
+    entries = "".join(
+        f"<url><loc>http://www.ics.uci.edu/{number}</loc></url>"
+        for number in range(count))
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f'{entries}</urlset>').encode("utf-8")
+
+
+def test_sitemap_index_and_urlset():
+    index = (
+        b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        b'<sitemap><loc> http://www.ics.uci.edu/a.xml </loc></sitemap>'
+        b'</sitemapindex>')
+    assert list(iter_sitemap(index)) == [
+        ("sitemap", "http://www.ics.uci.edu/a.xml")]
+    assert len(list(iter_sitemap(gzip.compress(urlset(10))))) == 10
+
+
+def test_gzipped_sitemap_is_cut_at_max_size():
+    content = gzip.compress(urlset(10000))
+    assert len(content) < 100000
+    found = list(iter_sitemap(content, max_size=100000))
+    assert 0 < len(found) < 10000
+    assert found[0] == ("url", "http://www.ics.uci.edu/0")
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from crawler.store import LogStore
+
+
+def completed(record):
+    return record[1]
+
+
+def open_log_store(path, **kwargs):
+    return LogStore(str(path), flush_interval=60, retired=completed, **kwargs)
+
+
+def record(number, done):
+    return (f"http://example.com/{number}", done, None)
+
+
+@pytest.fixture
+def save_file(tmp_path):
+    return tmp_path / "frontier.shelve"
+
+
+def test_reopen_replays_the_log(save_file):
+    store = open_log_store(save_file)
+    for number in range(10):
+        store[f"{number:016x}"] = record(number, False)
+    store.close()
+    store = open_log_store(save_file)
+    assert len(store) == 10
+    assert store[f"{3:016x}"] == record(3, False)
+    store.close()
+
+
+def test_compact_moves_completed_records_to_the_cold_file(save_file):
+    store = open_log_store(save_file)
+    for number in range(100):
+        store[f"{number:016x}"] = record(number, number % 2 == 0)
+    store.compact()
+    assert store.cold_count == 50
+    assert len(store.data) == 50
+    assert len(store) == 100
+    assert store[f"{4:016x}"] == record(4, True)
+    assert f"{5:016x}" in store
+    assert f"{100:016x}" not in store
+    # A second compaction merges its records into the index.
+    store[f"{5:016x}"] = record(5, True)
+    store.compact()
+    assert store.cold_count == 51
+    store.close()
+    assert len(store) == 100
+    assert store.cold_count == 51
+
+    store = open_log_store(save_file)
+    assert len(store) == 100
+    assert store.cold_count == 51
+    assert dict(store.items()) == {
+        f"{number:016x}": record(number, number % 2 == 0 or number == 5)
+        for number in range(100)}
+    store.close()
+
+
+def test_torn_log_batch_is_dropped(save_file):
+    store = open_log_store(save_file)
+    store["0000000000000001"] = record(1, False)
+    store.close()
+    with open(f"{save_file}.log", 'ab') as log:
+        log.write(b"\x80\x05torn")
+    store = open_log_store(save_file)
+    assert len(store) == 1
+    store["0000000000000002"] = record(2, False)
+    store.close()
+    store = open_log_store(save_file)
+    assert len(store) == 2
+    store.close()
+
+
+def test_recovers_from_a_compaction_that_died(save_file):
+    store = open_log_store(save_file)
+    for number in range(20):
+        store[f"{number:016x}"] = record(number, number < 10)
+    store.compact()
+    store.close()
+    # Died after writing the cold file, before removing the old log: the
+    # old log holds records that are cold already.
+    store = open_log_store(save_file)
+    store["0000000000000000"] = record(0, True)
+    store.flush()
+    os.replace(f"{save_file}.log", f"{save_file}.log.old")
+    store.close()
+    # Died while appending to the cold file, before indexing the records.
+    with open(f"{save_file}.done", 'ab') as cold:
+        cold.write(b"unindexed")
+    store = open_log_store(save_file)
+    assert not os.path.exists(f"{save_file}.log.old")
+    assert store.cold_count == 10
+    assert "0000000000000000" not in store.data
+    assert len(store) == 20
+    assert store["0000000000000000"] == record(0, True)
+    store.close()
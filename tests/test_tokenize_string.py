@@ -0,0 +1,55 @@
+from io import StringIO
+
+import pytest
+
+from benchmarks.tokenize_benchmark import reference_tokenize, synthetic_corpus
+from utils.tokenize_string import tokenize, tokenize_many, tokenize_stream
+
+EDGE_CASES = [
+    "",
+    " \t\n\r ",
+    "Hello, World!",
+    "abc123def 456",
+    "don't stop-me now_please",
+    # non ascii letters and digits are delimiters
+    "café naïve straße",
+    "ｆｕｌｌ１２３ width",
+    "中文abc中文",
+    "emoji\U0001f600between",
+    # the kelvin sign and dotted capital I lowercase to ascii letters
+    "Kelvin",
+    "İstanbul",
+    "AKBİC",
+    # non breaking, thin and ideographic spaces
+    "a b c　d",
+    "trailing token",
+    "123",
+]
+
+
+@pytest.mark.parametrize("text", EDGE_CASES)
+def test_tokenize_matches_reference(text):
+    assert tokenize(text) == reference_tokenize(text)
+
+
+def test_tokenize_synthetic_corpus():
+    for line in synthetic_corpus(2000):
+        assert tokenize(line) == reference_tokenize(line), line
+
+
+def test_tokenize_many():
+    lines = EDGE_CASES + synthetic_corpus(200, seed=1)
+    assert tokenize_many(lines) == [reference_tokenize(line) for line in lines]
+
+
+def test_tokenize_many_empty():
+    assert tokenize_many([]) == []
+
+
+def test_tokenize_stream():
+    text = "\n".join(EDGE_CASES + synthetic_corpus(200, seed=2))
+    assert list(tokenize_stream(StringIO(text))) == reference_tokenize(text)
+
+
+def test_tokenize_stream_newline_is_a_delimiter():
+    assert list(tokenize_stream(StringIO("ab\ncd"))) == ["ab", "cd"]
@@ -0,0 +1,45 @@
+import pytest
+
+from benchmarks.url_filter_benchmark import reference_is_valid, synthetic_corpus
+from utils.url_filter import URL_FILTER
+
+EDGE_CASES = [
+    "http://www.ics.uci.edu/",
+    "https://www.ics.uci.edu/~eppstein/pubs",
+    "http://www.ics.uci.edu:8080/page.html",
+    # a fully qualified host ends in a dot
+    "http://www.ics.uci.edu./people",
+    # the original Z never matched, paths are lowercased first
+    "http://www.ics.uci.edu/archive.z",
+    "http://www.ics.uci.edu/archive.Z",
+    "http://www.ics.uci.edu/photo.JPEG",
+    "http://www.ics.uci.edu/photo.tif",
+    "http://www.ics.uci.edu/page.html;jsessionid=1.pdf",
+    "http://www.ics.uci.edu/a.b/c",
+    "http://www.ics.uci.edu/files/x",
+    "http://www.ics.uci.edu/wp/attachment/1",
+    "http://www.ics.uci.edu/api?format=json",
+    "http://www.ics.uci.edu/mailto:someone",
+    "http://ics.uci.edu/",
+    "http://www.uci.edu/",
+    "ftp://www.ics.uci.edu/",
+]
+
+
+@pytest.mark.parametrize("url", EDGE_CASES)
+def test_classify_matches_reference(url):
+    assert URL_FILTER.classify(url)[0] == reference_is_valid(url)
+
+
+def test_classify_synthetic_corpus():
+    for url in synthetic_corpus(5000):
+        assert URL_FILTER.classify(url)[0] == reference_is_valid(url), url
+
+
+@pytest.mark.parametrize("url, accepted", [
+    # the host is matched, not a prefix of the netloc
+    ("http://www.ics.uci.edu.evil.com/", False),
+    ("http://WWW.ICS.UCI.EDU/", True),
+])
+def test_domain_check_uses_the_host(url, accepted):
+    assert URL_FILTER.classify(url)[0] is accepted
@@ -1,35 +1,201 @@
+import atexit
+import itertools
 import os
 import logging
-from hashlib import sha256
-from urllib.parse import urlparse
+import queue
+from hashlib import blake2b
+from logging.handlers import QueueHandler, QueueListener
+from urllib.parse import urlparse, urlsplit, urlunsplit
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+LOG_MODES = ("sync", "async")
+
+_log_settings = {"mode": "sync", "level": logging.INFO, "skip_log_every": 1}
+_loggers = dict()         # logger name -> log file name, for get_logger loggers
+_file_handlers = dict()   # log file name -> FileHandler, shared by its loggers
+_queue_handlers = dict()  # log file name -> QueueHandler, in async mode
+_stream_handler = None
+_queue_listener = None
+_skip_counter = itertools.count()
+
+
+def _file_handler(filename):
+    if filename not in _file_handlers:
+        if not os.path.exists("Logs"):
+            os.makedirs("Logs")
+        fh = logging.FileHandler(f"Logs/{filename}.log")
+        fh.setLevel(logging.DEBUG)
+        fh.setFormatter(logging.Formatter(LOG_FORMAT))
+        _file_handlers[filename] = fh
+    return _file_handlers[filename]
+
+
+def _console_handler():
+    global _stream_handler
+    if _stream_handler is None:
+        _stream_handler = logging.StreamHandler()
+        _stream_handler.setLevel(logging.INFO)
+        _stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return _stream_handler
+
+
+class _FileRouter(logging.Handler):
+    ''' Listener side of async mode: writes each record to its file. '''
+
+    def emit(self, record):
+        _file_handler(record.log_file).handle(record)
+
+
+class _QueueHandler(QueueHandler):
+    ''' Logging thread side of async mode. '''
+
+    def prepare(self, record):
+        # The records stay in this process, so formatting them can be left
+        # to the listener thread too.
+        return record
+
+
+def _queue_handler(filename):
+    if filename not in _queue_handlers:
+        handler = _QueueHandler(_queue_listener.queue)
+
+        def tag(record):
+            record.log_file = filename
+            return True
+        handler.addFilter(tag)
+        _queue_handlers[filename] = handler
+    return _queue_handlers[filename]
+
+
+def _install(logger, filename):
+    logger.setLevel(_log_settings["level"])
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    if _queue_listener is not None:
+        logger.addHandler(_queue_handler(filename))
+    else:
+        logger.addHandler(_file_handler(filename))
+        logger.addHandler(_console_handler())
+
 
 def get_logger(name, filename=None):
+    ''' Logger writing to Logs/<filename or name>.log and the console.
+    Calling it again for the same name does not add more handlers. '''
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-    if not os.path.exists("Logs"):
-        os.makedirs("Logs")
-    fh = logging.FileHandler(f"Logs/{filename if filename else name}.log")
-    fh.setLevel(logging.DEBUG)
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.INFO)
-    formatter = logging.Formatter(
-       "%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    fh.setFormatter(formatter)
-    ch.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    _loggers[name] = filename if filename else name
+    _install(logger, _loggers[name])
     return logger
 
 
-def get_urlhash(url):
+def configure_logging(mode="sync", level="INFO", skip_log_every=1):
+    ''' Sets up the loggers made by get_logger, before and after this call.
+
+    mode: "sync" writes records from the logging thread, "async" only puts
+    them on a queue that a background thread writes out.
+    level: the minimum level logged.
+    skip_log_every: should_log_skip() is True once every that many calls,
+    0 means never. '''
+    global _queue_listener
+    assert mode in LOG_MODES, f"Log mode should be one of {LOG_MODES}"
+    stop_logging()
+    _log_settings.update(
+        mode=mode, level=logging.getLevelName(level.upper()),
+        skip_log_every=skip_log_every)
+    if mode == "async":
+        _queue_listener = QueueListener(
+            queue.SimpleQueue(), _FileRouter(), _console_handler(),
+            respect_handler_level=True)
+        _queue_listener.start()
+    for name, filename in _loggers.items():
+        _install(logging.getLogger(name), filename)
+
+
+def stop_logging():
+    ''' Writes out the queued records and goes back to sync mode. '''
+    global _queue_listener
+    if _queue_listener is None:
+        return
+    listener, _queue_listener = _queue_listener, None
+    _queue_handlers.clear()
+    for name, filename in _loggers.items():
+        _install(logging.getLogger(name), filename)
+    listener.stop()
+
+
+atexit.register(stop_logging)
+
+
+def should_log_skip():
+    ''' Whether this skipped link gets its own log line (skip reasons are
+    always counted in crawler.metrics). '''
+    every = _log_settings["skip_log_every"]
+    return every > 0 and next(_skip_counter) % every == 0
+
+
+def get_urlkey(url):
+    ''' 64 bit integer key of a (normalized) url. '''
     parsed = urlparse(url)
     # everything other than scheme.
-    return sha256(
+    return int.from_bytes(blake2b(
         f"{parsed.netloc}/{parsed.path}/{parsed.params}/"
-        f"{parsed.query}/{parsed.fragment}".encode("utf-8")).hexdigest()
+        f"{parsed.query}/{parsed.fragment}".encode("utf-8"),
+        digest_size=8).digest(), "big")
+
+def get_urlhash(url):
+    return f"{get_urlkey(url):016x}"
+
+
+DEFAULT_PORTS = {"http": "80", "https": "443"}
+# Query parameters that only track where a visitor came from
+TRACKING_PARAMS = frozenset([
+    "fbclid", "gclid", "msclkid", "mc_cid", "mc_eid", "_ga", "_hsenc", "_hsmi"])
+# Last path segments that are the same page as their directory
+INDEX_PAGES = frozenset(["index.html", "index.htm"])
+
+def _remove_dot_segments(path):
+    ''' RFC 3986 section 5.2.4 '''
+    segments = path.split("/")
+    resolved = []
+    for segment in segments:
+        if segment == "..":
+            if len(resolved) > 1:
+                resolved.pop()
+        elif segment != ".":
+            resolved.append(segment)
+    if segments[-1] in (".", ".."):
+        # a/b/.. is the directory a/
+        resolved.append("")
+    return "/".join(resolved)
+
+def _is_tracking(param):
+    key = param.partition("=")[0].lower()
+    return key.startswith("utm_") or key in TRACKING_PARAMS
 
 def normalize(url):
-    if url.endswith("/"):
+    ''' Canonical form of url: lowercase scheme and host, no default port,
+    no dot segments, index page or trailing slash, sorted query parameters
+    without tracking parameters, and no fragment. '''
+    try:
+        parsed = urlsplit(url)
+    except ValueError:
         return url.rstrip("/")
-    return url
+    scheme = parsed.scheme.lower()
+    netloc = parsed.netloc
+    if netloc:
+        userinfo, at, hostport = netloc.rpartition("@")
+        # the host of an IPv6 address is in brackets and contains colons
+        bracket = hostport.rfind("]") + 1
+        host, colon, port = hostport[bracket:].partition(":")
+        host = hostport[:bracket] + host
+        if port == DEFAULT_PORTS.get(scheme):
+            colon = port = ""
+        netloc = f"{userinfo}{at}{host.lower()}{colon}{port}"
+    path = _remove_dot_segments(parsed.path) if "." in parsed.path else parsed.path
+    head, slash, last = path.rpartition("/")
+    if last.lower() in INDEX_PAGES:
+        path = head + slash
+    path = path.rstrip("/")
+    query = "&".join(sorted(
+        param for param in parsed.query.split("&")
+        if param and not _is_tracking(param)))
+    return urlunsplit((scheme, netloc, path, query, ""))
@@ -1,18 +1,15 @@
+from collections import Counter
 from typing import Set
 import re
 
-def calendar_trap_check(base_url: str, urls: Set) -> int:
-    number_pat = re.compile("[^a-zA-Z|\W]+([0-9]+)*\W?")
-    base_stripped = re.sub(number_pat, "", base_url)
-    calender_matches = 0
-    for parent in urls:
-        parent_stripped = re.sub(number_pat, "", parent)
-        if parent_stripped == base_stripped:
-            calender_matches += 1
-    return calender_matches
-    
-
-
+NUMBER_PATTERN = re.compile(r"[^a-zA-Z|\W]+([0-9]+)*\W?")
 
+def strip_numbers(url: str) -> str:
+    return NUMBER_PATTERN.sub("", url)
 
+def calendar_trap_counts(urls: Set) -> Counter:
+    """Number of urls per stripped form, computed once so each link is then an O(1) lookup"""
+    return Counter(strip_numbers(url) for url in urls)
 
+def calendar_trap_check(base_url: str, urls: Set) -> int:
+    return calendar_trap_counts(urls)[strip_numbers(base_url)]
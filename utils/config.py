@@ -1,3 +1,4 @@
+import os
 import re
 
 
@@ -8,14 +9,84 @@ class Config(object):
         assert self.user_agent != "DEFAULT AGENT", "Set useragent in config.ini"
         assert re.match(r"^[a-zA-Z0-9_ ,]+$", self.user_agent), "User agent should not have any special characters outside '_', ',' and 'space'"
         self.threads_count = int(config["LOCAL PROPERTIES"]["THREADCOUNT"])
+        self.crawler_mode = config["LOCAL PROPERTIES"].get("MODE", "threaded").strip()
+        assert self.crawler_mode in {"threaded", "pipelined"}, "MODE should be 'threaded' or 'pipelined'"
+        self.parse_processes = int(
+            config["LOCAL PROPERTIES"].get("PARSE_PROCESSES", "0")) or os.cpu_count()
         self.save_file = config["LOCAL PROPERTIES"]["SAVE"]
+        self.store = config["LOCAL PROPERTIES"].get("STORE", "log").strip()
+        assert self.store in {"log", "shelve"}, "STORE should be 'log' or 'shelve'"
+        self.store_flush_interval = float(
+            config["LOCAL PROPERTIES"].get("STORE_FLUSH_INTERVAL", "1.0"))
+        self.seen_set = config["LOCAL PROPERTIES"].get("SEEN_SET", "memory").strip()
+        assert self.seen_set in {"memory", "bloom"}, "SEEN_SET should be 'memory' or 'bloom'"
+        self.seen_capacity = int(
+            config["LOCAL PROPERTIES"].get("SEEN_CAPACITY", "10000000"))
         self.url_file = config["LOCAL PROPERTIES"]["URL_COUNT"]
         self.word_file = config["LOCAL PROPERTIES"]["WORDS"]
+        self.report_flush_interval = float(
+            config["LOCAL PROPERTIES"].get("REPORT_FLUSH_INTERVAL", "5.0"))
+        self.metrics_interval = float(
+            config["LOCAL PROPERTIES"].get("METRICS_INTERVAL", "30"))
+        self.metrics_file = config["LOCAL PROPERTIES"].get("METRICS_FILE", "").strip()
+        self.metrics_port = int(config["LOCAL PROPERTIES"].get("METRICS_PORT", "0"))
+        self.log_mode = config["LOCAL PROPERTIES"].get("LOG_MODE", "sync").strip()
+        assert self.log_mode in {"sync", "async"}, "LOG_MODE should be 'sync' or 'async'"
+        self.log_level = config["LOCAL PROPERTIES"].get("LOG_LEVEL", "INFO").strip()
+        self.skip_log_every = int(config["LOCAL PROPERTIES"].get("SKIP_LOG_EVERY", "1"))
+
+        # host:port of the peer endpoint of every node of a distributed
+        # crawl, in node id order. Empty for a single crawler process.
+        self.nodes = [
+            (host, int(port)) for host, _, port in (
+                node.strip().rpartition(":")
+                for node in config["LOCAL PROPERTIES"].get("NODES", "").split(",")
+                if node.strip())]
+        self.node_id = int(config["LOCAL PROPERTIES"].get("NODE_ID", "0"))
+        assert not self.nodes or 0 <= self.node_id < len(self.nodes), "NODE_ID should be an index in NODES"
+        self.forward_batch = int(config["LOCAL PROPERTIES"].get("FORWARD_BATCH", "500"))
+        self.forward_interval = float(
+            config["LOCAL PROPERTIES"].get("FORWARD_INTERVAL", "0.5"))
 
         self.host = config["CONNECTION"]["HOST"]
         self.port = int(config["CONNECTION"]["PORT"])
+        self.download_engine = config["CONNECTION"].get("ENGINE", "pooled").strip()
+        assert self.download_engine in {"pooled", "simple"}, "ENGINE should be 'pooled' or 'simple'"
+        self.download_concurrency = int(config["CONNECTION"].get("CONCURRENCY", "8"))
+        timeout = float(config["CONNECTION"].get("TIMEOUT", "0"))
+        self.download_timeout = timeout if timeout > 0 else None
+        self.response_cache = config["CONNECTION"].get("RESPONSE_CACHE", "off").strip()
+        assert self.response_cache in {"off", "record", "replay"}, "RESPONSE_CACHE should be 'off', 'record' or 'replay'"
+        self.response_cache_dir = config["CONNECTION"].get("RESPONSE_CACHE_DIR", "response_cache").strip()
+        self.max_response_size = int(config["CONNECTION"].get("MAX_RESPONSE_SIZE", "10485760"))
 
         self.seed_urls = config["CRAWLER"]["SEEDURL"].split(",")
         self.time_delay = float(config["CRAWLER"]["POLITENESS"])
+        # Per host rate control, see crawler/scheduler.py
+        self.max_delay = float(config["CRAWLER"].get("MAX_DELAY", "60"))
+        self.latency_factor = float(config["CRAWLER"].get("LATENCY_FACTOR", "1.0"))
+        self.failure_threshold = int(config["CRAWLER"].get("FAILURE_THRESHOLD", "5"))
+        self.circuit_cooldown = float(config["CRAWLER"].get("CIRCUIT_COOLDOWN", "30"))
+        self.max_probes = int(config["CRAWLER"].get("MAX_PROBES", "4"))
+        # "fifo" serves each host's urls in discovery order, "priority" the
+        # best scored first (see crawler/priority.py)
+        self.frontier_order = config["CRAWLER"].get("FRONTIER_ORDER", "fifo").strip()
+        assert self.frontier_order in {"fifo", "priority"}, "FRONTIER_ORDER should be 'fifo' or 'priority'"
+        self.scorer = config["CRAWLER"].get("SCORER", "content").strip()
+        assert self.scorer in {"content", "breadth_first"}, "SCORER should be 'content' or 'breadth_first'"
+        # Urls per (host, path template) before the rest are treated as a
+        # trap, 0 turns the check off (see utils/path_template.py)
+        self.trap_budget = int(config["CRAWLER"].get("TRAP_BUDGET", "300"))
+        # robots.txt of every host is fetched and obeyed, and its sitemaps
+        # seed the frontier with up to SITEMAP_URLS urls (0 for none)
+        self.robots_txt = config["CRAWLER"].get("ROBOTS_TXT", "on").strip()
+        assert self.robots_txt in {"on", "off"}, "ROBOTS_TXT should be 'on' or 'off'"
+        self.robots_ttl = float(config["CRAWLER"].get("ROBOTS_TTL", "86400"))
+        self.sitemap_urls = int(config["CRAWLER"].get("SITEMAP_URLS", "50000"))
+        # html.parser or lxml, falls back to html.parser if lxml is missing
+        self.parser = config["CRAWLER"].get("PARSER", "html.parser").strip()
+        # Max simhash bits between near duplicate pages, -1 turns the check off
+        self.near_duplicate_distance = int(
+            config["CRAWLER"].get("NEAR_DUPLICATE_DISTANCE", "3"))
 
         self.cache_server = None
\ No newline at end of file
@@ -1,17 +1,59 @@
 import requests
 import cbor
 import time
+from threading import Lock
+
+from requests.adapters import HTTPAdapter
 
 from utils.response import Response
+from utils.response_cache import get_response_cache
 
-def download(url, config, logger=None):
-    host, port = config.cache_server
-    resp = requests.get(
-        f"http://{host}:{port}/",
-        params=[("q", f"{url}"), ("u", f"{config.user_agent}")])
+# Status used when the cache server could not be reached at all (timeout,
+# refused connection...), next to the cache server's own 600-606 codes.
+DOWNLOAD_ERROR_STATUS = 608
+# Status used in replay mode for urls that are not in the response cache.
+CACHE_MISS_STATUS = 609
+# Status used for responses larger than the configured maximum, which are
+# not read past that size.
+TOO_LARGE_STATUS = 610
+
+
+def _read_body(resp, max_size):
+    ''' The body of a streamed resp, or None (and the connection dropped)
+    as soon as it is known to be larger than max_size bytes (0 means no
+    limit). Returns (body, bytes seen). '''
+    length = int(resp.headers.get("Content-Length") or 0)
+    if max_size and length > max_size:
+        resp.close()
+        return None, length
+    chunks = list()
+    size = 0
+    for chunk in resp.iter_content(1 << 16):
+        size += len(chunk)
+        if max_size and size > max_size:
+            resp.close()
+            return None, max(size, length)
+        chunks.append(chunk)
+    return b"".join(chunks), size
+
+
+def _too_large(url, size, logger):
+    if logger:
+        logger.info(f"Skipped {url}: response of {size} bytes is too large.")
+    return Response({
+        "error": f"Response of {size} bytes is too large.",
+        "status": TOO_LARGE_STATUS,
+        "url": url,
+        "size": size})
+
+
+def _parse(resp, body, url, logger, cache=None):
     try:
-        if resp and resp.content:
-            return Response(cbor.loads(resp.content))
+        if resp and body:
+            response = Response(cbor.loads(body))
+            if cache is not None:
+                cache.put(url, body)
+            return response
     except (EOFError, ValueError) as e:
         pass
     logger.error(f"Spacetime Response error {resp} with url {url}.")
@@ -19,3 +61,105 @@ def download(url, config, logger=None):
         "error": f"Spacetime Response error {resp} with url {url}.",
         "status": resp.status_code,
         "url": url})
+
+
+def _failed(url, error, logger):
+    logger.error(f"Could not reach the cache server for {url}: {error}.")
+    return Response({
+        "error": f"Could not reach the cache server for {url}: {error}.",
+        "status": DOWNLOAD_ERROR_STATUS,
+        "url": url})
+
+
+class PooledDownloader(object):
+    ''' Downloads through one requests.Session with a pool of keep-alive
+    connections to the cache server, so fetches do not pay for a new TCP
+    connection each time. At most `concurrency` requests are in flight at
+    once, any extra caller waits for a free connection. '''
+
+    def __init__(self, cache_server, user_agent, concurrency=8, timeout=None,
+                 response_cache=None, max_size=0):
+        host, port = cache_server
+        self.endpoint = f"http://{host}:{port}/"
+        self.user_agent = user_agent
+        self.timeout = timeout
+        # Responses larger than this many bytes are dropped, 0 means no limit
+        self.max_size = max_size
+        # Every parsed response is recorded in it, if given.
+        self.response_cache = response_cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1, pool_maxsize=concurrency, pool_block=True)
+        self.session.mount("http://", adapter)
+
+    def download(self, url, logger=None):
+        try:
+            resp = self.session.get(
+                self.endpoint,
+                params=[("q", f"{url}"), ("u", f"{self.user_agent}")],
+                timeout=self.timeout, stream=True)
+            body, size = _read_body(resp, self.max_size)
+        except requests.RequestException as e:
+            return _failed(url, e, logger)
+        if body is None:
+            return _too_large(url, size, logger)
+        return _parse(resp, body, url, logger, self.response_cache)
+
+    def close(self):
+        self.session.close()
+
+
+_downloaders = dict()
+_downloaders_lock = Lock()
+
+
+def get_downloader(config):
+    ''' One shared PooledDownloader per cache server. '''
+    key = (tuple(config.cache_server), config.user_agent)
+    with _downloaders_lock:
+        if key not in _downloaders:
+            _downloaders[key] = PooledDownloader(
+                config.cache_server, config.user_agent,
+                config.download_concurrency, config.download_timeout,
+                _recording_cache(config), config.max_response_size)
+        return _downloaders[key]
+
+
+def _recording_cache(config):
+    if config.response_cache == "record":
+        return get_response_cache(config)
+    return None
+
+
+def replay(url, config, logger=None):
+    ''' The response recorded for url, without any network I/O. '''
+    body = get_response_cache(config).get(url)
+    if body is None:
+        if logger:
+            logger.error(f"{url} is not in the response cache.")
+        return Response({
+            "error": f"{url} is not in the response cache.",
+            "status": CACHE_MISS_STATUS,
+            "url": url})
+    if config.max_response_size and len(body) > config.max_response_size:
+        return _too_large(url, len(body), logger)
+    return Response(cbor.loads(body))
+
+
+def download(url, config, logger=None):
+    if config.response_cache == "replay":
+        return replay(url, config, logger)
+    if config.download_engine == "pooled":
+        return get_downloader(config).download(url, logger)
+    host, port = config.cache_server
+    try:
+        resp = requests.get(
+            f"http://{host}:{port}/",
+            params=[("q", f"{url}"), ("u", f"{config.user_agent}")],
+            timeout=config.download_timeout, stream=True)
+        body, size = _read_body(resp, config.max_response_size)
+    except requests.RequestException as e:
+        return _failed(url, e, logger)
+    if body is None:
+        return _too_large(url, size, logger)
+    return _parse(resp, body, url, logger, _recording_cache(config))
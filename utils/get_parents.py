@@ -18,14 +18,6 @@ def get_parents(url, frontier, n_parents) -> List:
 def get_parents_set(url, frontier, n_parents) -> set:
     """Gets n parent urls (url it was scraped from) of url
     Uses set instead of list for faster lookup
+    Served from the frontier's in-memory parent index, compute it once per page
     """
-    parents = {url}
-    if not frontier.exists_in_shelf(url):
-        return parents
-    parent = frontier.get_parent(url)
-    i = 0
-    while parent and i < n_parents:
-        parents.add(parent)
-        parent = frontier.get_parent(parent)
-        i+=1
-    return parents
\ No newline at end of file
+    return frontier.get_ancestors(url, n_parents)
\ No newline at end of file
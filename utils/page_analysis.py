@@ -0,0 +1,78 @@
+import time
+
+from bs4 import BeautifulSoup, CData, FeatureNotFound, NavigableString, Tag
+
+from utils.information_value import information_value
+from utils.simhash import simhash
+from utils.tokenize_string import tokenize
+
+# Same string types soup.stripped_strings yields (no comments, doctypes...)
+TEXT_TYPES = (NavigableString, CData)
+
+_parsers = dict()
+
+
+def resolve_parser(name: str) -> str:
+    """Returns name if BeautifulSoup can use that parser, html.parser otherwise"""
+    if name not in _parsers:
+        try:
+            BeautifulSoup("", name)
+            _parsers[name] = name
+        except FeatureNotFound:
+            _parsers[name] = "html.parser"
+    return _parsers[name]
+
+
+class PageAnalysis(object):
+    """Everything the crawler needs to know about a page, from a single parse"""
+
+    def __init__(self, lines, token_count, tag_count, outlinks, parse_seconds=0.0, tokenize_seconds=0.0):
+        self.lines = lines  # one list of tokens per non empty text string
+        self.token_count = token_count
+        self.tag_count = tag_count
+        self.outlinks = outlinks  # raw href values, in page order
+        self.parse_seconds = parse_seconds  # time spent in analyze_page
+        self.tokenize_seconds = tokenize_seconds  # part of it spent tokenizing
+        self._fingerprint = None
+
+    @property
+    def fingerprint(self):
+        """simhash of the tokens for near duplicate detection, computed on first use"""
+        if self._fingerprint is None:
+            self._fingerprint = simhash(self.tokens)
+        return self._fingerprint
+
+    @property
+    def tokens(self):
+        return [token for line in self.lines for token in line]
+
+    @property
+    def information_value(self):
+        return information_value(self)
+
+
+def analyze_page(content, parser: str = "html.parser") -> PageAnalysis:
+    """Parses content once and walks the tree once to collect tokens, tag count and outlinks"""
+    start = time.perf_counter()
+    tokenize_seconds = 0.0
+    soup = BeautifulSoup(content, resolve_parser(parser))
+    lines = []
+    token_count = 0
+    tag_count = 0
+    outlinks = []
+    for node in soup.descendants:
+        if isinstance(node, Tag):
+            tag_count += 1
+            href = node.get("href")
+            if href is not None:
+                outlinks.append(href)
+        elif type(node) in TEXT_TYPES:
+            text = node.strip()
+            if text:
+                tokenize_start = time.perf_counter()
+                tokens = tokenize(text)
+                tokenize_seconds += time.perf_counter() - tokenize_start
+                if tokens:
+                    token_count += len(tokens)
+                    lines.append(tokens)
+    return PageAnalysis(lines, token_count, tag_count, outlinks, time.perf_counter() - start, tokenize_seconds)
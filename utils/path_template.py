@@ -0,0 +1,149 @@
+import os
+import re
+import struct
+from hashlib import blake2b
+from threading import Event, Lock, Thread
+from urllib.parse import parse_qsl, urlsplit
+
+# A snapshot entry: (host, template) key and its url count.
+ENTRY = struct.Struct("<QI")
+# In seconds, how often the counts are written to disk while urls come in.
+SNAPSHOT_INTERVAL = 30.0
+
+# Segments (or parts of segments between ; , and =) that become one symbol
+HASH_PART = re.compile(
+    r"[0-9a-f]{16,}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+# Session ids and tokens in query values: long mixes of letters and digits
+TOKEN_VALUE = re.compile(r"(?=[^0-9]*[0-9])(?=[^a-z]*[a-z])[a-z0-9_.~+/-]{16,}")
+DATE_PART = re.compile(
+    r"(19|20)[0-9]{2}([-_.]?[01]?[0-9]([-_.]?[0-3]?[0-9])?)?"
+    r"|[0-3]?[0-9][-_.][01]?[0-9][-_.](19|20)[0-9]{2}")
+DIGITS = re.compile(r"[0-9]+")
+SEPARATORS = re.compile(r"([;,=])")
+
+
+def _template_part(part: str) -> str:
+    if HASH_PART.fullmatch(part):
+        return "{hash}"
+    if DATE_PART.fullmatch(part):
+        return "{date}"
+    return DIGITS.sub("{n}", part)
+
+
+def _template_segment(segment: str) -> str:
+    return "".join(_template_part(part) for part in SEPARATORS.split(segment))
+
+
+def path_template(url: str) -> str:
+    """The shape of url without its host: path segments and query values
+    with numbers, dates, hashes and ids collapsed into {n}, {date} and
+    {hash}, query parameters sorted by name
+    /events/2026-10-18/?page=3&sid=9f8a... -> /events/{date}/?page={n}&sid={hash}
+    """
+    parsed = urlsplit(url.lower())
+    template = "/".join(
+        _template_segment(segment) for segment in parsed.path.split("/"))
+    if parsed.query:
+        params = sorted(parse_qsl(parsed.query, keep_blank_values=True))
+        template += "?" + "&".join(
+            f"{_template_segment(name)}="
+            f"{'{hash}' if TOKEN_VALUE.fullmatch(value) else _template_segment(value)}"
+            for name, value in params)
+    return template
+
+
+def template_key(url: str) -> int:
+    """64 bit key of the (host, path template) of url"""
+    host = urlsplit(url).netloc.lower()
+    return int.from_bytes(blake2b(
+        f"{host} {path_template(url)}".encode("utf-8"),
+        digest_size=8).digest(), "big")
+
+
+class TrapDetector(object):
+    """Counts the urls admitted per (host, path template) and rejects urls
+    whose template already has `budget` of them: calendars, paging, sorting
+    and session variants all share a template, so they stop after `budget`
+    urls whatever their exact shape. Each check is one hash lookup.
+
+    The counts are a dict of 64 bit template keys, written to `path` as a
+    snapshot of ENTRY records by a background thread every
+    `snapshot_interval` seconds and on close, so a crash only forgets the
+    last few counts and admit() never waits for the disk.
+
+    The first template of each host to run out of budget is logged.
+    """
+
+    def __init__(self, path: str, budget: int, snapshot_interval: float = SNAPSHOT_INTERVAL, logger=None):
+        self.path = path
+        self.budget = budget
+        self.snapshot_interval = snapshot_interval
+        self.logger = logger
+        self.counts = dict()  # template key -> urls admitted
+        self.rejected = 0
+        self.logged_hosts = set()  # hosts with a template over budget logged
+        self.lock = Lock()
+        if os.path.exists(path):
+            with open(path, "rb") as saved:
+                data = saved.read()
+            usable = len(data) - len(data) % ENTRY.size
+            for key, count in ENTRY.iter_unpack(data[:usable]):
+                self.counts[key] = count
+        self.dirty = False
+        self.closed = Event()
+        self.snapshotter = Thread(
+            target=self._snapshot_loop, args=(snapshot_interval,), daemon=True)
+        self.snapshotter.start()
+
+    def __len__(self):
+        return len(self.counts)
+
+    @property
+    def exhausted(self) -> int:
+        """Number of templates that reached their budget"""
+        with self.lock:
+            return sum(1 for count in self.counts.values() if count >= self.budget)
+
+    def admit(self, url: str) -> bool:
+        """Counts url against its template, False if the budget is spent"""
+        key = template_key(url)
+        with self.lock:
+            count = self.counts.get(key, 0)
+            if count >= self.budget:
+                self.rejected += 1
+                host = urlsplit(url).netloc.lower()
+                first = host not in self.logged_hosts
+                self.logged_hosts.add(host)
+            else:
+                self.counts[key] = count + 1
+                self.dirty = True
+                return True
+        if first and self.logger:
+            self.logger.warning(
+                f"Template {path_template(url)} of {host} reached its budget "
+                f"of {self.budget} urls, skipping the rest.")
+        return False
+
+    def _snapshot(self):
+        # Only the counts are copied under the lock, the file is written
+        # without it.
+        with self.lock:
+            if not self.dirty:
+                return
+            counts = list(self.counts.items())
+            self.dirty = False
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "wb") as snapshot:
+            snapshot.write(b"".join(
+                ENTRY.pack(key, min(count, 0xffffffff))
+                for key, count in counts))
+        os.replace(temporary, self.path)
+
+    def _snapshot_loop(self, interval):
+        while not self.closed.wait(interval):
+            self._snapshot()
+
+    def close(self):
+        self.closed.set()
+        self.snapshotter.join()
+        self._snapshot()
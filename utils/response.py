@@ -5,10 +5,19 @@ class Response(object):
         self.url = resp_dict["url"]
         self.status = resp_dict["status"]
         self.error = resp_dict["error"] if "error" in resp_dict else None
-        try:
-            self.raw_response = (
-                pickle.loads(resp_dict["response"])
-                if "response" in resp_dict else
-                None)
-        except TypeError:
-            self.raw_response = None
+        # The pickled requests.Response is only loaded if raw_response is
+        # used, so error statuses and skipped pages never pay for it.
+        self._pickled = resp_dict.get("response")
+        self._raw_response = None
+        self.size = resp_dict.get(
+            "size", len(self._pickled) if self._pickled else 0)
+
+    @property
+    def raw_response(self):
+        if self._pickled is not None:
+            try:
+                self._raw_response = pickle.loads(self._pickled)
+            except TypeError:
+                self._raw_response = None
+            self._pickled = None
+        return self._raw_response
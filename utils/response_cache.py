@@ -0,0 +1,122 @@
+import atexit
+import os
+import struct
+import zlib
+from threading import Lock
+
+from utils import get_urlkey
+
+# An index entry: url key, segment number, offset and length of the record.
+INDEX_ENTRY = struct.Struct("<QIQI")
+SEGMENT_SIZE = 1 << 28
+
+
+class ResponseCache(object):
+    ''' On-disk cache of cache server responses, keyed by url.
+
+    The responses are kept exactly as the cache server sent them (the cbor
+    body), zlib compressed, appended to large segment files in `directory`.
+    `directory/index` is an append-only list of INDEX_ENTRY records pointing
+    into them, loaded into memory on open; the last entry of a url wins.
+    A new segment is started once the current one reaches `segment_size`
+    bytes. Entries whose record did not make it to disk (a crash) are
+    dropped on open. '''
+
+    def __init__(self, directory, segment_size=SEGMENT_SIZE):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.lock = Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.entries = dict()   # url key -> (segment, offset, length)
+        segment_sizes = dict()
+        index_path = os.path.join(directory, "index")
+        if os.path.exists(index_path):
+            with open(index_path, 'rb') as index_file:
+                data = index_file.read()
+            # A torn last entry is ignored.
+            usable = len(data) - len(data) % INDEX_ENTRY.size
+            for key, segment, offset, length in INDEX_ENTRY.iter_unpack(
+                    data[:usable]):
+                if segment not in segment_sizes:
+                    path = self._segment_path(segment)
+                    segment_sizes[segment] = (
+                        os.path.getsize(path) if os.path.exists(path) else 0)
+                if offset + length <= segment_sizes[segment]:
+                    self.entries[key] = (segment, offset, length)
+        self.segment = max(segment_sizes, default=0)
+        self.index = open(index_path, 'ab')
+        self.writer = open(self._segment_path(self.segment), 'ab')
+        self.readers = dict()   # segment -> file
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:06d}")
+
+    def __contains__(self, url):
+        return get_urlkey(url) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, url, body):
+        ''' Records the cache server's body of the response for url. '''
+        record = zlib.compress(body)
+        with self.lock:
+            if self.writer.tell() >= self.segment_size:
+                self.writer.close()
+                self.segment += 1
+                self.writer = open(self._segment_path(self.segment), 'ab')
+            offset = self.writer.tell()
+            self.writer.write(record)
+            key = get_urlkey(url)
+            self.entries[key] = (self.segment, offset, len(record))
+            self.index.write(
+                INDEX_ENTRY.pack(key, self.segment, offset, len(record)))
+
+    def get(self, url):
+        ''' The recorded body for url, or None. '''
+        with self.lock:
+            entry = self.entries.get(get_urlkey(url))
+            if entry is None:
+                return None
+            segment, offset, length = entry
+            if segment == self.segment:
+                # The record may still be in the write buffer.
+                self.writer.flush()
+            reader = self.readers.get(segment)
+            if reader is None:
+                reader = self.readers[segment] = open(
+                    self._segment_path(segment), 'rb')
+            reader.seek(offset)
+            record = reader.read(length)
+        return zlib.decompress(record)
+
+    def flush(self):
+        with self.lock:
+            # Records first, so the index never points past them.
+            self.writer.flush()
+            self.index.flush()
+
+    def close(self):
+        with self.lock:
+            if self.writer.closed:
+                return
+            self.writer.close()
+            self.index.close()
+            for reader in self.readers.values():
+                reader.close()
+
+
+_caches = dict()
+_caches_lock = Lock()
+
+
+def get_response_cache(config):
+    ''' The shared ResponseCache of config, None if the cache is off. '''
+    if config.response_cache == "off":
+        return None
+    with _caches_lock:
+        if config.response_cache_dir not in _caches:
+            cache = ResponseCache(config.response_cache_dir)
+            atexit.register(cache.close)
+            _caches[config.response_cache_dir] = cache
+        return _caches[config.response_cache_dir]
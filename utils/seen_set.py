@@ -0,0 +1,100 @@
+import math
+import os
+import struct
+
+# Header of a saved bloom filter: size in bits, hash count, keys added
+HEADER = struct.Struct("<QQQ")
+
+
+class SeenSet(object):
+    ''' Exact set of 64 bit url keys (see utils.get_urlkey). '''
+
+    # A hit is certain, no need to check the save file
+    exact = True
+
+    def __init__(self):
+        self.keys = set()
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key):
+        self.keys.add(key)
+
+    def save(self, path):
+        ''' Not saved, a resumed crawl finds the keys of the previous runs
+        in the save file. '''
+
+    def restore(self, path):
+        return False
+
+
+class BloomFilter(object):
+    ''' Approximate set of 64 bit url keys in about 10 bits per url. A miss
+    is certain, a hit is wrong with probability `error_rate` and has to be
+    confirmed against the save file. '''
+
+    exact = False
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing on the two halves of the key, which is already a
+        # uniformly distributed hash.
+        low = key & 0xffffffff
+        high = (key >> 32) | 1
+        return ((low + i * high) % self.size for i in range(self.hash_count))
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(
+            bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def save(self, path):
+        ''' Writes the filter to path for the next run to restore. '''
+        with open(f"{path}.tmp", "wb") as saved:
+            saved.write(HEADER.pack(self.size, self.hash_count, self.count))
+            saved.write(self.bits)
+        os.replace(f"{path}.tmp", path)
+
+    def restore(self, path):
+        ''' Loads the filter saved to path, if it has the same size and hash
+        count. Returns True if it did. The file is removed, so a crawl that
+        dies does not leave a filter behind that misses its last keys. '''
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as saved:
+            header = saved.read(HEADER.size)
+            bits = saved.read()
+        os.remove(path)
+        if len(header) != HEADER.size:
+            return False
+        size, hash_count, count = HEADER.unpack(header)
+        if ((size, hash_count) != (self.size, self.hash_count)
+                or len(bits) != len(self.bits)):
+            return False
+        self.bits = bytearray(bits)
+        self.count = count
+        return True
+
+
+def make_seen_set(config):
+    if config.seen_set == "bloom":
+        return BloomFilter(config.seen_capacity)
+    return SeenSet()
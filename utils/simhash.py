@@ -0,0 +1,96 @@
+import os
+from collections import Counter
+from functools import lru_cache
+from hashlib import blake2b
+from threading import Lock
+from typing import Iterable, Optional
+
+# 64 bit fingerprints split into 4 bands of 16 bits: two fingerprints at
+# most 3 bits apart share at least one band, so looking up the bands finds
+# every near duplicate up to that distance.
+BANDS = 4
+BAND_BITS = 16
+MAX_DISTANCE = BANDS - 1
+
+
+@lru_cache(maxsize=1 << 16)
+def _token_hash(token: str) -> bytes:
+    return blake2b(token.encode("utf-8"), digest_size=8).digest()
+
+
+def simhash(tokens: Iterable[str]) -> int:
+    """64 bit SimHash of a token stream, tokens weighted by their frequency"""
+    # Per byte of the token hashes, the total weight of each byte value.
+    # Turning these into per bit weights afterwards costs 8 additions per
+    # token instead of 64.
+    tables = [[0] * 256 for _ in range(8)]
+    total = 0
+    for token, weight in Counter(tokens).items():
+        total += weight
+        for table, value in zip(tables, _token_hash(token)):
+            table[value] += weight
+    fingerprint = 0
+    for byte, table in enumerate(tables):
+        for bit in range(8):
+            mask = 1 << bit
+            ones = sum(weight for value, weight in enumerate(table) if value & mask)
+            if 2 * ones > total:
+                fingerprint |= 1 << (byte * 8 + bit)
+    return fingerprint
+
+
+class NearDuplicateIndex(object):
+    """Fingerprints of the pages crawled so far, banded for lookup
+    Every fingerprint is appended to `path` so the index survives restarts
+    """
+
+    def __init__(self, path: str, max_distance: int = MAX_DISTANCE):
+        assert max_distance <= MAX_DISTANCE, f"Near duplicates are only found up to {MAX_DISTANCE} bits apart"
+        self.path = path
+        self.max_distance = max_distance
+        self.bands = [dict() for _ in range(BANDS)]  # band value -> [(fingerprint, url)]
+        self.count = 0
+        self.pruned_pages = 0
+        self.pruned_outlinks = 0
+        self.lock = Lock()
+        if os.path.exists(path):
+            with open(path, "r") as saved:
+                for line in saved:
+                    fingerprint, _, url = line.rstrip("\n").partition(" ")
+                    self._add(int(fingerprint, 16), url)
+        self.file = open(path, "a")
+
+    def _band_values(self, fingerprint: int):
+        mask = (1 << BAND_BITS) - 1
+        return [(fingerprint >> (band * BAND_BITS)) & mask for band in range(BANDS)]
+
+    def _add(self, fingerprint: int, url: str):
+        for band, value in zip(self.bands, self._band_values(fingerprint)):
+            band.setdefault(value, []).append((fingerprint, url))
+        self.count += 1
+
+    def find(self, fingerprint: int) -> Optional[str]:
+        """Url of a crawled page at most max_distance bits away, or None"""
+        for band, value in zip(self.bands, self._band_values(fingerprint)):
+            for other, url in band.get(value, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return url
+        return None
+
+    def find_or_add(self, url: str, fingerprint: int, outlinks: int = 0) -> Optional[str]:
+        """Returns the url url is a near duplicate of (counting it and its outlinks as pruned),
+        or adds url to the index and returns None
+        """
+        with self.lock:
+            duplicate = self.find(fingerprint)
+            if duplicate is not None:
+                self.pruned_pages += 1
+                self.pruned_outlinks += outlinks
+                return duplicate
+            self._add(fingerprint, url)
+            self.file.write(f"{fingerprint:016x} {url}\n")
+            return None
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -1,29 +1,34 @@
-from typing import List
-from io import StringIO
+from typing import IO, Iterable, Iterator, List
 import re
 
+# A token is a run of ascii letters and digits, anything else is a delimiter.
+# Tokens are lowercased after matching (lowercasing first would turn some
+# non ascii characters, like the kelvin sign, into ascii letters).
+_TOKEN_PATTERN = re.compile(r"[a-zA-Z0-9]+")
+
 
 def tokenize(s: str) -> List[str]:
         """
         Reads in a string and returns a list of the tokens in that string
         """
-        tokens= []
-        with StringIO(s) as stream:  # replaces characters that fail decoding with a valid char
-            current_token = ''
-            #  O(n) for n chars in the string
-            while True:
-                char = ''
-                try:  # catch any decoding errors
-                    char = stream.read(1)
-                except:
-                    continue
-                
-                if re.match("[a-zA-Z0-9]", char):
-                    current_token += char.lower()
-                else:  # encountered a delimeter character
-                    if len(current_token) > 0:
-                        tokens.append(current_token)
-                        current_token = ''
-                    if len(char) == 0:
-                        break
-        return tokens
\ No newline at end of file
+        tokens = _TOKEN_PATTERN.findall(s)
+        if not tokens:
+            return tokens
+        #  one lower() and one split() for the whole string instead of per token
+        return " ".join(tokens).lower().split(" ")
+
+
+def tokenize_many(strings: Iterable[str]) -> List[List[str]]:
+        """
+        Tokenizes every string, returns one list of tokens per string
+        """
+        return [tokenize(s) for s in strings]
+
+
+def tokenize_stream(stream: IO[str]) -> Iterator[str]:
+        """
+        Yields the tokens of a text file object, reading it line by line
+        (a newline is a delimiter so no token spans two lines)
+        """
+        for line in stream:
+            yield from tokenize(line)
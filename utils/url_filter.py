@@ -0,0 +1,112 @@
+import re
+from typing import Iterable, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Paths ending in one of these extensions are not web pages
+EXTENSIONS = frozenset([
+    "css", "js", "bmp", "gif", "jpg", "jpeg", "ico",
+    "png", "tif", "tiff", "mid", "mp2", "mp3", "mp4",
+    "wav", "avi", "mov", "mpg", "mpeg", "ram", "m4v", "mkv", "ogg", "ogv", "pdf", "war",
+    "ps", "eps", "tex", "ppt", "pptx", "doc", "docx", "xls", "xlsx", "names",
+    "data", "dat", "exe", "bz2", "tar", "msi", "bin", "7z", "psd", "dmg", "iso",
+    "epub", "dll", "cnf", "tgz", "sha1", "py", "sql", "conf", "svg", "r", "c",
+    "thmx", "mso", "arff", "rtf", "jar", "csv", "json", "java", "apk", "img", "xml",
+    "rm", "smil", "wmv", "swf", "wma", "zip", "rar", "gz", "txt", "vmdk", "php", "ppsx"])
+# Paths containing one of these are not crawled
+PATH_FRAGMENTS = ("json", "xmlrpc", "mailto", ".php", "attachment/",
+                  "/pdf/", "/wiki/", "/files/")
+# Only subdomains of these are crawled
+ALLOWED_DOMAINS = ("ics.uci.edu", "cs.uci.edu", "informatics.uci.edu", "stat.uci.edu")
+
+# A directory repeated 3 or more times
+REPEATED_PATH = re.compile(r'\/([^\/]+)\/(.+\/)?\1\/(.+\/)?\1')
+# A url ending in a date, like /10/18/2026
+DATE_PATH = re.compile(r'\/?([0-9]{0,2})\/([0-9]{0,2})\/([0-9]{4})($|\/)$')
+
+
+class DomainTrie(object):
+    """Suffix trie over host labels, matches subdomains of the allowed domains"""
+
+    def __init__(self, domains: Iterable[str]):
+        self.root = dict()
+        for domain in domains:
+            node = self.root
+            for label in reversed(domain.lower().split(".")):
+                node = node.setdefault(label, dict())
+            node[None] = True  # end of an allowed domain
+
+    def match(self, host: str) -> bool:
+        """True if host is a strict subdomain of an allowed domain (a fully qualified host may end in a dot)"""
+        labels = host[:-1].split(".") if host.endswith(".") else host.split(".")
+        node = self.root
+        for i in range(len(labels) - 1, 0, -1):
+            node = node.get(labels[i])
+            if node is None:
+                return False
+            if None in node:
+                return True
+        return False
+
+
+def _host(parsed) -> str:
+    """host without user info and port"""
+    return parsed.netloc.rpartition("@")[2].partition(":")[0].lower()
+
+
+class UrlFilter(object):
+    """All the url rules of the crawler, compiled once
+    classify(url) -> (accepted, reason) where reason says which rule rejected the url
+    """
+
+    def __init__(self, domains: Iterable[str] = ALLOWED_DOMAINS):
+        self.domains = DomainTrie(domains)
+
+    def classify(self, url: str) -> Tuple[bool, Optional[str]]:
+        try:
+            parsed = urlsplit(url)
+        except ValueError:
+            return False, "malformed"
+        if parsed.scheme not in ("http", "https"):
+            return False, "scheme"
+        path = parsed.path.lower()
+        # ;params of the last segment are not part of the path (as in urlparse)
+        params = path.find(";", path.rfind("/"))
+        if params != -1:
+            path = path[:params]
+        dot = path.rfind(".")
+        if dot != -1 and path[dot + 1:] in EXTENSIONS:
+            return False, "extension"
+        for fragment in PATH_FRAGMENTS:
+            if fragment in path:
+                return False, "path"
+        if not self.domains.match(_host(parsed)):
+            return False, "domain"
+        return True, None
+
+    def classify_host(self, url: str) -> Tuple[bool, Optional[str]]:
+        """Only the scheme and domain rules of classify, for urls that are not pages (sitemaps)"""
+        try:
+            parsed = urlsplit(url)
+        except ValueError:
+            return False, "malformed"
+        if parsed.scheme not in ("http", "https"):
+            return False, "scheme"
+        if not self.domains.match(_host(parsed)):
+            return False, "domain"
+        return True, None
+
+    def classify_many(self, urls: Iterable[str]) -> List[Tuple[bool, Optional[str]]]:
+        classify = self.classify
+        return [classify(url) for url in urls]
+
+    def trap_reason(self, found_url: str, url: str) -> Optional[str]:
+        """Checks a link found on url against the trap patterns, returns why it is a trap or None"""
+        if REPEATED_PATH.search(found_url):
+            return "Repeated path"
+        if DATE_PATH.search(url) and DATE_PATH.search(found_url):
+            if DATE_PATH.sub("", url) == DATE_PATH.sub("", found_url):
+                return "Found common calendar format"
+        return None
+
+
+URL_FILTER = UrlFilter()